@@ -0,0 +1,221 @@
+import heapq
+import itertools
+import threading
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from typing import List
+from psycopg2 import sql
+import Utility.DBConnector as Connector
+
+# In memory index of who scored with whom, built from Player_Scored_In.
+# Every player keeps a sorted array('i') of the matches they scored in and every match a sorted array('i') of its
+# scorers, so a score costs 4 bytes in each of the two arrays (plus a dict entry and an array header per player and
+# per match). The closeness of a player is counted by merging the scorer arrays of their own matches, which gives
+# the candidates in id order with the number of matches they share.
+#
+#   graph = CoScoringGraph()
+#   graph.load()
+#   Solution.attachCoScoringGraph(graph)    # getClosePlayers is answered from memory from now on
+#   graph.follow(listener)                  # optional, picks up the writes of other processes (a ChangeListener)
+#
+# The Solution writes of this process update an attached graph as soon as they succeed. Writes made anywhere else
+# only reach it through follow, without a listener the graph is only as fresh as its last load.
+
+
+def _insert(values: array, value: int) -> bool:
+    index = bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        return False
+    values.insert(index, value)
+    return True
+
+
+def _remove(values: array, value: int) -> bool:
+    index = bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        del values[index]
+        return True
+    return False
+
+
+class CoScoringGraph:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.player_matches = {}                # player_id -> sorted array of the matches they scored in
+            self.match_players = {}                 # match_id -> sorted array of its scorers, only matches with one
+            self.sorted_players = array("i")        # every player by id
+
+    def load(self, deadline: float = None):
+        # one statement, so the players and the goals come from the same snapshot
+        conn = None
+        try:
+            conn = Connector.DBConnector(deadline=deadline)
+            _, result = conn.execute("SELECT P.player_id, S.match_id"
+                                     " FROM Players P LEFT OUTER JOIN Player_Scored_In S USING (player_id)")
+            rows = result.tuples("player_id", "match_id")
+        finally:
+            if conn is not None:
+                conn.close()
+        # the arrays are built sorted at once, inserting the rows one by one would move them over and over
+        player_matches, match_players = defaultdict(list), defaultdict(list)
+        for player_id, match_id in rows:
+            scored = player_matches[player_id]
+            if match_id is not None:
+                scored.append(match_id)
+                match_players[match_id].append(player_id)
+        with self.lock:
+            self.player_matches = {player_id: array("i", sorted(matches))
+                                   for player_id, matches in player_matches.items()}
+            self.match_players = {match_id: array("i", sorted(players)) for match_id, players in match_players.items()}
+            self.sorted_players = array("i", sorted(player_matches))
+
+    def addPlayer(self, player_id: int):
+        with self.lock:
+            if player_id in self.player_matches:
+                return
+            self.player_matches[player_id] = array("i")
+            _insert(self.sorted_players, player_id)
+
+    def removePlayer(self, player_id: int):
+        # the player's goals go with them, as Player_Scored_In cascades
+        with self.lock:
+            if player_id not in self.player_matches:
+                return
+            for match_id in self.player_matches.pop(player_id):
+                self.__dropScorer(match_id, player_id)
+            _remove(self.sorted_players, player_id)
+
+    def addScore(self, player_id: int, match_id: int):
+        with self.lock:
+            self.addPlayer(player_id)
+            if _insert(self.player_matches[player_id], match_id):
+                _insert(self.match_players.setdefault(match_id, array("i")), player_id)
+
+    def removeScore(self, player_id: int, match_id: int):
+        with self.lock:
+            if player_id in self.player_matches and _remove(self.player_matches[player_id], match_id):
+                self.__dropScorer(match_id, player_id)
+
+    def removeMatch(self, match_id: int):
+        with self.lock:
+            for player_id in self.match_players.pop(match_id, ()):
+                _remove(self.player_matches[player_id], match_id)
+
+    def __dropScorer(self, match_id: int, player_id: int):
+        # a match without scorers is forgotten
+        scorers = self.match_players.get(match_id)
+        if scorers is not None:
+            _remove(scorers, player_id)
+            if not scorers:
+                del self.match_players[match_id]
+
+    def closePlayers(self, player_id: int, limit: int = None) -> List[int]:
+        # the same rule as getClosePlayers: another player is close if they scored in at least half of the matches
+        # player_id scored in, so everyone is close to a player who never scored. The first limit of them by id, all
+        # of them when limit is None
+        with self.lock:
+            matches = self.player_matches.get(player_id)
+            if not matches:
+                players = self.sorted_players
+                end = len(players) if limit is None else min(limit, len(players))
+                index = bisect_left(players, player_id)
+                if index < end and players[index] == player_id:
+                    # player_id is skipped, one more makes up for it
+                    end = min(end + 1, len(players))
+                return [other for other in players[:end] if other != player_id]
+            # only a player sharing a match can reach half, so the candidates are the scorers of these matches. The
+            # merged scorer arrays list a candidate once per shared match, in id order
+            close = []
+            merged = heapq.merge(*(self.match_players[match_id] for match_id in matches))
+            for other, shared in itertools.groupby(merged):
+                if limit is not None and len(close) >= limit:
+                    break
+                if other != player_id and 2 * sum(1 for _ in shared) >= len(matches):
+                    close.append(other)
+            return close
+
+    def playersWithinHops(self, player_id: int, hops: int) -> List[int]:
+        # every player reachable from player_id through at most hops steps of closeness
+        with self.lock:
+            seen = {player_id}
+            frontier = [player_id]
+            for _ in range(hops):
+                reached = []
+                for current in frontier:
+                    for other in self.closePlayers(current):
+                        if other not in seen:
+                            seen.add(other)
+                            reached.append(other)
+                if not reached:
+                    break
+                frontier = reached
+            seen.discard(player_id)
+            return sorted(seen)
+
+    def clusters(self) -> List[List[int]]:
+        # the connected groups of players linked by scoring in the same match, players who never scored are left out
+        with self.lock:
+            seen_players, seen_matches = set(), set()
+            clusters = []
+            for first, matches in self.player_matches.items():
+                if not matches or first in seen_players:
+                    continue
+                seen_players.add(first)
+                cluster = [first]
+                frontier = [first]
+                while frontier:
+                    reached = []
+                    for player_id in frontier:
+                        for match_id in self.player_matches[player_id]:
+                            if match_id in seen_matches:
+                                continue
+                            seen_matches.add(match_id)
+                            for other in self.match_players[match_id]:
+                                if other not in seen_players:
+                                    seen_players.add(other)
+                                    reached.append(other)
+                    cluster += reached
+                    frontier = reached
+                clusters.append(sorted(cluster))
+            return sorted(clusters)
+
+    def follow(self, listener: Connector.ChangeListener):
+        listener.register(self.onChange)
+
+    def onChange(self, table: str, keys: dict):
+        # a notification does not say what happened to the row, so the row is read again and the graph set to match.
+        # This is also harmless for the writes this process already applied
+        if table is None:
+            self.load()
+        elif table == "players":
+            if self.__exists("Players", player_id=keys["player_id"]):
+                self.addPlayer(keys["player_id"])
+            else:
+                self.removePlayer(keys["player_id"])
+        elif table == "matches":
+            if not self.__exists("Matches", match_id=keys["match_id"]):
+                self.removeMatch(keys["match_id"])
+        elif table == "player_scored_in":
+            if self.__exists("Player_Scored_In", player_id=keys["player_id"], match_id=keys["match_id"]):
+                self.addScore(keys["player_id"], keys["match_id"])
+            else:
+                self.removeScore(keys["player_id"], keys["match_id"])
+
+    @staticmethod
+    def __exists(table: str, **keys) -> bool:
+        conn = None
+        try:
+            conn = Connector.DBConnector()
+            condition = sql.SQL(" AND ").join(sql.SQL("{0} = {1}").format(sql.Identifier(column), sql.Literal(value))
+                                              for column, value in keys.items())
+            rows_effected, _ = conn.execute(sql.SQL("SELECT 1 FROM {table} WHERE {condition}")
+                                            .format(table=sql.Identifier(table.lower()), condition=condition))
+            return rows_effected != 0
+        finally:
+            if conn is not None:
+                conn.close()
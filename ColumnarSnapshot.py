@@ -0,0 +1,206 @@
+import argparse
+import struct
+import sys
+import time
+from array import array
+from typing import Dict, List
+import Utility.DBConnector as Connector
+import Solution
+from Dataset import generateLeague
+
+# Whole table snapshots for offline analytics, loaded as typed column arrays instead of rows.
+# The tables are read with COPY ... TO STDOUT (FORMAT binary). Every column is selected as a NOT NULL INTEGER, so
+# every row of the stream has the same size and a column is cut out of the stream with a few strided slices, without
+# looking at the rows one by one. The stream is decoded as it arrives, so it is never held whole.
+#
+#   snapshot = loadSnapshot()
+#   snapshot["players"]["height"]       # array('i'), one entry per player
+#   len(snapshot["scores"])             # number of rows
+#
+#   python ColumnarSnapshot.py --scale 20000    # compare with reading the same tables through execute
+
+# table -> (query, column names). preferred_foot is a text column, it is loaded as 1 for "Left" and 0 for "Right", and
+# a stadium of no team has team_id 0 (team ids are positive)
+SNAPSHOT_TABLES = {
+    "teams": ("SELECT team_id FROM Teams", ["team_id"]),
+    "stadiums": ("SELECT stadium_id, capacity, COALESCE(team_id, 0) AS team_id FROM Stadiums",
+                 ["stadium_id", "capacity", "team_id"]),
+    "matches": ("SELECT match_id, first_team_id, second_team_id FROM Matches",
+                ["match_id", "first_team_id", "second_team_id"]),
+    "players": ("SELECT player_id, team_id, age, height, (preferred_foot = 'Left')::INTEGER AS left_footed"
+                " FROM Players",
+                ["player_id", "team_id", "age", "height", "left_footed"]),
+    "scores": ("SELECT player_id, match_id, num_of_goals FROM Player_Scored_In",
+               ["player_id", "match_id", "num_of_goals"]),
+    "attendance": ("SELECT match_id, stadium_id, audience_number FROM Played_In",
+                   ["match_id", "stadium_id", "audience_number"]),
+}
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_TRAILER = b"\xff\xff"
+# how much of a COPY stream is gathered before its rows are decoded
+COPY_CHUNK_BYTES = 1 << 20
+
+
+class ColumnarTable:
+    def __init__(self, columns: Dict[str, array]):
+        self.columns = columns
+
+    def __getitem__(self, name: str) -> array:
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def names(self) -> List[str]:
+        return list(self.columns)
+
+
+class ColumnarSnapshot:
+    def __init__(self, tables: Dict[str, ColumnarTable]):
+        self.tables = tables
+
+    def __getitem__(self, table: str) -> ColumnarTable:
+        return self.tables[table]
+
+
+class ColumnarSink:
+    # the file a binary COPY stream is written to, decoding it into column arrays as it arrives. A binary COPY stream
+    # is a header, then per row a 16 bit field count and per field a 32 bit length and the value, then a 16 bit -1.
+    # With only NOT NULL int4 fields a row is 2 + 8 * fields bytes long, and byte b of field f of every row is one
+    # slice of the stream with the row size as its step. The written chunks are gathered up to COPY_CHUNK_BYTES and
+    # their whole rows decoded, only the part of a row at the end of a chunk is kept for the next one
+    def __init__(self, names: List[str]):
+        self.names = names
+        self.row_size = 2 + 8 * len(names)
+        self.columns = {name: array("i") for name in names}
+        self.pending = bytearray()
+        self.header_read = False
+
+    def write(self, data) -> int:
+        if not self.pending and len(data) >= COPY_CHUNK_BYTES:
+            # a large chunk is decoded where it is
+            with memoryview(data) as view:
+                consumed = self.__decode(view)
+                self.pending += view[consumed:]
+        else:
+            self.pending += data
+            if len(self.pending) >= COPY_CHUNK_BYTES:
+                self.__decodePending()
+        return len(data)
+
+    def close(self) -> ColumnarTable:
+        # the columns of the whole stream, once it was written to the end
+        self.__decodePending()
+        if not self.header_read or not self.pending.endswith(COPY_TRAILER):
+            raise ValueError("not a binary COPY stream")
+        if len(self.pending) != len(COPY_TRAILER):
+            raise ValueError("the stream does not hold NOT NULL integer columns only")
+        self.pending = bytearray()
+        # the stream is big endian
+        if sys.byteorder == "little":
+            for column in self.columns.values():
+                column.byteswap()
+        return ColumnarTable(self.columns)
+
+    def __decodePending(self):
+        with memoryview(self.pending) as view:
+            consumed = self.__decode(view)
+        del self.pending[:consumed]
+
+    def __decode(self, data: memoryview) -> int:
+        # decodes the header (once) and the whole rows at the start of data, and returns how many bytes it used
+        start = 0
+        if not self.header_read:
+            header_length = len(COPY_SIGNATURE) + 8
+            if len(data) < header_length:
+                return 0
+            if data[:len(COPY_SIGNATURE)] != COPY_SIGNATURE:
+                raise ValueError("not a binary COPY stream")
+            extension_length, = struct.unpack_from("!i", data, len(COPY_SIGNATURE) + 4)
+            if len(data) < header_length + extension_length:
+                return 0
+            start = header_length + extension_length
+            self.header_read = True
+        rows = (len(data) - start) // self.row_size
+        if rows == 0:
+            return start
+        if data[start:start + 6] != struct.pack("!hi", len(self.names), 4):
+            raise ValueError("the stream does not hold NOT NULL integer columns only")
+        end = start + rows * self.row_size
+        for index, name in enumerate(self.names):
+            offset = start + 2 + 8 * index + 4
+            raw = bytearray(4 * rows)
+            for byte in range(4):
+                raw[byte::4] = data[offset + byte:end:self.row_size]
+            self.columns[name].frombytes(raw)
+        return end
+
+
+def decodeIntegerColumns(data, names: List[str]) -> ColumnarTable:
+    # a whole binary COPY stream at once, bytes or a memoryview of bytes
+    sink = ColumnarSink(names)
+    sink.write(data)
+    return sink.close()
+
+
+def loadSnapshot(tables: List[str] = None, deadline: float = None) -> ColumnarSnapshot:
+    # all the tables are copied in one transaction, so they are consistent with each other. Every table is decoded
+    # while it is copied, so its raw COPY bytes are never held whole
+    tables = list(SNAPSHOT_TABLES) if tables is None else tables
+    sinks = {table: ColumnarSink(SNAPSHOT_TABLES[table][1]) for table in tables}
+    conn = None
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        conn.copyOut(*[(f"COPY ({SNAPSHOT_TABLES[table][0]}) TO STDOUT (FORMAT binary)", sinks[table])
+                       for table in tables])
+    finally:
+        if conn is not None:
+            conn.close()
+    return ColumnarSnapshot({table: sinks[table].close() for table in tables})
+
+
+def loadThroughExecute(tables: List[str] = None) -> ColumnarSnapshot:
+    # the same snapshot read the usual way, as rows through execute and a ResultSet, to compare with
+    tables = list(SNAPSHOT_TABLES) if tables is None else tables
+    conn = None
+    snapshot = {}
+    try:
+        conn = Connector.DBConnector()
+        for table in tables:
+            query, names = SNAPSHOT_TABLES[table]
+            _, result = conn.execute(query)
+            snapshot[table] = ColumnarTable({name: array("i", (result[row][name] for row in range(result.size())))
+                                             for name in names})
+    finally:
+        if conn is not None:
+            conn.close()
+    return ColumnarSnapshot(snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the columnar snapshot loader against reading through execute")
+    parser.add_argument("--scale", type=int, help="generate a league of this many teams first (drops the tables)")
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+    if arguments.scale is not None:
+        Solution.dropTables()
+        Solution.createTables()
+        generateLeague(arguments.scale)
+
+    timings = {}
+    for name, load in [("binary COPY", loadSnapshot), ("execute + ResultSet", loadThroughExecute)]:
+        best = None
+        for _ in range(arguments.repeat):
+            start = time.perf_counter()
+            snapshot = load()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        rows = ", ".join(f"{table} {len(snapshot[table])}" for table in snapshot.tables)
+        print(f"{name:22}{best:>9.3f}s  ({rows})")
+    print(f"speedup: {timings['execute + ResultSet'] / timings['binary COPY']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
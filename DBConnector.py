@@ -1,9 +1,53 @@
 import psycopg2
-from psycopg2 import errors, sql
+from psycopg2 import errors, pool, sql
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from Utility.Exceptions import DatabaseException
+import itertools
+import json
 import os
-from typing import Union
+import select
+import threading
+import time
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator, List, Union
+
+
+# phase hooks, see addPhaseHook
+_phase_hooks = []
+
+
+# hook(phase, seconds) is called for every phase of the work done here, on the thread that did it:
+#   "config"        reading database.ini
+#   "connect"       opening a connection, or borrowing one from the pool
+#   "compose"       rendering a composed query to its text
+#   "execute"       running the query on the server, the round trip included
+#   "commit"        committing it
+#   "fetch"         fetching the rows
+#   "materialize"   building the ResultSet, and the row dict of every ResultSet[row]
+# Nothing is timed while no hook is added
+def addPhaseHook(hook: Callable[[str, float], None]):
+    _phase_hooks.append(hook)
+
+
+def removePhaseHook(hook: Callable[[str, float], None]):
+    _phase_hooks.remove(hook)
+
+
+@contextmanager
+def timedPhase(phase: str):
+    if not _phase_hooks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for hook in list(_phase_hooks):
+            hook(phase, elapsed)
 
 
 class ResultSetDict(dict):
@@ -22,6 +66,9 @@ class ResultSet:
         self.__fromQuery(description, results)
 
     def __getitem__(self, row):
+        if _phase_hooks:
+            with timedPhase("materialize"):
+                return self.__getRow(row)
         return self.__getRow(row)
 
     # so you can use print(ResultSet)
@@ -44,6 +91,18 @@ class ResultSet:
     def isEmpty(self):
         return self.size() == 0
 
+    # the rows as plain tuples holding the given columns in the given order. Unlike indexing the ResultSet this does
+    # not build a ResultSetDict per row, so it is the way to materialize many rows into objects
+    def tuples(self, *columns: str) -> List[tuple]:
+        if self.isEmpty():
+            return []
+        indexes = [self.cols[col] for col in columns]
+        if indexes == list(range(len(self.cols_header))):
+            return self.rows
+        if len(indexes) == 1:
+            return [(row[indexes[0]],) for row in self.rows]
+        return list(map(itemgetter(*indexes), self.rows))
+
     def __getRow(self, row: int):
         if len(self.rows) <= row:
             print('Invalid row ' + str(row))
@@ -57,33 +116,194 @@ class ResultSet:
         if results is None or len(results) == 0:  # no results
             self.cols = ResultSetDict()
         else:
-            self.rows = results.copy()
+            self.rows = results
             self.cols_header = [d.name for d in description]
             self.cols = ResultSetDict()
             for col, index in zip(self.cols_header, range(len(results[0]))):
                 self.cols[col] = index
 
 
+# names of the server side cursors of stream
+_cursor_names = itertools.count()
+
+
+# the section of database.ini the DBConnectors of a thread connect to, see useSection
+DEFAULT_SECTION = "postgresql"
+_thread_section = threading.local()
+
+
+def currentSection() -> str:
+    return getattr(_thread_section, "name", DEFAULT_SECTION)
+
+
+# every DBConnector made by this thread inside the with block connects to the database of the given section of
+# database.ini (e.g. one of the shards, see Sharding) instead of the default one
+@contextmanager
+def useSection(section: str):
+    previous = currentSection()
+    _thread_section.name = section
+    try:
+        yield
+    finally:
+        _thread_section.name = previous
+
+
+# the Postgres settings of the DBConnectors of a thread, see useSettings
+_thread_settings = threading.local()
+
+
+def currentSettings() -> dict:
+    return getattr(_thread_settings, "settings", {})
+
+
+# every DBConnector made by this thread inside the with block runs each of its transactions with the given settings
+# (e.g. {"work_mem": "64MB"}), applied with SET LOCAL so they end with the transaction and never outlive it on a
+# pooled connection. See Solution.TUNING_PROFILES
+@contextmanager
+def useSettings(settings: dict):
+    previous = currentSettings()
+    _thread_settings.settings = settings
+    try:
+        yield
+    finally:
+        _thread_settings.settings = previous
+
+
 class DBConnector:
+    # the shared connection pools, one per database section, see openPool. The semaphore makes a caller wait for a
+    # free connection instead of failing when all of them are taken
+    __pools = {}  # section -> (pool, semaphore, size)
+    __pool_lock = threading.Lock()
+    # see tuningSections
+    __tuning = None
+
     # constructor
-    def __init__(self):
+    # deadline is an optional time budget in seconds for everything done through this connection. It is applied as
+    # the session statement_timeout and also enforced on the client side by cancelling a query that is still running
+    # when the budget runs out, so a slow server can not hold the caller past it
+    # while a pool is open the connection is borrowed from it and given back by close, pooled=False always opens a
+    # connection of its own (needed when the session is changed for good, e.g. by LISTEN)
+    def __init__(self, deadline: float = None, pooled: bool = True):
+        self.deadline = None if deadline is None else time.monotonic() + deadline
+        self.lock = threading.RLock()
+        self.section = currentSection()
+        self.settings = currentSettings()
+        self.pool, self.pool_slots, _ = DBConnector.__pools.get(self.section, (None, None, 0)) if pooled \
+            else (None, None, 0)
         try:
-            # Obtain the configuration parameters
-            params = DBConnector.__config()
-            self.connection = psycopg2.connect(**params)
+            if self.pool is not None:
+                with timedPhase("connect"):
+                    self.connection = self.__borrow()
+            else:
+                # Obtain the configuration parameters
+                with timedPhase("config"):
+                    params = DBConnector.__config(section=self.section)
+                if self.deadline is not None:
+                    # libpq rounds the connect timeout to whole seconds (and treats 1 as 2)
+                    params['connect_timeout'] = max(2, int(deadline + 0.999))
+                with timedPhase("connect"):
+                    self.connection = psycopg2.connect(**params)
             self.connection.autocommit = False
             self.cursor = self.connection.cursor()
+        except DatabaseException.QUERY_TIMEOUT:
+            self.connection = None
+            self.cursor = None
+            raise
         except Exception as e:
             self.connection = None
             self.cursor = None
             raise DatabaseException.ConnectionInvalid("Could not connect to database")
+        if self.deadline is not None:
+            self.__applyStatementTimeout()
 
-    # close connection
-    def close(self):
-        if self.cursor is not None:
-            self.cursor.close()
-        if self.connection is not None:
+    # open a pool of at most maxconn connections shared by all the threads of the process. While it is open every
+    # DBConnector borrows one of these connections instead of connecting, so no more than maxconn queries run at once.
+    # The pool is for the database of the current section (each shard has a pool of its own)
+    @staticmethod
+    def openPool(minconn: int = 1, maxconn: int = 10):
+        section = currentSection()
+        with DBConnector.__pool_lock:
+            if section in DBConnector.__pools:
+                raise DatabaseException.ConnectionInvalid("A connection pool is already open")
+            try:
+                connections = pool.ThreadedConnectionPool(minconn, maxconn, **DBConnector.__config(section=section))
+            except Exception:
+                raise DatabaseException.ConnectionInvalid("Could not connect to database")
+            DBConnector.__pools[section] = (connections, threading.BoundedSemaphore(maxconn), maxconn)
+
+    # connections that are borrowed at this time are closed when they are given back
+    @staticmethod
+    def closePool():
+        with DBConnector.__pool_lock:
+            connections, _, _ = DBConnector.__pools.pop(currentSection(), (None, None, 0))
+            if connections is not None:
+                connections.closeall()
+
+    # the number of connections of the open pool of the current section, 0 when there is none
+    @staticmethod
+    def poolSize() -> int:
+        return DBConnector.__pools.get(currentSection(), (None, None, 0))[2]
+
+    def __borrow(self):
+        timeout = None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+        if not self.pool_slots.acquire(timeout=timeout):
+            raise DatabaseException.QUERY_TIMEOUT("QUERY_TIMEOUT")
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self.pool_slots.release()
+            raise
+
+    # a pooled connection goes back clean: no open transaction and no session settings left behind
+    def __giveBack(self):
+        broken = self.connection.closed != 0
+        if not broken:
+            try:
+                self.connection.rollback()
+                if self.deadline is not None:
+                    self.connection.cursor().execute("RESET statement_timeout")
+                    self.connection.commit()
+            except Exception:
+                broken = True
+        try:
+            self.pool.putconn(self.connection, close=broken)
+        except pool.PoolError:
+            # the pool was closed meanwhile
             self.connection.close()
+        finally:
+            self.pool_slots.release()
+
+    # milliseconds left until the deadline, raises QUERY_TIMEOUT if it has already passed
+    def __remainingMillis(self) -> int:
+        remaining = int((self.deadline - time.monotonic()) * 1000)
+        if remaining <= 0:
+            raise DatabaseException.QUERY_TIMEOUT("QUERY_TIMEOUT")
+        return remaining
+
+    # if the deadline already passed while connecting, the next execute reports it
+    def __applyStatementTimeout(self):
+        remaining = int((self.deadline - time.monotonic()) * 1000)
+        if remaining <= 0:
+            return
+        try:
+            self.cursor.execute(sql.SQL("SET statement_timeout = {0}").format(sql.Literal(remaining)))
+            self.connection.commit()
+        except Exception:
+            self.close()
+            raise DatabaseException.ConnectionInvalid("Could not set statement timeout")
+
+    # close connection (or give it back to the pool it was borrowed from)
+    def close(self):
+        with self.lock:
+            if self.cursor is not None:
+                self.cursor.close()
+            if self.connection is not None:
+                if self.pool is not None:
+                    self.__giveBack()
+                else:
+                    self.connection.close()
+            self.cursor = None
+            self.connection = None
 
     # commit connection's changes
     def commit(self):
@@ -104,14 +324,37 @@ class DBConnector:
     # executes the query, if it is SELECT you may ask to print the results with printSchema
     # returns the number of rows effected and a ResultSet (for SELECT)
     def execute(self, query: Union[str, sql.Composed], printSchema=False) -> (int, ResultSet):
+        with self.lock:
+            return self.__execute(query, printSchema)
+
+    def __execute(self, query: Union[str, sql.Composed], printSchema=False) -> (int, ResultSet):
         if self.connection is None:
             raise DatabaseException.ConnectionInvalid("Connection Invalid")
 
+        # cancel the query from the client side if the server did not stop it by the deadline
+        timer = None
+        if self.deadline is not None:
+            timer = threading.Timer(self.__remainingMillis() / 1000, self.connection.cancel)
+            timer.daemon = True
+            timer.start()
+
         # try to execute the query
         try:
-            self.cursor.execute(query)
+            if _phase_hooks and isinstance(query, sql.Composable):
+                # the cursor would render it itself, it is done here so that it is timed on its own
+                with timedPhase("compose"):
+                    query = query.as_string(self.connection)
+            with timedPhase("execute"):
+                # the settings are a statement of their own, so the query reaches the server exactly as it was given
+                if self.settings:
+                    self.cursor.execute(self.__setLocal())
+                self.cursor.execute(query)
             row_effected = max(self.cursor.rowcount, 0)
-            self.commit()
+            with timedPhase("commit"):
+                self.commit()
+        except errors.lookup("57014"):
+            self.rollback()
+            raise DatabaseException.QUERY_TIMEOUT("QUERY_TIMEOUT")
         except errors.lookup("23502"):
             raise DatabaseException.NOT_NULL_VIOLATION("NOT_NULL_VIOLATION")
         except errors.lookup("23503"):
@@ -120,10 +363,16 @@ class DBConnector:
             raise DatabaseException.UNIQUE_VIOLATION("UNIQUE_VIOLATION")
         except errors.lookup("23514"):
             raise DatabaseException.CHECK_VIOLATION("CHECK_VIOLATION")
+        finally:
+            if timer is not None:
+                timer.cancel()
 
         # get entries in case of SELECT
         if self.cursor.description is not None:
-            entries = ResultSet(self.cursor.description, self.cursor.fetchall())
+            with timedPhase("fetch"):
+                rows = self.cursor.fetchall()
+            with timedPhase("materialize"):
+                entries = ResultSet(self.cursor.description, rows)
         else:
             entries = ResultSet()
 
@@ -133,6 +382,82 @@ class DBConnector:
 
         return row_effected, entries
 
+    # runs a SELECT on a server side cursor and yields its rows as tuples. The rows are fetched batchSize at a time as
+    # they are consumed, so they are never all held in memory. The transaction stays open until the last row is read
+    # or the generator is closed, and each batch is fetched only if the deadline has not passed yet
+    def stream(self, query: Union[str, sql.Composed], batchSize: int = 1000) -> Iterator[tuple]:
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        timer = None
+        if self.deadline is not None:
+            timer = threading.Timer(self.__remainingMillis() / 1000, self.connection.cancel)
+            timer.daemon = True
+            timer.start()
+        cursor = self.connection.cursor(name="stream" + str(next(_cursor_names)))
+        finished = False
+        try:
+            with self.lock, timedPhase("execute"):
+                if self.settings:
+                    self.cursor.execute(self.__setLocal())
+                cursor.execute(query)
+            while True:
+                if self.deadline is not None:
+                    self.__remainingMillis()
+                with self.lock, timedPhase("fetch"):
+                    rows = cursor.fetchmany(batchSize)
+                if not rows:
+                    break
+                yield from rows
+            finished = True
+        except errors.lookup("57014"):
+            raise DatabaseException.QUERY_TIMEOUT("QUERY_TIMEOUT")
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self.lock:
+                if self.connection is not None:
+                    try:
+                        cursor.close()
+                    except Exception:
+                        pass
+                    if finished:
+                        self.commit()
+                    else:
+                        self.rollback()
+
+    def __setLocal(self) -> sql.Composed:
+        return sql.SQL("; ").join(sql.SQL("SET LOCAL {name} = {value}").format(name=sql.Identifier(name),
+                                                                              value=sql.Literal(str(value)))
+                                  for name, value in self.settings.items())
+
+    # run COPY ... TO STDOUT statements, each one writing to its file object, in one read only transaction so they
+    # all see the same snapshot of the database. A copy is a (query, file) pair
+    def copyOut(self, *copies: tuple) -> None:
+        with self.lock:
+            if self.connection is None:
+                raise DatabaseException.ConnectionInvalid("Connection Invalid")
+            timer = None
+            if self.deadline is not None:
+                timer = threading.Timer(self.__remainingMillis() / 1000, self.connection.cancel)
+                timer.daemon = True
+                timer.start()
+            try:
+                self.cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                if self.settings:
+                    self.cursor.execute(self.__setLocal())
+                for query, file in copies:
+                    self.cursor.copy_expert(query, file)
+                self.commit()
+            except errors.lookup("57014"):
+                self.rollback()
+                raise DatabaseException.QUERY_TIMEOUT("QUERY_TIMEOUT")
+            except Exception:
+                self.rollback()
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
     # grant credentials
     @staticmethod
     def __config(filename=os.path.join(os.path.join(os.getcwd(), "Utility"), 'database.ini'),
@@ -151,7 +476,139 @@ class DBConnector:
         else:
             # file not found
             db = DBConnector.__config(
-                filename=os.path.join(os.path.join(os.path.dirname(os.getcwd()), 'Utility'), 'database.ini'))
+                filename=os.path.join(os.path.join(os.path.dirname(os.getcwd()), 'Utility'), 'database.ini'),
+                section=section)
             if db is None:
                 raise DatabaseException.database_ini_ERROR("Please modify database.ini file under Utility")
         return db
+
+    @staticmethod
+    def __sections() -> ConfigParser:
+        parser = ConfigParser()
+        parser.read([os.path.join(os.path.join(os.path.dirname(os.getcwd()), 'Utility'), 'database.ini'),
+                     os.path.join(os.path.join(os.getcwd(), "Utility"), 'database.ini')])
+        return parser
+
+    # the sections of database.ini named shard0, shard1, ... in the order of their numbers
+    @staticmethod
+    def shardSections() -> List[str]:
+        parser = DBConnector.__sections()
+        shards = [section for section in parser.sections() if section.startswith("shard") and section[5:].isdigit()]
+        return sorted(shards, key=lambda section: int(section[5:]))
+
+    # name -> settings of the sections of database.ini named tuning.<name>, read once per process
+    @staticmethod
+    def tuningSections() -> dict:
+        if DBConnector.__tuning is None:
+            parser = DBConnector.__sections()
+            DBConnector.__tuning = {section[len("tuning."):]: dict(parser.items(section))
+                                    for section in parser.sections() if section.startswith("tuning.")}
+        return DBConnector.__tuning
+
+
+
+class ChangeListener:
+    # listens on a NOTIFY channel (see Solution.CHANGES_CHANNEL) on a connection of its own and hands every change to
+    # the registered callbacks as callback(table, keys), e.g. ("players", {"player_id": 3, "team_id": 1}).
+    # Notifications sent while the connection was down are lost, so after reconnecting the callbacks get
+    # callback(None, None), which means that anything may have changed and the whole cache should be dropped
+    def __init__(self, channel: str, poll_interval: float = 1.0, retry_interval: float = 1.0):
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.conn = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def register(self, callback: Callable[[str, dict], None]):
+        with self.lock:
+            self.callbacks.append(callback)
+
+    def unregister(self, callback: Callable[[str, dict], None]):
+        with self.lock:
+            self.callbacks.remove(callback)
+
+    # the channel is listened to before start returns, so every change committed afterwards is reported
+    def start(self):
+        self.stopped.clear()
+        self.__listen()
+        self.thread = threading.Thread(target=self.__run, name="ChangeListener-" + self.channel, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __listen(self):
+        self.conn = DBConnector(pooled=False)
+        # notifications are only read outside of a transaction
+        self.conn.connection.autocommit = True
+        self.conn.cursor.execute(sql.SQL("LISTEN {channel}").format(channel=sql.Identifier(self.channel)))
+
+    def __dispatch(self, table, keys):
+        with self.lock:
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            try:
+                callback(table, keys)
+            except Exception as e:
+                # one broken cache must not stop the invalidation of the others
+                print(e)
+
+    def __run(self):
+        while not self.stopped.is_set():
+            try:
+                if self.conn is None:
+                    self.__listen()
+                    self.__dispatch(None, None)
+                if select.select([self.conn.connection], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                self.conn.connection.poll()
+                while self.conn.connection.notifies:
+                    change = json.loads(self.conn.connection.notifies.pop(0).payload)
+                    self.__dispatch(change["table"], change["keys"])
+            except Exception:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                self.stopped.wait(self.retry_interval)
+
+
+# call fn once for every item of args_iterable on up to `workers` threads and return the results in the order of the
+# items. An item is the tuple of positional arguments of one call (anything else is taken as a single argument).
+# A call that raises does not stop the others, its place in the result holds the exception it raised.
+# While a pool is open the threads are bounded by its size, since more of them would only wait for a connection.
+# The items are read as the calls complete, at most two per thread ahead of the oldest unfinished call, so a long
+# iterable is never all submitted at once. The calls connect to the database section, and run with the settings (see
+# useSettings), of the calling thread
+def runMany(fn: Callable, args_iterable: Iterable, workers: int = 4) -> List[Any]:
+    if DBConnector.poolSize() > 0:
+        workers = min(workers, DBConnector.poolSize())
+    workers = max(1, workers)
+    section = currentSection()
+    settings = currentSettings()
+
+    def call(args):
+        try:
+            with useSection(section), useSettings(settings):
+                return fn(*args) if isinstance(args, tuple) else fn(args)
+        except Exception as e:
+            return e
+
+    results = []
+    submitted = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for args in args_iterable:
+            if len(submitted) >= 2 * workers:
+                results.append(submitted.popleft().result())
+            submitted.append(executor.submit(call, args))
+        while submitted:
+            results.append(submitted.popleft().result())
+    return results
@@ -0,0 +1,53 @@
+import Utility.DBConnector as Connector
+from psycopg2 import sql
+
+# a synthetic league used by the tools that need data of a given size (plan snapshots, load generation).
+# scale is the number of teams, the other tables grow with it:
+#   25 players per team, a stadium for 9 out of 10 teams, 10 home matches per team,
+#   90% of the matches played in the home team's stadium and about 3 scorers per match
+PLAYERS_PER_TEAM = 25
+MATCHES_PER_TEAM = 10
+
+
+def generateLeague(scale: int, seed: float = 0.5) -> None:
+    # the tables must exist and be empty, the same seed always produces the same league
+    if scale < 2:
+        raise ValueError("a league needs at least 2 teams")
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        # setseed is per session, and every statement below runs on this connection
+        conn.execute(sql.SQL("SELECT setseed({seed})").format(seed=sql.Literal(seed)))
+        conn.execute(sql.SQL("INSERT INTO Teams(team_id) SELECT g FROM generate_series(1, {teams}) g")
+                     .format(teams=sql.Literal(scale)))
+        conn.execute(sql.SQL("INSERT INTO Stadiums(stadium_id, capacity, team_id) "
+                             " SELECT g, 10000 + floor(random() * 90000)::INTEGER, g "
+                             " FROM generate_series(1, {teams}) g"
+                             " WHERE g % 10 <> 0")
+                     .format(teams=sql.Literal(scale)))
+        conn.execute(sql.SQL("INSERT INTO Players(player_id, team_id, age, height, preferred_foot) "
+                             " SELECT g, 1 + (g - 1) % {teams}, 17 + floor(random() * 20)::INTEGER,"
+                             "  165 + floor(random() * 40)::INTEGER,"
+                             "  CASE WHEN random() < 0.7 THEN 'Right' ELSE 'Left' END "
+                             " FROM generate_series(1, {players}) g")
+                     .format(teams=sql.Literal(scale), players=sql.Literal(scale * PLAYERS_PER_TEAM)))
+        # the away team is any team but the home team
+        conn.execute(sql.SQL("INSERT INTO Matches(match_id, competition, first_team_id, second_team_id) "
+                             " SELECT g, CASE WHEN random() < 0.3 THEN 'International' ELSE 'Domestic' END,"
+                             "  home, 1 + (home + floor(random() * ({teams} - 1))::INTEGER) % {teams} "
+                             " FROM (SELECT g, 1 + (g - 1) % {teams} AS home"
+                             "  FROM generate_series(1, {matches}) g) AS Generated")
+                     .format(teams=sql.Literal(scale), matches=sql.Literal(scale * MATCHES_PER_TEAM)))
+        conn.execute("INSERT INTO Played_In(match_id, stadium_id, audience_number) "
+                     " SELECT M.match_id, S.stadium_id, floor(random() * S.capacity)::INTEGER "
+                     " FROM Matches M INNER JOIN Stadiums S ON S.team_id = M.first_team_id "
+                     " WHERE random() < 0.9")
+        conn.execute("INSERT INTO Player_Scored_In(player_id, match_id, num_of_goals) "
+                     " SELECT P.player_id, M.match_id, 1 + floor(random() * 3)::INTEGER "
+                     " FROM Matches M CROSS JOIN LATERAL (VALUES (M.first_team_id), (M.second_team_id)) AS Side(team_id)"
+                     "  INNER JOIN Players P ON P.team_id = Side.team_id "
+                     " WHERE random() < 0.06")
+        conn.execute("ANALYZE")
+    finally:
+        if conn is not None:
+            conn.close()
@@ -28,3 +28,13 @@ class DatabaseException(_Exceptions):
 
     class UNKNOWN_ERROR(_Exceptions):
         pass
+
+
+# the call ran past its deadline, either through statement_timeout or a client side cancel. Unlike the errors above it
+# is a DatabaseException, so a caller catching DatabaseException catches a timeout too
+class QUERY_TIMEOUT(DatabaseException):
+    pass
+
+
+QUERY_TIMEOUT.__qualname__ = "DatabaseException.QUERY_TIMEOUT"
+DatabaseException.QUERY_TIMEOUT = QUERY_TIMEOUT
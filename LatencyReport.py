@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import functools
+import inspect
+import io
+import os
+import runpy
+import threading
+import time
+from collections import defaultdict
+from psycopg2 import sql
+import Utility.DBConnector as Connector
+import Solution
+
+# Where the time of each Solution function goes: connecting, reading database.ini, composing the query, running it on
+# the server, committing, fetching and building the ResultSet, and the rest (the Python of the function itself).
+# The DBConnector phase hooks time the phases, and every Solution function is wrapped so that a phase is charged to
+# the function that was running.
+#
+#   python LatencyReport.py                     # runs main.py, prints milliseconds per call of every function
+#   python LatencyReport.py --pool --repeat 5   # the same with a connection pool, five times over
+#
+# "compose" is the sql.SQL.format and join calls of the function plus the rendering of the query to text. The client
+# share of a function is everything but "execute", "commit" and "fetch", the phases that wait for the server.
+
+PHASES = ["config", "connect", "compose", "execute", "commit", "fetch", "materialize", "other"]
+SERVER_PHASES = {"execute", "commit", "fetch"}
+
+
+class PhaseTimes:
+    # aggregates the phases per Solution function, calls to the function from inside another one are charged to the
+    # outer one
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = threading.local()
+        self.calls = defaultdict(int)
+        self.totals = defaultdict(float)
+        self.phases = defaultdict(lambda: defaultdict(float))
+
+    def onPhase(self, phase: str, seconds: float):
+        function = getattr(self.running, "function", None)
+        if function is not None:
+            with self.lock:
+                self.phases[function][phase] += seconds
+
+    def timed(self, name: str, fn):
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            if getattr(self.running, "function", None) is not None:
+                return fn(*args, **kwargs)
+            self.running.function = name
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.running.function = None
+                with self.lock:
+                    self.calls[name] += 1
+                    self.totals[name] += elapsed
+        return call
+
+    def report(self) -> str:
+        lines = [f"{'function':28}{'calls':>7}{'ms/call':>9}" + "".join(f"{phase:>12}" for phase in PHASES) +
+                 f"{'client':>9}"]
+        grand = defaultdict(float)
+        for name in sorted(self.calls, key=lambda name: -self.totals[name]):
+            phases = dict(self.phases[name])
+            phases["other"] = max(0.0, self.totals[name] - sum(phases.values()))
+            client = sum(seconds for phase, seconds in phases.items() if phase not in SERVER_PHASES)
+            for phase, seconds in phases.items():
+                grand[phase] += seconds
+            lines.append(f"{name:28}{self.calls[name]:>7}{1000 * self.totals[name] / self.calls[name]:>9.3f}" +
+                         "".join(f"{1000 * phases.get(phase, 0.0) / self.calls[name]:>12.3f}" for phase in PHASES) +
+                         f"{100 * client / self.totals[name] if self.totals[name] else 0.0:>8.0f}%")
+        total = sum(self.totals.values())
+        if total:
+            lines.append("")
+            lines.append("share of all the time: " + ", ".join(f"{phase} {100 * grand[phase] / total:.0f}%"
+                                                              for phase in PHASES))
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def timingSolution(times: PhaseTimes):
+    # wraps the public Solution functions and sql.SQL.format / join for the duration of the block
+    originals = {name: fn for name, fn in vars(Solution).items()
+                 if inspect.isfunction(fn) and fn.__module__ == Solution.__name__ and not name.startswith("_")}
+    composing = {name: getattr(sql.SQL, name) for name in ("format", "join")}
+
+    composing_depth = threading.local()
+
+    def timedCompose(fn):
+        # only the outermost compose call of a thread is timed, the ones it makes itself are part of it
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            depth = getattr(composing_depth, "depth", 0)
+            composing_depth.depth = depth + 1
+            try:
+                if depth:
+                    return fn(*args, **kwargs)
+                with Connector.timedPhase("compose"):
+                    return fn(*args, **kwargs)
+            finally:
+                composing_depth.depth = depth
+        return call
+
+    for name, fn in originals.items():
+        setattr(Solution, name, times.timed(name, fn))
+    for name, fn in composing.items():
+        setattr(sql.SQL, name, timedCompose(fn))
+    Connector.addPhaseHook(times.onPhase)
+    try:
+        yield
+    finally:
+        Connector.removePhaseHook(times.onPhase)
+        for name, fn in composing.items():
+            setattr(sql.SQL, name, fn)
+        for name, fn in originals.items():
+            setattr(Solution, name, fn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Break the latency of the Solution functions down by phase")
+    parser.add_argument("--scenario", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                        help="the script to run, main.py by default")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--pool", action="store_true", help="borrow the connections from a pool")
+    parser.add_argument("--show-output", action="store_true", help="do not hide what the scenario prints")
+    arguments = parser.parse_args()
+
+    times = PhaseTimes()
+    if arguments.pool:
+        Connector.DBConnector.openPool(1, 4)
+    try:
+        with timingSolution(times):
+            for _ in range(arguments.repeat):
+                output = contextlib.nullcontext() if arguments.show_output else \
+                    contextlib.redirect_stdout(io.StringIO())
+                with output:
+                    # the scenario imports the (wrapped) Solution functions itself
+                    runpy.run_path(arguments.scenario, run_name="__main__")
+    finally:
+        if arguments.pool:
+            Connector.DBConnector.closePool()
+    print("milliseconds per call")
+    print(times.report())
+
+
+if __name__ == '__main__':
+    main()
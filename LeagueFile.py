@@ -0,0 +1,196 @@
+import argparse
+import json
+import struct
+import time
+from typing import Dict, List
+import numpy as np
+import Solution
+from ColumnarSnapshot import loadSnapshot
+
+# A frozen copy of the league in one file, and the read only ranked Solution functions computed over it with NumPy.
+# The file is the columns of a snapshot laid one after the other as little endian int4, behind a small header, so it
+# is opened with a memory map: opening reads the header only, the columns are paged in when they are used, and every
+# process that opens the same file shares the same pages.
+#
+#   exportLeagueFile("league.snap")         # one consistent snapshot of the database
+#   league = LeagueFile("league.snap")
+#   league.popularTeams()                   # == Solution.popularTeams() at the time of the export
+#
+#   python LeagueFile.py league.snap --export   # export, then time the file against the database
+#
+# The answers are those of the SQL over the exported rows, including the order and the limits.
+
+MAGIC = b"LEAGSNAP"
+FORMAT_VERSION = 1
+# magic, version, length of the json directory that follows
+HEADER = struct.Struct("<8sII")
+ALIGNMENT = 64
+LEAGUE_TABLES = ["teams", "stadiums", "matches", "players", "scores", "attendance"]
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def exportLeagueFile(path: str, deadline: float = None):
+    snapshot = loadSnapshot(LEAGUE_TABLES, deadline=deadline)
+    # directory: table -> {"rows": count, "columns": {column: offset of its first value after the directory}}
+    directory = {table: {"rows": len(snapshot[table]), "columns": {}} for table in LEAGUE_TABLES}
+    columns = []
+    offset = 0
+    for table in LEAGUE_TABLES:
+        for name in snapshot[table].names():
+            values = np.frombuffer(snapshot[table][name], dtype=np.intc).astype("<i4")
+            directory[table]["columns"][name] = offset
+            columns.append((offset, values))
+            offset = _aligned(offset + values.nbytes)
+    encoded = json.dumps(directory, sort_keys=True).encode()
+    start = _aligned(HEADER.size + len(encoded))
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        file.write(encoded)
+        for column_offset, values in columns:
+            file.seek(start + column_offset)
+            file.write(values.tobytes())
+        file.truncate(start + offset)
+
+
+class LeagueFile:
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            magic, version, directory_length = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a league snapshot file")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"{path} is a version {version} league snapshot, expected version {FORMAT_VERSION}")
+            directory = json.loads(file.read(directory_length))
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        start = _aligned(HEADER.size + directory_length)
+        self.tables = {table: {name: self.data[start + offset:start + offset + 4 * entry["rows"]].view("<i4")
+                               for name, offset in entry["columns"].items()}
+                       for table, entry in directory.items()}
+        # derived arrays, computed on first use and kept, the file never changes under them
+        self.derived = {}
+
+    def __getitem__(self, table: str) -> Dict[str, np.ndarray]:
+        return self.tables[table]
+
+    def __derive(self, name: str, compute):
+        if name not in self.derived:
+            self.derived[name] = compute()
+        return self.derived[name]
+
+    def __activeTallTeams(self) -> np.ndarray:
+        # TallTeams: two different players taller than 190, Played_At_Least_One_Match: a team of Teams in a match
+        def compute():
+            players, matches = self["players"], self["matches"]
+            tall, counts = np.unique(players["team_id"][players["height"] > 190], return_counts=True)
+            played = np.union1d(matches["first_team_id"], matches["second_team_id"])
+            return np.intersect1d(np.intersect1d(tall[counts >= 2], played), self["teams"]["team_id"])
+        return self.__derive("active_tall_teams", compute)
+
+    def __matchGoals(self) -> tuple:
+        # (match ids, their goals), the matches somebody scored in, sorted by id
+        def compute():
+            scores = self["scores"]
+            match_ids, where = np.unique(scores["match_id"], return_inverse=True)
+            goals = np.bincount(where, weights=scores["num_of_goals"], minlength=len(match_ids)).astype(np.int64)
+            return match_ids, goals
+        return self.__derive("match_goals", compute)
+
+    def __playerRanking(self) -> tuple:
+        # (team of every player, player ids) ordered by team, then by goals and id descending
+        def compute():
+            players, scores = self["players"], self["scores"]
+            player_ids = players["player_id"]
+            order = np.argsort(player_ids)
+            scorers = np.searchsorted(player_ids, scores["player_id"], sorter=order)
+            goals = np.zeros(len(player_ids), dtype=np.int64)
+            np.add.at(goals, order[scorers], scores["num_of_goals"].astype(np.int64))
+            ranked = np.lexsort((-player_ids.astype(np.int64), -goals, players["team_id"]))
+            return players["team_id"][ranked], player_ids[ranked]
+        return self.__derive("player_ranking", compute)
+
+    def getActiveTallTeams(self) -> List[int]:
+        return self.__activeTallTeams()[::-1][:5].tolist()
+
+    def getActiveTallRichTeams(self) -> List[int]:
+        stadiums = self["stadiums"]
+        rich = stadiums["team_id"][(stadiums["capacity"] > 55000) & (stadiums["team_id"] != 0)]
+        # one row per rich stadium, a team with two of them is listed twice as in the join
+        return np.sort(rich[np.isin(rich, self.__activeTallTeams())])[:5].tolist()
+
+    def popularTeams(self) -> List[int]:
+        def compute():
+            teams, matches, attendance = self["teams"], self["matches"], self["attendance"]
+            # DidntPlayAtHome: a team that is nobody's first team
+            away_only = np.setdiff1d(teams["team_id"], matches["first_team_id"])
+            # Played_At_Least_One_Home_Match: the first team of every match with a Played_In row
+            order = np.argsort(matches["match_id"])
+            played = order[np.searchsorted(matches["match_id"], attendance["match_id"], sorter=order)]
+            hosts = matches["first_team_id"][played]
+            # HomeDidntHaveFortyAudience: a host of a played match with at most 40000 people
+            small = np.unique(hosts[attendance["audience_number"] <= 40000])
+            return np.union1d(away_only, np.setdiff1d(hosts, small))[::-1][:10]
+        return self.__derive("popular_teams", compute).tolist()
+
+    def getMostAttractiveStadiums(self) -> List[int]:
+        def compute():
+            stadiums, attendance = self["stadiums"], self["attendance"]
+            match_ids, match_goals = self.__matchGoals()
+            # the goals of the match of every Played_In row, 0 when nobody scored in it
+            found = np.searchsorted(match_ids, attendance["match_id"])
+            scored = found < len(match_ids)
+            scored[scored] = match_ids[found[scored]] == attendance["match_id"][scored]
+            goals_per_row = np.zeros(len(found), dtype=np.int64)
+            goals_per_row[scored] = match_goals[found[scored]]
+            stadium_ids = stadiums["stadium_id"]
+            order = np.argsort(stadium_ids)
+            hosts = order[np.searchsorted(stadium_ids, attendance["stadium_id"], sorter=order)]
+            goals = np.zeros(len(stadium_ids), dtype=np.int64)
+            np.add.at(goals, hosts, goals_per_row)
+            return stadium_ids[np.lexsort((stadium_ids, -goals))]
+        return self.__derive("most_attractive_stadiums", compute).tolist()
+
+    def mostGoalsForTeam(self, teamID: int) -> List[int]:
+        teams, ranked = self.__playerRanking()
+        start = np.searchsorted(teams, teamID, side="left")
+        end = np.searchsorted(teams, teamID, side="right")
+        return ranked[start:min(end, start + 5)].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the league snapshot file against the database")
+    parser.add_argument("path")
+    parser.add_argument("--export", action="store_true", help="export the database to path first")
+    parser.add_argument("--repeat", type=int, default=100)
+    arguments = parser.parse_args()
+    if arguments.export:
+        start = time.perf_counter()
+        exportLeagueFile(arguments.path)
+        print(f"export{time.perf_counter() - start:>23.3f}s")
+    start = time.perf_counter()
+    league = LeagueFile(arguments.path)
+    print(f"open{time.perf_counter() - start:>25.6f}s")
+
+    team_ids = league["teams"]["team_id"][:arguments.repeat].tolist() or [1]
+    calls = [("popularTeams", lambda source: source.popularTeams()),
+             ("getActiveTallTeams", lambda source: source.getActiveTallTeams()),
+             ("getMostAttractiveStadiums", lambda source: source.getMostAttractiveStadiums()),
+             ("mostGoalsForTeam", lambda source: [source.mostGoalsForTeam(team_id) for team_id in team_ids])]
+    for name, call in calls:
+        timings = []
+        for source in (Solution, league):
+            start = time.perf_counter()
+            for _ in range(arguments.repeat if name != "mostGoalsForTeam" else 1):
+                result = call(source)
+            timings.append(time.perf_counter() - start)
+            if source is Solution:
+                expected = result
+        print(f"{name:26}{timings[0]:>9.3f}s sql {timings[1]:>9.3f}s file"
+              f"  {'same' if result == expected else 'DIFFERENT'}")
+
+
+if __name__ == '__main__':
+    main()
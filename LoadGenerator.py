@@ -0,0 +1,215 @@
+import argparse
+import multiprocessing
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from psycopg2 import sql
+import Utility.DBConnector as Connector
+from Utility.DBConnector import ResultSet
+from Utility.ReturnValue import ReturnValue
+import Solution
+from Business.Match import Match
+from Business.Player import Player
+from Business.Stadium import Stadium
+from Dataset import generateLeague, PLAYERS_PER_TEAM, MATCHES_PER_TEAM
+
+# Mixed workload load generator for the Solution API.
+# N processes drive a weighted mix of Solution calls against a generated league at a target total rate and the run
+# ends with a per function report of throughput, p50/p99 latency, outcome counts (ReturnValues and exception classes)
+# and time spent waiting for locks.
+#
+#   python LoadGenerator.py --scale 200 --processes 8 --rate 400 --duration 30 --mix profile=70,score=20,analytics=10
+#
+# The schedule is open loop: every process has fixed send times and a call's latency is measured from its planned
+# send time, so a stalled server shows up in the tail instead of silently lowering the offered load.
+# Lock waits are sampled from pg_stat_activity. Every query of the run carries a /* function */ comment, which is
+# how a waiting backend is attributed to the Solution function that sent the query.
+
+LOCK_SAMPLE_INTERVAL = 0.05
+
+
+# each operation draws its arguments from the generated league, the ranges are slightly wider than the league so a
+# few calls hit missing rows as they would in production
+def _player(league):
+    player_id = random.randint(1, league["players"] + 10)
+    return Player(player_id, 1 + (player_id - 1) % league["teams"], 20, 180, "Left")
+
+
+def _match(league):
+    return Match(random.randint(1, league["matches"] + 10), "Domestic", 1, 2)
+
+
+def _stadium(league):
+    return Stadium(random.randint(1, league["teams"]), 50000, None)
+
+
+OPERATIONS = {
+    "getPlayerProfile": lambda league: (_player(league).getPlayerID(),),
+    "getMatchProfile": lambda league: (_match(league).getMatchID(),),
+    "getStadiumProfile": lambda league: (_stadium(league).getStadiumID(),),
+    "playerScoredInMatch": lambda league: (_match(league), _player(league), random.randint(1, 3)),
+    "playerDidntScoreInMatch": lambda league: (_match(league), _player(league)),
+    "matchInStadium": lambda league: (_match(league), _stadium(league), random.randint(0, 60000)),
+    "averageAttendanceInStadium": lambda league: (_stadium(league).getStadiumID(),),
+    "stadiumTotalGoals": lambda league: (_stadium(league).getStadiumID(),),
+    "playerIsWinner": lambda league: (_player(league).getPlayerID(), _match(league).getMatchID()),
+    "getActiveTallTeams": lambda league: (),
+    "getActiveTallRichTeams": lambda league: (),
+    "popularTeams": lambda league: (),
+    "getMostAttractiveStadiums": lambda league: (),
+    "mostGoalsForTeam": lambda league: (random.randint(1, league["teams"]),),
+    "getClosePlayers": lambda league: (_player(league).getPlayerID(),),
+}
+
+# a mix entry is either one of these groups (spread evenly over its functions) or a single function name
+GROUPS = {
+    "profile": ["getPlayerProfile", "getMatchProfile", "getStadiumProfile"],
+    "score": ["playerScoredInMatch"],
+    "attendance": ["matchInStadium"],
+    "analytics": ["averageAttendanceInStadium", "stadiumTotalGoals", "playerIsWinner", "getActiveTallTeams",
+                  "getActiveTallRichTeams", "popularTeams", "getMostAttractiveStadiums", "mostGoalsForTeam",
+                  "getClosePlayers"],
+}
+
+
+def parseMix(mix: str) -> dict:
+    weights = defaultdict(float)
+    for entry in mix.split(","):
+        name, _, weight = entry.partition("=")
+        name, weight = name.strip(), float(weight)
+        functions = GROUPS.get(name, [name])
+        for function in functions:
+            if function not in OPERATIONS:
+                raise ValueError(f"unknown function or group in the mix: {name}")
+            weights[function] += weight / len(functions)
+    return dict(weights)
+
+
+class _TaggingConnector(Connector.DBConnector):
+    # prefixes every query with a comment naming the Solution function that is running
+    function = ""
+
+    def execute(self, query, printSchema=False) -> (int, ResultSet):
+        tag = sql.SQL("/* {0} */ ").format(sql.SQL(_TaggingConnector.function))
+        return super().execute(sql.Composed([tag, sql.SQL(query) if isinstance(query, str) else query]), printSchema)
+
+
+def _worker(league: dict, weights: dict, rate: float, duration: float, pooled: bool, seed: int, results):
+    random.seed(seed)
+    Connector.DBConnector = _TaggingConnector
+    if pooled:
+        Connector.DBConnector.openPool(1, 1)
+    functions, cumulative = list(weights), list(weights.values())
+    latencies = defaultdict(list)
+    outcomes = defaultdict(Counter)
+    start = time.monotonic()
+    planned = start
+    try:
+        while planned - start < duration:
+            now = time.monotonic()
+            if planned > now:
+                time.sleep(planned - now)
+            name = random.choices(functions, cumulative)[0]
+            args = OPERATIONS[name](league)
+            _TaggingConnector.function = name
+            try:
+                outcome = getattr(Solution, name)(*args)
+                outcome = outcome.name if isinstance(outcome, ReturnValue) else "OK"
+            except Exception as e:
+                outcome = type(e).__name__
+            latencies[name].append(time.monotonic() - planned)
+            outcomes[name][outcome] += 1
+            planned += random.expovariate(rate)
+    finally:
+        if pooled:
+            Connector.DBConnector.closePool()
+    results.put((dict(latencies), {name: dict(counts) for name, counts in outcomes.items()}))
+
+
+def _sampleLockWaits(stop: threading.Event, samples: Counter):
+    conn = Connector.DBConnector(pooled=False)
+    tag = re.compile(r"^/\* (\w+) \*/")
+    try:
+        while not stop.wait(LOCK_SAMPLE_INTERVAL):
+            _, result = conn.execute("SELECT query FROM pg_stat_activity"
+                                     " WHERE wait_event_type = 'Lock' AND datname = current_database()")
+            for query, in result.tuples("query"):
+                match = tag.match(query)
+                samples[match.group(1) if match else "other"] += 1
+    finally:
+        conn.close()
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(latencies: dict, outcomes: dict, lock_samples: Counter, elapsed: float):
+    print(f"{'function':28}{'calls':>8}{'calls/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'lock wait s':>13}  outcomes")
+    total = 0
+    for name in sorted(latencies, key=lambda function: -len(latencies[function])):
+        values = latencies[name]
+        total += len(values)
+        counts = ", ".join(f"{outcome}={count}" for outcome, count in sorted(outcomes[name].items()))
+        print(f"{name:28}{len(values):>8}{len(values) / elapsed:>10.1f}{percentile(values, 0.5) * 1000:>10.2f}"
+              f"{percentile(values, 0.99) * 1000:>10.2f}{lock_samples[name] * LOCK_SAMPLE_INTERVAL:>13.2f}  {counts}")
+    print(f"total: {total} calls in {elapsed:.1f}s, {total / elapsed:.1f} calls/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed workload load generator for the Solution API")
+    parser.add_argument("--scale", type=int, default=100, help="number of teams in the generated league")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=100, help="target calls per second of all processes together")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--mix", default="profile=70,score=20,analytics=10",
+                        help="comma separated weights of groups (" + ", ".join(GROUPS) + ") or function names")
+    parser.add_argument("--connect-per-call", action="store_true",
+                        help="open a connection for every call instead of keeping one per process")
+    parser.add_argument("--reuse", action="store_true", help="run against the league already in the database")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    weights = parseMix(arguments.mix)
+    league = {"teams": arguments.scale, "players": arguments.scale * PLAYERS_PER_TEAM,
+              "matches": arguments.scale * MATCHES_PER_TEAM}
+    if not arguments.reuse:
+        Solution.dropTables()
+        Solution.createTables()
+        generateLeague(arguments.scale)
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker,
+                                       args=(league, weights, arguments.rate / arguments.processes,
+                                             arguments.duration, not arguments.connect_per_call,
+                                             arguments.seed + index, results))
+               for index in range(arguments.processes)]
+    lock_samples = Counter()
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sampleLockWaits, args=(stop, lock_samples), daemon=True)
+    sampler.start()
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+
+    latencies = defaultdict(list)
+    outcomes = defaultdict(Counter)
+    for _ in workers:
+        worker_latencies, worker_outcomes = results.get()
+        for name, values in worker_latencies.items():
+            latencies[name] += values
+        for name, counts in worker_outcomes.items():
+            outcomes[name].update(counts)
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+    stop.set()
+    sampler.join()
+    report(latencies, outcomes, lock_samples, elapsed)
+
+
+if __name__ == '__main__':
+    main()
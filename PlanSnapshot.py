@@ -0,0 +1,210 @@
+import argparse
+import inspect
+import json
+import os
+import re
+import sys
+import Utility.DBConnector as Connector
+from Utility.DBConnector import ResultSet
+import Solution
+from Business.Match import Match
+from Business.Player import Player
+from Business.Stadium import Stadium
+from Dataset import generateLeague
+
+# Query plan snapshots for the Solution queries.
+# Every Solution function in PLANNED_CALLS is called once with its queries captured instead of executed, each captured
+# query is EXPLAINed on a generated league, and the plan is reduced to its shape (node types, join types, relations
+# and indexes). With --update the shapes and estimated costs are stored under the snapshot directory, otherwise they
+# are compared to the stored ones and the run fails if a shape changed or a cost went over its budget.
+#
+#   python PlanSnapshot.py --scale 200 --update     # record
+#   python PlanSnapshot.py --scale 200              # check, exit code 1 on a regression
+
+# the ids used as arguments all exist in a generated league
+PLANNED_CALLS = [
+    ("addTeam", (1,)),
+    ("addMatch", (Match(1, "Domestic", 1, 2),)),
+    ("getMatchProfile", (1,)),
+    ("deleteMatch", (Match(1, "Domestic", 1, 2),)),
+    ("addPlayer", (Player(1, 1, 20, 180, "Left"),)),
+    ("getPlayerProfile", (1,)),
+    ("deletePlayer", (Player(1, 1, 20, 180, "Left"),)),
+    ("addStadium", (Stadium(1, 50000, 1),)),
+    ("getStadiumProfile", (1,)),
+    ("deleteStadium", (Stadium(1, 50000, 1),)),
+    ("playerScoredInMatch", (Match(1, "Domestic", 1, 2), Player(1, 1, 20, 180, "Left"), 1)),
+    ("playerDidntScoreInMatch", (Match(1, "Domestic", 1, 2), Player(1, 1, 20, 180, "Left"))),
+    ("matchInStadium", (Match(1, "Domestic", 1, 2), Stadium(1, 50000, 1), 1000)),
+    ("matchNotInStadium", (Match(1, "Domestic", 1, 2), Stadium(1, 50000, 1))),
+    ("deleteMatches", ([1, 2, 3],)),
+    ("deletePlayers", ([1, 2, 3],)),
+    ("deleteStadiums", ([1, 2, 3],)),
+    ("playersDidntScoreInMatches", ([(1, 1), (2, 2)],)),
+    ("matchesNotInStadiums", ([(1, 1), (2, 2)],)),
+    ("averageAttendanceInStadium", (1,)),
+    ("stadiumTotalGoals", (1,)),
+    ("playerIsWinner", (1, 1)),
+    ("getActiveTallTeams", ()),
+    ("getActiveTallRichTeams", ()),
+    ("popularTeams", ()),
+    ("getMostAttractiveStadiums", ()),
+    ("mostGoalsForTeam", (1,)),
+    ("getClosePlayers", (1,)),
+    ("getLeagueDashboard", ([1, 2, 3],)),
+    ("getMostAttractiveStadiumsPage", (10, Solution._encodeCursor(3, 20))),
+    ("mostGoalsForTeamPage", (1, 10, Solution._encodeCursor(3, 20))),
+    ("popularTeamsPage", (10, Solution._encodeCursor(20))),
+    ("getActiveTallTeamsPage", (10, Solution._encodeCursor(20))),
+    ("getTallTeams", (190, 2, True, 55000, 5, True)),
+    ("getTeamReports", ([1, 2, 3],)),
+    ("getPlayerAttributeHistogram", ("height", 10, 1)),
+    ("getTeamPlayerStats", ([1, 2, 3],)),
+    ("findPlayers", ({"minAge": 18, "maxAge": 22, "minHeight": 185, "preferredFoot": "Left",
+                      "competition": "International", "minGoals": 1}, "-goals", 50)),
+]
+
+# the parts of a plan node that make up its shape, costs and row estimates are left out on purpose
+SHAPE_KEYS = ["Node Type", "Join Type", "Strategy", "Relation Name", "Index Name"]
+
+# statements that only prepare the session or transaction and have no plan of their own
+SESSION_STATEMENT = re.compile(r"^\s*SET\s[^;]*;", re.IGNORECASE)
+
+
+class _CapturingConnector(Connector.DBConnector):
+    # stands in for DBConnector while a Solution function runs, it only records the queries it is given
+    captured = []
+
+    def __init__(self, deadline: float = None):
+        self.connection = None
+        self.cursor = None
+
+    def execute(self, query, printSchema=False) -> (int, ResultSet):
+        _CapturingConnector.captured.append(query)
+        return 0, ResultSet()
+
+    def stream(self, query, batchSize: int = 1000):
+        _CapturingConnector.captured.append(query)
+        return iter(())
+
+    def close(self):
+        pass
+
+
+def captureQueries(name: str, args: tuple) -> list:
+    _CapturingConnector.captured = []
+    original = Connector.DBConnector
+    Connector.DBConnector = _CapturingConnector
+    try:
+        result = getattr(Solution, name)(*args)
+        # a streaming function runs its query only when its rows are read
+        if inspect.isgenerator(result):
+            list(result)
+    finally:
+        Connector.DBConnector = original
+    return _CapturingConnector.captured
+
+
+def normalizePlan(node: dict) -> dict:
+    shape = {key: node[key] for key in SHAPE_KEYS if key in node}
+    if "Plans" in node:
+        shape["Plans"] = [normalizePlan(child) for child in node["Plans"]]
+    return shape
+
+
+def explain(conn: Connector.DBConnector, query) -> (dict, float):
+    text = query if isinstance(query, str) else query.as_string(conn.connection)
+    while SESSION_STATEMENT.match(text):
+        text = SESSION_STATEMENT.sub("", text, count=1)
+    # EXPLAIN without ANALYZE does not run the statement, so the writes leave the league untouched
+    _, result = conn.execute("EXPLAIN (FORMAT JSON) " + text)
+    plan = result.rows[0][0][0]["Plan"]
+    return normalizePlan(plan), plan["Total Cost"]
+
+
+def takeSnapshots() -> dict:
+    snapshots = {}
+    for name, args in PLANNED_CALLS:
+        # the plans are those of the function's tuning profile (work_mem and parallel workers change them)
+        with Connector.useSettings(Solution.tuningSettings(name)):
+            conn = Connector.DBConnector()
+        try:
+            plans = []
+            for query in captureQueries(name, args):
+                shape, cost = explain(conn, query)
+                plans.append({"plan": shape, "total_cost": cost})
+            snapshots[name] = plans
+        finally:
+            conn.close()
+    return snapshots
+
+
+def compareSnapshot(name: str, stored: list, current: list, tolerance: float) -> list:
+    failures = []
+    if len(stored) != len(current):
+        return [f"{name}: ran {len(current)} queries, the snapshot has {len(stored)}"]
+    for index, (old, new) in enumerate(zip(stored, current)):
+        if old["plan"] != new["plan"]:
+            failures.append(f"{name} query {index}: plan shape changed\n"
+                            f"  stored:  {json.dumps(old['plan'])}\n"
+                            f"  current: {json.dumps(new['plan'])}")
+        budget = old.get("cost_budget", old["total_cost"] * (1 + tolerance))
+        if new["total_cost"] > budget:
+            failures.append(f"{name} query {index}: estimated cost {new['total_cost']} is over the budget {budget}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Plan snapshot testing for the Solution queries")
+    parser.add_argument("--scale", type=int, default=100, help="number of teams in the generated league")
+    parser.add_argument("--snapshots", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            "plan_snapshots"))
+    parser.add_argument("--update", action="store_true", help="record the current plans as the new snapshots")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative growth of the estimated cost when a snapshot has no cost_budget")
+    parser.add_argument("--keep", action="store_true", help="leave the generated league in the database")
+    arguments = parser.parse_args()
+
+    Solution.dropTables()
+    Solution.createTables()
+    try:
+        generateLeague(arguments.scale)
+        snapshots = takeSnapshots()
+    finally:
+        if not arguments.keep:
+            Solution.dropTables()
+
+    directory = os.path.join(arguments.snapshots, f"scale_{arguments.scale}")
+    if arguments.update:
+        os.makedirs(directory, exist_ok=True)
+        for name, plans in snapshots.items():
+            path = os.path.join(directory, name + ".json")
+            # a hand set cost_budget survives the update
+            if os.path.exists(path):
+                with open(path) as file:
+                    old = json.load(file)
+                for new_plan, old_plan in zip(plans, old):
+                    if "cost_budget" in old_plan:
+                        new_plan["cost_budget"] = old_plan["cost_budget"]
+            with open(path, "w") as file:
+                json.dump(plans, file, indent=1, sort_keys=True)
+        print(f"recorded {len(snapshots)} plan snapshots in {directory}")
+        return 0
+
+    failed = 0
+    for name, plans in snapshots.items():
+        path = os.path.join(directory, name + ".json")
+        if not os.path.exists(path):
+            failures = [f"{name}: no snapshot, run with --update first"]
+        else:
+            with open(path) as file:
+                failures = compareSnapshot(name, json.load(file), plans, arguments.tolerance)
+        for failure in failures:
+            print(failure)
+        failed += 1 if failures else 0
+    print(f"{len(snapshots) - failed}/{len(snapshots)} functions match their plan snapshots")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
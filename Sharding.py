@@ -0,0 +1,444 @@
+from typing import List
+from psycopg2 import sql
+import Utility.DBConnector as Connector
+from Utility.Exceptions import DatabaseException
+from Utility.ReturnValue import ReturnValue
+import Solution
+from Business.Match import Match
+from Business.Player import Player
+from Business.Stadium import Stadium
+
+# The Solution API over several Postgres databases (shards), split by team.
+# The shards are the sections shard0, shard1, ... of database.ini, each one with the same keys as [postgresql]:
+#
+#   [shard0]
+#   host=localhost
+#   database=league_shard0
+#   ...
+#
+# Team t lives on shard t % N. Its players, its stadium and its home matches are stored there, and the goals and the
+# attendance of a match are stored with the match. Teams are tiny and are kept on every shard, so every team
+# reference stays local. A stadium of no team lives on the shard of its own id.
+# Two references may cross shards: an away player who scored, and a match played in another team's stadium. Their
+# foreign keys are dropped on the shards and checked (and cascaded) here instead.
+#
+# The functions take the same arguments and return the same values as the Solution functions of the same names.
+# A call whose argument carries the team (addPlayer, addMatch, addStadium, mostGoalsForTeam) goes to one shard. A call
+# by id alone first finds the shard of the id (one small query on each shard, in parallel) and then runs there, and the
+# league wide reads run on all the shards in parallel and merge their results.
+
+# (table, constraint, column)
+CROSS_SHARD_FOREIGN_KEYS = [("Player_Scored_In", "player_scored_in_player_id_fkey", "player_id"),
+                            ("Played_In", "played_in_stadium_id_fkey", "stadium_id")]
+
+_shards = None
+
+
+def shards() -> List[str]:
+    global _shards
+    if _shards is None:
+        _shards = Connector.DBConnector.shardSections()
+        if not _shards:
+            raise DatabaseException.database_ini_ERROR("database.ini has no shard sections")
+        # the Solution inserts must not check the references the shards do not enforce
+        for section in _shards:
+            Solution.unchecked_references[section] = {(table, column) for table, _, column in CROSS_SHARD_FOREIGN_KEYS}
+    return _shards
+
+
+def shardOf(teamID: int) -> str:
+    # an invalid team goes to the first shard, which rejects it like a single database would
+    return shards()[teamID % len(shards())] if type(teamID) is int else shards()[0]
+
+
+def onShard(section: str, fn, *args):
+    with Connector.useSection(section):
+        return fn(*args)
+
+
+def onEveryShard(fn, *args) -> list:
+    # fn(*args) on every shard in parallel, the results in the order of the shards
+    results = Connector.runMany(onShard, [(section, fn) + args for section in shards()], workers=len(shards()))
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+def _rows(query: sql.Composable, deadline: float = None) -> list:
+    conn = None
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        _, result = conn.execute(query)
+        return result.rows
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def _execute(query: sql.Composable, deadline: float = None) -> int:
+    conn = None
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        rows_effected, _ = conn.execute(query)
+        return rows_effected
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def locate(table: str, column: str, value, deadline: float = None) -> str:
+    # the shard holding the row, None if there is none
+    query = sql.SQL("SELECT 1 FROM {table} WHERE {column} = {value}") \
+        .format(table=sql.Identifier(table.lower()), column=sql.Identifier(column), value=sql.Literal(value))
+    for section, rows in zip(shards(), onEveryShard(_rows, query, deadline)):
+        if rows:
+            return section
+    return None
+
+
+def _dropCrossShardKeys(deadline: float = None):
+    for table, constraint, _ in CROSS_SHARD_FOREIGN_KEYS:
+        _execute(sql.SQL("ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}")
+                 .format(table=sql.Identifier(table.lower()), constraint=sql.Identifier(constraint)), deadline)
+
+
+def createTables(deadline: float = None) -> None:
+    for section in shards():
+        onShard(section, Solution.createTables, deadline)
+        onShard(section, _dropCrossShardKeys, deadline)
+
+
+def clearTables(deadline: float = None):
+    # the shards are cleared in other threads, the profile session of this one is forgotten here
+    Solution._forgetProfile()
+    onEveryShard(Solution.clearTables, deadline)
+
+
+def dropTables(deadline: float = None):
+    Solution._forgetProfile()
+    onEveryShard(Solution.dropTables, deadline)
+
+
+def addTeam(teamID: int, deadline: float = None) -> ReturnValue:
+    try:
+        results = onEveryShard(Solution.addTeam, teamID, deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+    return next((result for result in results if result != ReturnValue.OK), ReturnValue.OK)
+
+
+# an id that is already on some shard is added on that shard again, so the insert fails there exactly as a duplicate
+# fails on a single database, whatever team the new row names
+def _add(fn, row, table: str, column: str, value, home: str, deadline: float) -> ReturnValue:
+    try:
+        section = locate(table, column, value, deadline) or home
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+    return onShard(section, fn, row, deadline)
+
+
+# a row looked up by id is read (or deleted) on its shard, a missing one on the first shard, which answers as a single
+# database would
+def _byId(fn, arg, table: str, column: str, value, deadline: float, *more):
+    section = locate(table, column, value, deadline) or shards()[0]
+    return onShard(section, fn, arg, *more, deadline)
+
+
+def addMatch(match: Match, deadline: float = None) -> ReturnValue:
+    return _add(Solution.addMatch, match, "Matches", "match_id", match.getMatchID(),
+                shardOf(match.getHomeTeamID()), deadline)
+
+
+def getMatchProfile(matchID: int, deadline: float = None) -> Match:
+    try:
+        return _byId(Solution.getMatchProfile, matchID, "Matches", "match_id", matchID, deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return Match.badMatch()
+
+
+def deleteMatch(match: Match, deadline: float = None) -> ReturnValue:
+    # the goals and the attendance of the match are on its shard and go with it
+    try:
+        return _byId(Solution.deleteMatch, match, "Matches", "match_id", match.getMatchID(), deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+
+
+def addPlayer(player: Player, deadline: float = None) -> ReturnValue:
+    return _add(Solution.addPlayer, player, "Players", "player_id", player.getPlayerID(),
+                shardOf(player.getTeamID()), deadline)
+
+
+def getPlayerProfile(playerID: int, deadline: float = None) -> Player:
+    try:
+        return _byId(Solution.getPlayerProfile, playerID, "Players", "player_id", playerID, deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return Player.badPlayer()
+
+
+def deletePlayer(player: Player, deadline: float = None) -> ReturnValue:
+    try:
+        result = _byId(Solution.deletePlayer, player, "Players", "player_id", player.getPlayerID(), deadline)
+        if result == ReturnValue.OK:
+            # the cascade to the goals of the player in the matches of other teams
+            onEveryShard(_execute, sql.SQL("DELETE FROM Player_Scored_In WHERE player_id = {player_id}")
+                         .format(player_id=sql.Literal(player.getPlayerID())), deadline)
+        return result
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+
+
+def addStadium(stadium: Stadium, deadline: float = None) -> ReturnValue:
+    home = shardOf(stadium.getBelongsTo()) if stadium.getBelongsTo() is not None else shardOf(stadium.getStadiumID())
+    return _add(Solution.addStadium, stadium, "Stadiums", "stadium_id", stadium.getStadiumID(), home, deadline)
+
+
+def getStadiumProfile(stadiumID: int, deadline: float = None) -> Stadium:
+    try:
+        return _byId(Solution.getStadiumProfile, stadiumID, "Stadiums", "stadium_id", stadiumID, deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return Stadium.badStadium()
+
+
+def deleteStadium(stadium: Stadium, deadline: float = None) -> ReturnValue:
+    try:
+        result = _byId(Solution.deleteStadium, stadium, "Stadiums", "stadium_id", stadium.getStadiumID(), deadline)
+        if result == ReturnValue.OK:
+            # the cascade to the matches of other teams played in the stadium
+            onEveryShard(_execute, sql.SQL("DELETE FROM Played_In WHERE stadium_id = {stadium_id}")
+                         .format(stadium_id=sql.Literal(stadium.getStadiumID())), deadline)
+        return result
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+
+
+def playerScoredInMatch(match: Match, player: Player, amount: int, deadline: float = None) -> ReturnValue:
+    try:
+        if locate("Players", "player_id", player.getPlayerID(), deadline) is None:
+            # the shard has no foreign key to Players, so the checks it would make before it are made here
+            if None in (match.getMatchID(), player.getPlayerID(), amount):
+                return ReturnValue.ERROR
+            return ReturnValue.BAD_PARAMS if amount <= 0 else ReturnValue.NOT_EXISTS
+        return _byId(Solution.playerScoredInMatch, match, "Matches", "match_id", match.getMatchID(), deadline,
+                     player, amount)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+
+
+def playerDidntScoreInMatch(match: Match, player: Player, deadline: float = None) -> ReturnValue:
+    try:
+        return _byId(Solution.playerDidntScoreInMatch, match, "Matches", "match_id", match.getMatchID(), deadline,
+                     player)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+
+
+def matchInStadium(match: Match, stadium: Stadium, attendance: int, deadline: float = None) -> ReturnValue:
+    try:
+        if locate("Stadiums", "stadium_id", stadium.getStadiumID(), deadline) is None:
+            # the shard has no foreign key to Stadiums, so the checks it would make before it are made here
+            if None in (match.getMatchID(), stadium.getStadiumID(), attendance):
+                return ReturnValue.ERROR
+            if attendance < 0:
+                return ReturnValue.BAD_PARAMS
+            if locate("Played_In", "match_id", match.getMatchID(), deadline) is not None:
+                return ReturnValue.ALREADY_EXISTS
+            return ReturnValue.NOT_EXISTS
+        return _byId(Solution.matchInStadium, match, "Matches", "match_id", match.getMatchID(), deadline,
+                     stadium, attendance)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+
+
+def matchNotInStadium(match: Match, stadium: Stadium, deadline: float = None) -> ReturnValue:
+    try:
+        return _byId(Solution.matchNotInStadium, match, "Matches", "match_id", match.getMatchID(), deadline,
+                     stadium)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return ReturnValue.ERROR
+
+
+def averageAttendanceInStadium(stadiumID: int, deadline: float = None) -> float:
+    # the matches played in the stadium can be on any shard, so the shards send sums and counts, not averages
+    try:
+        parts = onEveryShard(_rows, sql.SQL("SELECT COALESCE(SUM(audience_number), 0), COUNT(*) FROM Played_In"
+                                            " WHERE stadium_id = {stadium_id}")
+                             .format(stadium_id=sql.Literal(stadiumID)), deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return float(-1)
+    total = sum(rows[0][0] for rows in parts)
+    count = sum(rows[0][1] for rows in parts)
+    return float(total) / count if count else float(0)
+
+
+def stadiumTotalGoals(stadiumID: int, deadline: float = None) -> int:
+    try:
+        parts = onEveryShard(_rows, sql.SQL("SELECT COALESCE(SUM(G.goals), 0)"
+                                            " FROM Played_In P INNER JOIN MatchGoals G ON P.match_id = G.match_id"
+                                            " WHERE P.stadium_id = {stadium_id}")
+                             .format(stadium_id=sql.Literal(stadiumID)), deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return -1
+    return sum(rows[0][0] for rows in parts)
+
+
+def playerIsWinner(playerID: int, matchID: int, deadline: float = None) -> bool:
+    # the goals of a match are all on its shard
+    try:
+        return _byId(Solution.playerIsWinner, playerID, "Matches", "match_id", matchID, deadline, matchID)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return False
+
+
+# a team is tall and rich on its own shard, it is active if any shard has a match of it
+def _teamSets(deadline: float) -> (set, set, set):
+    def teams(query):
+        return {team_id for rows in onEveryShard(_rows, sql.SQL(query), deadline) for team_id, in rows}
+    return (teams("SELECT team_id FROM TallTeams"),
+            teams("SELECT team_id FROM Played_At_Least_One_Match"),
+            teams("SELECT team_id FROM Stadiums WHERE capacity > 55000"))
+
+
+def getActiveTallTeams(deadline: float = None) -> List[int]:
+    try:
+        tall, active, _ = _teamSets(deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    return sorted(tall & active, reverse=True)[:5]
+
+
+def getActiveTallRichTeams(deadline: float = None) -> List[int]:
+    try:
+        tall, active, rich = _teamSets(deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    return sorted(tall & active & rich)[:5]
+
+
+def popularTeams(deadline: float = None) -> List[int]:
+    # the home matches of a team and their attendance are all on its shard, so every shard ranks its own teams (every
+    # shard has all the teams, only its own are asked about) and the top 10 of the shards' top 10s is the answer
+    def shardTop(deadline):
+        section, count = Connector.currentSection(), len(shards())
+        query = sql.SQL("SELECT team_id"
+                        " FROM DidntPlayAtHome "
+                        " WHERE team_id % {count} = {index} "
+                        "UNION "
+                        "   SELECT first_team_id "
+                        "   FROM PopularNotEmptyWay "
+                        "ORDER BY team_id DESC "
+                        " LIMIT 10").format(count=sql.Literal(count), index=sql.Literal(shards().index(section)))
+        return [team_id for team_id, in _rows(query, deadline)]
+    try:
+        tops = onEveryShard(shardTop, deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    return sorted((team_id for top in tops for team_id in top), reverse=True)[:10]
+
+
+def getMostAttractiveStadiums(deadline: float = None) -> List[int]:
+    # a stadium's goals are spread over the shards of the matches played in it, so each shard sends its part of every
+    # stadium's total and the ranking is made from the sums
+    try:
+        stadiums = onEveryShard(_rows, sql.SQL("SELECT stadium_id FROM Stadiums"), deadline)
+        parts = onEveryShard(_rows, sql.SQL("SELECT P.stadium_id, SUM(G.goals)"
+                                            " FROM Played_In P INNER JOIN MatchGoals G ON P.match_id = G.match_id"
+                                            " GROUP BY P.stadium_id"), deadline)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    goals = {stadium_id: 0 for rows in stadiums for stadium_id, in rows}
+    for rows in parts:
+        for stadium_id, part in rows:
+            if stadium_id in goals:
+                goals[stadium_id] += part
+    return sorted(goals, key=lambda stadium_id: (-goals[stadium_id], stadium_id))
+
+
+def mostGoalsForTeam(teamID: int, deadline: float = None) -> List[int]:
+    # the players are on the team's shard, their goals on the shards of the matches they scored in
+    try:
+        players = onShard(shardOf(teamID), _rows, sql.SQL("SELECT player_id FROM Players WHERE team_id = {team_id}")
+                          .format(team_id=sql.Literal(teamID)), deadline)
+        goals = {player_id: 0 for player_id, in players}
+        if goals:
+            parts = onEveryShard(_rows, sql.SQL("SELECT player_id, SUM(num_of_goals) FROM Player_Scored_In"
+                                                " WHERE player_id = ANY({players}) GROUP BY player_id")
+                                 .format(players=sql.Literal(list(goals))), deadline)
+            for rows in parts:
+                for player_id, part in rows:
+                    goals[player_id] += part
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    return sorted(goals, key=lambda player_id: (-goals[player_id], -player_id))[:5]
+
+
+def getClosePlayers(playerID: int, deadline: float = None) -> List[int]:
+    # each shard counts the player's matches among its matches and, for every other player, how many of these they
+    # also scored in. The sums decide, and if the player never scored everyone is close, which is the 10 lowest ids
+    # of the shards' 10 lowest ids
+    def shardCounts(deadline):
+        scored = _rows(sql.SQL("SELECT COUNT(*) FROM Player_Scored_In WHERE player_id = {player_id}")
+                       .format(player_id=sql.Literal(playerID)), deadline)[0][0]
+        shared = _rows(sql.SQL("SELECT G.player_id, COUNT(*)"
+                               " FROM Player_Scored_In PM INNER JOIN Player_Scored_In G ON PM.match_id = G.match_id"
+                               " WHERE PM.player_id = {player_id} AND G.player_id <> {player_id}"
+                               " GROUP BY G.player_id").format(player_id=sql.Literal(playerID)), deadline)
+        return scored, shared
+    try:
+        counts = onEveryShard(shardCounts, deadline)
+        scored = sum(shard_scored for shard_scored, _ in counts)
+        if scored == 0:
+            lowest = onEveryShard(_rows, sql.SQL("SELECT player_id FROM Players WHERE player_id <> {player_id}"
+                                                 " ORDER BY player_id LIMIT 10")
+                                  .format(player_id=sql.Literal(playerID)), deadline)
+            return sorted(player_id for rows in lowest for player_id, in rows)[:10]
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    shared = {}
+    for _, rows in counts:
+        for player_id, part in rows:
+            shared[player_id] = shared.get(player_id, 0) + part
+    return sorted(player_id for player_id, together in shared.items() if 2 * together >= scored)[:10]
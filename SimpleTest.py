@@ -1,6 +1,21 @@
+import io
+import os
+import tempfile
+import threading
+import time
 import unittest
 import Solution
 from Utility.ReturnValue import ReturnValue
+from Utility.Exceptions import DatabaseException
+import Utility.DBConnector as Connector
+from psycopg2 import sql
+from CoScoringGraph import CoScoringGraph
+import ColumnarSnapshot
+from ColumnarSnapshot import ColumnarSink, SNAPSHOT_TABLES, loadSnapshot
+from LeagueFile import LeagueFile, exportLeagueFile
+from WriteBehind import WriteBehindQueue
+from Workload import WorkloadRecorder, readTrace, replayTrace, mismatches
+import Sharding
 from Tests.abstractTest import AbstractTest
 from Business.Match import Match
 from Business.Stadium import Stadium
@@ -44,7 +59,541 @@ class Test(AbstractTest):
         self.assertEqual(ReturnValue.ALREADY_EXISTS, Solution.addStadium(Stadium(1, 5000, 1)), "ID 1 already exists")
         self.assertEqual(ReturnValue.BAD_PARAMS, Solution.addStadium(Stadium(2, 5000, 3)), "teamID 3 not exists")
 
+    def test_Deadline(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1, deadline=5), "Should work")
+        conn = Connector.DBConnector(deadline=0.5)
+        try:
+            with self.assertRaises(DatabaseException.QUERY_TIMEOUT):
+                conn.execute("SELECT pg_sleep(5)")
+            # a timeout is caught by the callers that catch any DatabaseException
+            with self.assertRaises(DatabaseException):
+                conn.execute("SELECT pg_sleep(5)")
+        finally:
+            conn.close()
+
+    def test_LeagueDashboard(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 195, "Left")), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(2, 1, 20, 199, "Left")), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                      Player(2, 1, 20, 199, "Left"), 3), "Should work")
+        dashboard = Solution.getLeagueDashboard([1, 2])
+        self.assertEqual(Solution.getActiveTallTeams(), dashboard["activeTallTeams"], "Same as getActiveTallTeams")
+        self.assertEqual(Solution.popularTeams(), dashboard["popularTeams"], "Same as popularTeams")
+        self.assertEqual({1: [2, 1], 2: []}, dashboard["mostGoalsForTeam"], "Same as mostGoalsForTeam")
+
+    def test_KeysetPages(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        for player_id in range(1, 6):
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(player_id, 1, 20, 180, "Left")), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                      Player(2, 1, 20, 180, "Left"), 3), "Should work")
+        page, cursor = Solution.mostGoalsForTeamPage(1, 2)
+        self.assertEqual([2, 5], page, "Best scorer first, ties by id descending")
+        page, cursor = Solution.mostGoalsForTeamPage(1, 2, cursor)
+        self.assertEqual([4, 3], page, "Continues after the previous page")
+        page, cursor = Solution.mostGoalsForTeamPage(1, 2, cursor)
+        self.assertEqual(([1], None), (page, cursor), "Last page has no cursor")
+        self.assertEqual(([], None), Solution.mostGoalsForTeamPage(1, 2, "not a cursor"), "Bad cursor")
+
+    def test_CoScoringGraph(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        for player_id in range(1, 5):
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(player_id, 1, 20, 180, "Left")), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(2, "Domestic", 1, 2)), "Should work")
+        graph = CoScoringGraph()
+        graph.load()
+        Solution.attachCoScoringGraph(graph)
+        try:
+            for player_id, match_id in [(1, 1), (2, 1), (2, 2), (3, 2)]:
+                self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(
+                    Match(match_id, "Domestic", 1, 2), Player(player_id, 1, 20, 180, "Left"), 1), "Should work")
+            self.assertEqual([2], Solution.getClosePlayers(1), "Scored together in match 1")
+            self.assertEqual([1, 3], Solution.getClosePlayers(2), "Half of player 2's matches")
+            self.assertEqual([2, 3], graph.playersWithinHops(1, 2), "Player 3 is close to player 2")
+            self.assertEqual([[1, 2, 3]], graph.clusters(), "Linked through player 2")
+            self.assertEqual([1, 2, 3], graph.closePlayers(4), "Everyone is close to a player who never scored")
+            self.assertEqual([1, 2], graph.closePlayers(4, limit=2), "The first two by id")
+            self.assertEqual([1], graph.closePlayers(2, limit=1), "The first close one")
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(5, 1, 20, 180, "Left")), "Should work")
+            self.assertEqual([1, 2, 3, 5], graph.closePlayers(4), "The new player is close too")
+            self.assertEqual(ReturnValue.OK, Solution.deletePlayer(Player(5, 1, 20, 180, "Left")), "Should work")
+            self.assertEqual([1, 2, 3], graph.closePlayers(4), "The deleted player is gone")
+            self.assertEqual(ReturnValue.OK, Solution.playerDidntScoreInMatch(Match(1, "Domestic", 1, 2),
+                                                                             Player(2, 1, 20, 180, "Left")), "Should work")
+            self.assertEqual([[1], [2, 3]], graph.clusters(), "Player 1 is on their own")
+            self.assertEqual([], Solution.getClosePlayers(1), "Nobody else scored in match 1")
+        finally:
+            Solution.attachCoScoringGraph(None)
+        self.assertEqual([], Solution.getClosePlayers(1), "Same answer from the database")
+        self.assertEqual([3], Solution.getClosePlayers(2), "Same answer from the database")
+
+    def test_WriteBehind(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(1, 50000, 1)), "Should work")
+        with WriteBehindQueue(max_delay=0.5) as writes:
+            futures = [writes.playerScoredInMatch(Match(1, "Domestic", 1, 2), Player(1, 1, 20, 180, "Left"), 2),
+                       writes.playerScoredInMatch(Match(1, "Domestic", 1, 2), Player(1, 1, 20, 180, "Left"), 1),
+                       writes.playerScoredInMatch(Match(2, "Domestic", 1, 2), Player(1, 1, 20, 180, "Left"), 1),
+                       writes.playerScoredInMatch(Match(1, "Domestic", 1, 2), Player(1, 1, 20, 180, "Left"), 0),
+                       writes.matchInStadium(Match(1, "Domestic", 1, 2), Stadium(2, 50000, 1), 100),
+                       writes.matchInStadium(Match(1, "Domestic", 1, 2), Stadium(1, 50000, 1), 100),
+                       writes.matchInStadium(Match(1, "Domestic", 1, 2), Stadium(1, 50000, 1), -1)]
+        self.assertEqual([ReturnValue.OK, ReturnValue.ALREADY_EXISTS, ReturnValue.NOT_EXISTS, ReturnValue.BAD_PARAMS,
+                          ReturnValue.NOT_EXISTS, ReturnValue.OK, ReturnValue.BAD_PARAMS],
+                         [future.result() for future in futures], "Same as the direct calls")
+        self.assertEqual(2, Solution.stadiumTotalGoals(1), "Written in one batch")
+
+    def test_ColumnarSnapshot(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(2, 2, 31, 195, "Right")), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                      Player(2, 2, 31, 195, "Right"), 3), "Should work")
+        snapshot = loadSnapshot()
+        players = sorted(zip(*(snapshot["players"][name] for name in snapshot["players"].names())))
+        self.assertEqual([(1, 1, 20, 180, 1), (2, 2, 31, 195, 0)], players, "Every player, column by column")
+        self.assertEqual([2], list(snapshot["scores"]["player_id"]), "The scorer")
+        self.assertEqual(0, len(snapshot["attendance"]), "No match was played in a stadium")
+        stream = io.BytesIO()
+        conn = Connector.DBConnector()
+        try:
+            conn.copyOut((f"COPY ({SNAPSHOT_TABLES['players'][0]}) TO STDOUT (FORMAT binary)", stream))
+        finally:
+            conn.close()
+        chunk_bytes = ColumnarSnapshot.COPY_CHUNK_BYTES
+        try:
+            # the rows are cut across the chunks
+            ColumnarSnapshot.COPY_CHUNK_BYTES = 16
+            sink = ColumnarSink(SNAPSHOT_TABLES["players"][1])
+            data = stream.getvalue()
+            for start in range(0, len(data), 7):
+                sink.write(data[start:start + 7])
+            chunked = sink.close()
+        finally:
+            ColumnarSnapshot.COPY_CHUNK_BYTES = chunk_bytes
+        self.assertEqual(list(snapshot["players"]["height"]), list(chunked["height"]), "The same columns")
+
+    def test_LeagueFile(self) -> None:
+        for team_id in range(1, 4):
+            self.assertEqual(ReturnValue.OK, Solution.addTeam(team_id), "Should work")
+        for player_id, team_id, height in [(1, 1, 195), (2, 1, 200), (3, 2, 191), (4, 2, 180), (5, 3, 192), (6, 3, 193)]:
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(player_id, team_id, 20, height, "Left")),
+                             "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(1, 60000, 1)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(2, 30000, None)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.matchInStadium(Match(1, "Domestic", 1, 2), Stadium(2, 30000, None),
+                                                                 45000), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                      Player(3, 2, 20, 191, "Left"), 2), "Should work")
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "league.snap")
+        try:
+            exportLeagueFile(path)
+            league = LeagueFile(path)
+            # the file answers as the database did when it was exported
+            self.assertEqual(ReturnValue.OK, Solution.deleteMatch(Match(1, "Domestic", 1, 2)), "Should work")
+            self.assertEqual([1], league.getActiveTallTeams(), "Team 3 never played")
+            self.assertEqual([1], league.getActiveTallRichTeams(), "Team 1 has a big stadium")
+            self.assertEqual([3, 2, 1], league.popularTeams(), "Team 1 hosted 45000 people")
+            self.assertEqual([2, 1], league.getMostAttractiveStadiums(), "Stadium 2 saw two goals")
+            self.assertEqual([3, 4], league.mostGoalsForTeam(2), "Player 3 scored")
+            self.assertEqual([], league.mostGoalsForTeam(4), "No such team")
+            del league
+        finally:
+            os.remove(path)
+            os.rmdir(directory)
+
+    def test_Workload(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            trace = os.path.join(directory, "trace.jsonl")
+            with WorkloadRecorder(trace):
+                self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+                self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Should work")
+                self.assertEqual(ReturnValue.ALREADY_EXISTS, Solution.addTeam(1), "ID 1 already exists")
+                self.assertEqual(1, Solution.getTeamReport(1)["roster"][0].getPlayerID(), "One player")
+                self.assertEqual([1], [player.getPlayerID() for player in Solution.findPlayers({})], "Streamed")
+                rows = Solution.findPlayers({})
+                self.assertEqual(1, next(rows).getPlayerID(), "Should work")
+                time.sleep(0.2)
+                rows.close()
+                Solution.averageAttendanceInStadium(1, deadline=5)
+                self.assertEqual([ReturnValue.OK, ReturnValue.NOT_EXISTS], Solution.deletePlayers([1, 1]),
+                                 "Should work")
+            Solution.addTeam(2)
+            calls = readTrace(trace)
+            # getTeamReport calls getTeamReports, only the outer call is recorded
+            self.assertEqual(["addTeam", "addPlayer", "addTeam", "getTeamReport", "findPlayers", "findPlayers",
+                              "averageAttendanceInStadium", "deletePlayers"], [call["f"] for call in calls],
+                             "Every call once")
+            self.assertEqual({"R": "ALREADY_EXISTS"}, calls[2]["r"], "The ReturnValue")
+            self.assertEqual((True, None), (calls[4].get("done"), calls[5].get("done")), "Only the first was read out")
+            self.assertLess(calls[5]["ms"], 200, "The reader's time is not the stream's")
+            self.assertEqual({"deadline": 5}, calls[6]["k"], "Keyword arguments")
+            Solution.clearTables()
+            replayed = replayTrace(calls, speed=0)
+            self.assertEqual([], mismatches(calls, replayed), "The same results on a database in the same state")
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Replayed too")
+            self.assertEqual([0, 1], mismatches(calls, replayTrace(calls, speed=0)), "Team 1 and player 1 exist")
+
+    def test_ApproximateAttendance(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(1, 90000, 1)), "Should work")
+        for match_id, audience in [(1, 1000), (2, 3000)]:
+            self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(match_id, "Domestic", 1, 2)), "Should work")
+            self.assertEqual(ReturnValue.OK, Solution.matchInStadium(Match(match_id, "Domestic", 1, 2),
+                                                                     Stadium(1, 90000, 1), audience), "Should work")
+        # a small stadium is averaged exactly
+        self.assertEqual(Solution.Estimate(2000.0, 2000.0, 2000.0, True),
+                         Solution.averageAttendanceInStadium(1, approximate=True), "Exact")
+        self.assertEqual(Solution.Estimate(0.0, 0.0, 0.0, True),
+                         Solution.averageAttendanceInStadium(2, approximate=True), "No matches")
+        self.assertEqual(Solution.Estimate(0, 0, 0, True), Solution.stadiumTotalGoals(1, approximate=True), "Counter")
+        self.assertEqual(Solution.ESTIMATE_ERROR,
+                         Solution.averageAttendanceInStadium(1, approximate=True, confidence=1), "Bad confidence")
+        self.assertFalse(Solution.ESTIMATE_ERROR.exact, "An error is not exact")
+        exact_below, sample_rows = Solution.APPROXIMATE_EXACT_BELOW, Solution.APPROXIMATE_SAMPLE_ROWS
+        conn = Connector.DBConnector()
+        try:
+            Solution.APPROXIMATE_EXACT_BELOW, Solution.APPROXIMATE_SAMPLE_ROWS = 0, 50
+            self.assertTrue(Solution.averageAttendanceInStadium(1, approximate=True).exact, "Fits the sample")
+            for matches in (1000, 10000):
+                conn.execute(sql.SQL("INSERT INTO Matches SELECT id, 'Domestic', 1, 2"
+                                     " FROM generate_series(3, {last}) id ON CONFLICT DO NOTHING;"
+                                     " INSERT INTO Played_In SELECT id, 1, 1000 * (id % 7)"
+                                     " FROM generate_series(3, {last}) id ON CONFLICT DO NOTHING;"
+                                     " ANALYZE Played_In").format(last=sql.Literal(matches)))
+                _, result = conn.execute(sql.SQL("EXPLAIN (ANALYZE, FORMAT JSON) ") +
+                                         Solution.ATTENDANCE_SAMPLE_QUERY.format(stadium_id=sql.Literal(1),
+                                                                                 rows=sql.Literal(50)))
+                nodes, read = [result.rows[0][0][0]["Plan"]], 0
+                while nodes:
+                    node = nodes.pop()
+                    nodes += node.get("Plans", [])
+                    if node.get("Relation Name") == "played_in":
+                        read += node["Actual Rows"] * node["Actual Loops"]
+                self.assertEqual(50, read, "The sample is read from the stadium's index range alone")
+                exact = float(Solution.averageAttendanceInStadium(1))
+                estimate = Solution.averageAttendanceInStadium(1, approximate=True, confidence=0.999)
+                self.assertFalse(estimate.exact, "Sampled")
+                self.assertTrue(estimate.low < exact < estimate.high, "The interval holds the average")
+        finally:
+            Solution.APPROXIMATE_EXACT_BELOW, Solution.APPROXIMATE_SAMPLE_ROWS = exact_below, sample_rows
+            conn.close()
+
+    def test_Tuning(self) -> None:
+        with Connector.useSettings({"work_mem": "7MB"}):
+            conn = Connector.DBConnector()
+        try:
+            # every transaction of the connection gets the settings, and only its transactions
+            for _ in range(2):
+                _, result = conn.execute("SELECT current_setting('work_mem') AS work_mem")
+                self.assertEqual("7MB", result[0]["work_mem"], "SET LOCAL")
+            # the settings do not change the text of the query, a leading comment stays in front
+            _, result = conn.execute("/* tagged */ SELECT query FROM pg_stat_activity WHERE pid = pg_backend_pid()")
+            self.assertTrue(result[0]["query"].startswith("/* tagged */"), "The query as it was given")
+        finally:
+            conn.close()
+        self.assertEqual("64MB", Solution.tuningSettings("getClosePlayers")["work_mem"], "Analytic")
+        self.assertEqual({}, Solution.tuningSettings("createTables"), "Not tuned")
+        self.assertEqual(Solution.ANALYTIC, Solution.FUNCTION_TUNING["findPlayers"], "Entered by @tuned")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Should work")
+        lookup = Solution.TUNING_PROFILES[Solution.LOOKUP]
+        try:
+            Solution.TUNING_PROFILES[Solution.LOOKUP] = {"work_mem": "not a size"}
+            self.assertIsNone(Solution.getPlayerProfile(1).getPlayerID(), "The lookup runs with its profile")
+        finally:
+            Solution.TUNING_PROFILES[Solution.LOOKUP] = lookup
+        self.assertEqual(1, Solution.getPlayerProfile(1).getPlayerID(), "Should work")
+
+    def test_BulkDeletes(self) -> None:
+        for team_id in range(1, 4):
+            self.assertEqual(ReturnValue.OK, Solution.addTeam(team_id), "Should work")
+        matches = [Match(match_id, "Domestic", 1, 2) for match_id in range(1, 5)]
+        players = [Player(player_id, 1, 20, 180, "Left") for player_id in range(1, 4)]
+        stadiums = [Stadium(stadium_id, 50000, None) for stadium_id in range(1, 3)]
+        for row, add in [(matches, Solution.addMatch), (players, Solution.addPlayer), (stadiums, Solution.addStadium)]:
+            for item in row:
+                self.assertEqual(ReturnValue.OK, add(item), "Should work")
+        for match in matches:
+            self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(match, players[0], 1), "Should work")
+            self.assertEqual(ReturnValue.OK, Solution.matchInStadium(match, stadiums[0], 1000), "Should work")
+        self.assertEqual([ReturnValue.OK, ReturnValue.NOT_EXISTS, ReturnValue.NOT_EXISTS, ReturnValue.OK],
+                         Solution.playersDidntScoreInMatches([(matches[0], players[0]), (matches[0], players[0]),
+                                                              (matches[1], players[1]), (2, 1)]), "By pair")
+        self.assertEqual([ReturnValue.OK, ReturnValue.NOT_EXISTS],
+                         Solution.matchesNotInStadiums([(1, 1), (2, 2)]), "The stadium must match")
+        self.assertEqual(2, Solution.stadiumTotalGoals(1), "Two scores left in stadium 1")
+        self.assertEqual([ReturnValue.OK, ReturnValue.OK, ReturnValue.NOT_EXISTS, ReturnValue.NOT_EXISTS],
+                         Solution.deleteMatches([matches[2], 4, 4, 99]), "Objects and ids")
+        self.assertEqual(0, Solution.stadiumTotalGoals(1), "Their scores went with them")
+        self.assertEqual(Match.badMatch().getMatchID(), Solution.getMatchProfile(4).getMatchID(), "Match 4 is gone")
+        self.assertEqual([ReturnValue.OK, ReturnValue.ERROR], Solution.deletePlayers([players[2], "3"]), "Bad id")
+        self.assertEqual([ReturnValue.OK, ReturnValue.OK], Solution.deleteStadiums(stadiums), "Both")
+        self.assertEqual(2, Solution.getMatchProfile(2).getMatchID(), "Match 2 is still there")
+        self.assertEqual([], Solution.deleteMatches([]), "Nothing to delete")
+
+    def test_FindPlayers(self) -> None:
+        for team_id in range(1, 4):
+            self.assertEqual(ReturnValue.OK, Solution.addTeam(team_id), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "International", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(2, "Domestic", 3, 1)), "Should work")
+        players = [Player(1, 1, 19, 186, "Left"), Player(2, 2, 21, 190, "Left"), Player(3, 2, 25, 190, "Left"),
+                   Player(4, 3, 20, 188, "Left"), Player(5, 1, 20, 184, "Left"), Player(6, 1, 22, 195, "Right")]
+        for player in players:
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(player), "Should work")
+        for player_id, goals in [(1, 1), (2, 3), (6, 5)]:
+            self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(Match(1, "International", 1, 2),
+                                                                          players[player_id - 1], goals),
+                             "Should work")
+        scouting = {"minAge": 18, "maxAge": 22, "minHeight": 185, "preferredFoot": "Left",
+                    "competition": "International"}
+        found = list(Solution.findPlayers(scouting))
+        self.assertEqual([1, 2], [player.getPlayerID() for player in found], "Young, tall, left footed")
+        self.assertEqual(186, found[0].getHeight(), "Whole players")
+        self.assertEqual([2], [player.getPlayerID() for player in Solution.findPlayers(dict(scouting, minGoals=2))],
+                         "Two goals or more")
+        self.assertEqual([6, 2, 1], [player.getPlayerID() for player in Solution.findPlayers({}, "-goals", 3)],
+                         "Top scorers")
+        self.assertEqual([1, 4, 5, 6],
+                         [player.getPlayerID() for player in Solution.findPlayers({"competition": "Domestic"}, "age")],
+                         "By age")
+        self.assertEqual([], list(Solution.findPlayers({"weight": 80})), "Unknown filter")
+        self.assertEqual([], list(Solution.findPlayers({}, "name")), "Unknown order")
+        # stopping early ends the stream and gives the connection back
+        stream = Solution.findPlayers({}, batchSize=2)
+        self.assertEqual(1, next(stream).getPlayerID(), "First player")
+        stream.close()
+        self.assertEqual(6, len(list(Solution.findPlayers({}, batchSize=4))), "Batches of 4")
+
+    def test_TeamReport(self) -> None:
+        for team_id in range(1, 4):
+            self.assertEqual(ReturnValue.OK, Solution.addTeam(team_id), "Should work")
+        for player_id, height in [(1, 195), (2, 200), (3, 180)]:
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(player_id, 1, 20, height, "Left")),
+                             "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(1, 60000, 1)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(2, "Domestic", 3, 1)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.matchInStadium(Match(1, "Domestic", 1, 2), Stadium(1, 60000, 1),
+                                                                 50000), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                      Player(3, 1, 20, 180, "Left"), 2), "Should work")
+        report = Solution.getTeamReport(1)
+        self.assertEqual([1, 2, 3], [player.getPlayerID() for player in report["roster"]], "The roster")
+        self.assertEqual(Solution.mostGoalsForTeam(1), report["topScorers"], "The top scorers")
+        self.assertEqual((1, 1), (report["homeMatches"], report["awayMatches"]), "One of each")
+        self.assertEqual(1, report["stadium"].getStadiumID(), "Stadium 1")
+        self.assertEqual(Solution.averageAttendanceInStadium(1), report["averageAttendance"], "The attendance")
+        self.assertEqual(2, report["stadiumGoals"], "Two goals")
+        self.assertEqual((True, True, True), (report["tall"], report["active"], report["popular"]), "Flags")
+        reports = Solution.getTeamReports([2, 3, 4])
+        self.assertEqual([2, 3], sorted(reports), "No team 4")
+        self.assertIsNone(reports[2]["stadium"], "Team 2 has no stadium")
+        self.assertEqual((False, True, True), (reports[2]["tall"], reports[2]["active"], reports[2]["popular"]),
+                         "Team 2 played away only")
+        self.assertFalse(reports[3]["popular"], "Team 3 hosted a match that was not played in a stadium")
+        self.assertIsNone(Solution.getTeamReport(4), "No team 4")
+
+    def test_PhaseHooks(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Should work")
+        phases = []
+        hook = lambda phase, seconds: phases.append(phase)
+        Connector.addPhaseHook(hook)
+        try:
+            self.assertEqual(1, Solution.getPlayerProfile(1).getPlayerID(), "Should work")
+        finally:
+            Connector.removePhaseHook(hook)
+        self.assertEqual(["config", "connect", "compose", "execute", "commit", "fetch", "materialize"], phases,
+                         "One query, every phase once")
+        Solution.getPlayerProfile(1)
+        self.assertEqual(7, len(phases), "Nothing is timed without a hook")
+
+    def test_ConflictPrecedence(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Should work")
+        # the key is checked before the references, the CHECK constraints before both
+        self.assertEqual(ReturnValue.ALREADY_EXISTS, Solution.addMatch(Match(1, "Domestic", 7, 2)), "Key first")
+        self.assertEqual(ReturnValue.BAD_PARAMS, Solution.addMatch(Match(1, "Friendly", 7, 2)), "CHECK first")
+        self.assertEqual(ReturnValue.BAD_PARAMS, Solution.addPlayer(Player(2, 7, 20, 180, "Left")), "No team 7")
+        self.assertEqual(ReturnValue.OK, Solution.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                      Player(1, 1, 20, 180, "Left"), 1), "Should work")
+        self.assertEqual(ReturnValue.ALREADY_EXISTS, Solution.playerScoredInMatch(
+            Match(1, "Domestic", 1, 2), Player(1, 1, 20, 180, "Left"), 2), "Scored already")
+        self.assertEqual(ReturnValue.NOT_EXISTS, Solution.playerScoredInMatch(
+            Match(1, "Domestic", 1, 2), Player(2, 1, 20, 180, "Left"), 2), "No player 2")
+        self.assertEqual(ReturnValue.BAD_PARAMS, Solution.playerScoredInMatch(
+            Match(1, "Domestic", 1, 2), Player(2, 1, 20, 180, "Left"), 0), "CHECK first")
+        self.assertEqual(ReturnValue.NOT_EXISTS, Solution.matchInStadium(Match(1, "Domestic", 1, 2),
+                                                                         Stadium(1, 100, None), 10), "No stadium 1")
+        self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(1, 100, 1)), "Should work")
+        self.assertEqual(ReturnValue.ALREADY_EXISTS, Solution.addStadium(Stadium(2, 100, 1)), "Team 1 has one")
+
+    def test_ProfileSession(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(1, 1, 20, 180, "Left")), "Should work")
+        with Solution.profileSession():
+            player = Solution.getPlayerProfile(1)
+            self.assertIs(player, Solution.getPlayerProfile(1), "The same object")
+            missing = Solution.getMatchProfile(1)
+            self.assertIsNone(missing.getMatchID(), "No such match")
+            self.assertIs(missing, Solution.getMatchProfile(1), "The miss is remembered")
+            self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+            self.assertEqual(1, Solution.getMatchProfile(1).getMatchID(), "The add forgot the miss")
+            self.assertEqual(ReturnValue.OK, Solution.deletePlayer(player), "Should work")
+            self.assertIsNone(Solution.getPlayerProfile(1).getPlayerID(), "The delete forgot the player")
+        self.assertIsNot(Solution.getMatchProfile(1), Solution.getMatchProfile(1), "No session")
+
+    def test_TallTeams(self) -> None:
+        for team_id in range(1, 5):
+            self.assertEqual(ReturnValue.OK, Solution.addTeam(team_id), "Should work")
+        for player_id, team_id, height in [(1, 1, 195), (2, 1, 200), (3, 2, 191), (4, 2, 192), (5, 2, 193),
+                                           (6, 3, 195), (7, 3, 180), (8, 4, 199), (9, 4, 198)]:
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(player_id, team_id, 20, height, "Left")),
+                             "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(2, "Domestic", 3, 4)), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(1, 60000, 2)), "Should work")
+        self.assertEqual(Solution.getActiveTallTeams(), Solution.getTallTeams(), "The defaults")
+        self.assertEqual([4, 2, 1], Solution.getTallTeams(), "Team 3 has one tall player")
+        self.assertEqual([2], Solution.getTallTeams(minCount=3), "Three tall players")
+        self.assertEqual([4, 1], Solution.getTallTeams(minHeight=194), "Taller than 194")
+        self.assertEqual([2], Solution.getTallTeams(minCapacity=55000), "A big stadium")
+        self.assertEqual([4], Solution.getTallTeams(limit=1), "The first one")
+        self.assertEqual(ReturnValue.OK, Solution.deleteMatch(Match(2, "Domestic", 3, 4)), "Should work")
+        self.assertEqual([2, 1], Solution.getTallTeams(), "Team 4 did not play")
+        self.assertEqual([4, 2, 1], Solution.getTallTeams(activeOnly=False), "Team 4 is still tall")
+
+    def test_TallTeamsLimit(self) -> None:
+        # more than 5 teams qualify, so the limit and the order decide which ones are listed
+        for team_id in range(1, 9):
+            self.assertEqual(ReturnValue.OK, Solution.addTeam(team_id), "Should work")
+            for player_id in (2 * team_id - 1, 2 * team_id):
+                self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(player_id, team_id, 20, 195, "Left")),
+                                 "Should work")
+            self.assertEqual(ReturnValue.OK, Solution.addStadium(Stadium(team_id, 60000, team_id)), "Should work")
+        for match_id in range(1, 5):
+            self.assertEqual(ReturnValue.OK, Solution.addMatch(Match(match_id, "Domestic", 2 * match_id - 1,
+                                                                     2 * match_id)), "Should work")
+        self.assertEqual([8, 7, 6, 5, 4], Solution.getActiveTallTeams(), "The highest 5")
+        self.assertEqual(Solution.getActiveTallTeams(), Solution.getTallTeams(), "The defaults")
+        self.assertEqual([1, 2, 3, 4, 5], Solution.getActiveTallRichTeams(), "The lowest 5")
+        self.assertEqual(Solution.getActiveTallRichTeams(), Solution.getTallTeams(minCapacity=55000, ascending=True),
+                         "Big stadiums, lowest ids first")
+
+    def test_PlayerAnalytics(self) -> None:
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+        self.assertEqual(ReturnValue.OK, Solution.addTeam(2), "Should work")
+        for player_id, age, height, foot in [(1, 20, 180, "Left"), (2, 25, 191, "Right"), (3, 30, 200, "Left")]:
+            self.assertEqual(ReturnValue.OK, Solution.addPlayer(Player(player_id, 1, age, height, foot)),
+                             "Should work")
+        self.assertEqual([(180, 187, 1), (187, 194, 1), (194, 201, 1)],
+                         Solution.getPlayerAttributeHistogram("height", 3), "Three ranges of 7 cm")
+        self.assertEqual([(20, 26, 2), (26, 32, 1)], Solution.getPlayerAttributeHistogram("age", 2, 1),
+                         "Team 1 by age")
+        self.assertEqual([], Solution.getPlayerAttributeHistogram("age", 2, 2), "Team 2 has no players")
+        self.assertEqual([], Solution.getPlayerAttributeHistogram("player_id", 2), "Not an attribute")
+        stats = Solution.getTeamPlayerStats([1, 2])
+        self.assertEqual({"players": 3, "tallPlayers": 2, "leftFooted": 2, "rightFooted": 1,
+                          "heightQuartiles": [185.5, 191.0, 195.5], "ageQuartiles": [22.5, 25.0, 27.5]}, stats[1],
+                         "Team 1")
+        self.assertEqual(0, stats[2]["players"], "Team 2 has no players")
+        self.assertIsNone(stats[2]["heightQuartiles"], "Team 2 has no players")
+
+    def test_ChangeNotifications(self) -> None:
+        changes = []
+        received = threading.Event()
+
+        def invalidate(table, keys):
+            changes.append((table, keys))
+            received.set()
+
+        listener = Connector.ChangeListener(Solution.CHANGES_CHANNEL, poll_interval=0.1)
+        listener.register(invalidate)
+        listener.start()
+        try:
+            self.assertEqual(ReturnValue.OK, Solution.addTeam(1), "Should work")
+            self.assertTrue(received.wait(5), "The insert should be announced")
+            self.assertEqual([("teams", {"team_id": 1})], changes, "Table and keys of the new row")
+        finally:
+            listener.stop()
+
+    def test_RunMany(self) -> None:
+        Connector.DBConnector.openPool(1, 3)
+        try:
+            results = Connector.runMany(Solution.addTeam, [(1,), (2,), (1,), (0,)], workers=8)
+        finally:
+            Connector.DBConnector.closePool()
+        self.assertEqual([ReturnValue.OK, ReturnValue.OK, ReturnValue.ALREADY_EXISTS, ReturnValue.BAD_PARAMS],
+                         sorted(results[:3], key=lambda value: value.value) + results[3:], "One result per call")
+
+        def workMem(_):
+            conn = Connector.DBConnector()
+            try:
+                _, result = conn.execute("SELECT current_setting('work_mem') AS work_mem")
+                return result[0]["work_mem"]
+            finally:
+                conn.close()
+
+        # the settings of the caller go with the calls, and the results keep the order of the items
+        with Connector.useSettings({"work_mem": "7MB"}):
+            self.assertEqual(["7MB"] * 20, Connector.runMany(workMem, iter(range(20)), workers=2),
+                             "The caller's settings")
+        self.assertEqual(list(range(50)), Connector.runMany(lambda item: item, iter(range(50)), workers=3), "In order")
+
 
 # *** DO NOT RUN EACH TEST MANUALLY ***
+@unittest.skipUnless(Connector.DBConnector.shardSections(), "database.ini has no shard sections")
+class ShardedTest(unittest.TestCase):
+    def setUp(self) -> None:
+        Sharding.createTables()
+
+    def tearDown(self) -> None:
+        Sharding.dropTables()
+
+    def test_CrossShard(self) -> None:
+        teams = range(1, len(Sharding.shards()) + 2)
+        for team_id in teams:
+            self.assertEqual(ReturnValue.OK, Sharding.addTeam(team_id), "Should work")
+            self.assertEqual(ReturnValue.OK, Sharding.addPlayer(Player(team_id, team_id, 20, 180, "Left")),
+                             "Should work")
+            self.assertEqual(ReturnValue.OK, Sharding.addStadium(Stadium(team_id, 50000, team_id)), "Should work")
+        self.assertEqual(ReturnValue.ALREADY_EXISTS, Sharding.addPlayer(Player(1, 2, 20, 180, "Left")),
+                         "Player 1 exists on another shard")
+        self.assertEqual(ReturnValue.OK, Sharding.addMatch(Match(1, "Domestic", 1, 2)), "Should work")
+        self.assertEqual(ReturnValue.OK, Sharding.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                      Player(2, 2, 20, 180, "Left"), 3),
+                         "An away player scores on the home team's shard")
+        self.assertEqual(ReturnValue.NOT_EXISTS, Sharding.playerScoredInMatch(Match(1, "Domestic", 1, 2),
+                                                                              Player(99, 2, 20, 180, "Left"), 3),
+                         "No such player on any shard")
+        self.assertEqual(ReturnValue.OK, Sharding.matchInStadium(Match(1, "Domestic", 1, 2),
+                                                                 Stadium(2, 50000, 2), 1000), "Away stadium")
+        self.assertEqual(3, Sharding.stadiumTotalGoals(2), "Goals of a match on another shard")
+        self.assertEqual([2], Sharding.mostGoalsForTeam(2), "The only player of team 2")
+        self.assertEqual([2] + [team_id for team_id in teams if team_id != 2], Sharding.getMostAttractiveStadiums(),
+                         "Merged from every shard")
+        self.assertEqual(ReturnValue.OK, Sharding.deletePlayer(Player(2, 2, 20, 180, "Left")), "Should work")
+        self.assertEqual(0, Sharding.stadiumTotalGoals(2), "The goals went with the player")
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2, exit=False)
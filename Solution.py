@@ -1,5 +1,14 @@
-from typing import List
+import base64
+import functools
+import inspect
+import json
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from statistics import NormalDist
+from typing import Callable, Iterator, List, Tuple, Union
 import Utility.DBConnector as Connector
+from Utility.DBConnector import ResultSet
 from Utility.ReturnValue import ReturnValue
 from Utility.Exceptions import DatabaseException
 from Business.Match import Match
@@ -7,11 +16,224 @@ from Business.Player import Player
 from Business.Stadium import Stadium
 from psycopg2 import sql
 
+# the columns of each entity in the order its constructor takes them
+MATCH_COLUMNS = ("match_id", "competition", "first_team_id", "second_team_id")
+PLAYER_COLUMNS = ("player_id", "team_id", "age", "height", "preferred_foot")
+STADIUM_COLUMNS = ("stadium_id", "capacity", "team_id")
+
+# the CHECK constraints of createTables, one condition per table with a placeholder per column
+MATCH_CHECKS = sql.SQL("{first_team_id} <> {second_team_id} AND {competition} IN ('International', 'Domestic')"
+                       " AND {match_id} > 0 AND {first_team_id} > 0 AND {second_team_id} > 0")
+PLAYER_CHECKS = sql.SQL("{age} > 0 AND {player_id} > 0 AND {team_id} > 0 AND {height} > 0"
+                        " AND {preferred_foot} IN ('Left', 'Right')")
+STADIUM_CHECKS = sql.SQL("{capacity} > 0 AND {stadium_id} > 0 AND {team_id} > 0")
+SCORE_CHECKS = sql.SQL("{num_of_goals} > 0")
+ATTENDANCE_CHECKS = sql.SQL("{audience_number} > -1")
+
+# every committed change to the six tables is announced on this channel, see createTables
+CHANGES_CHANNEL = "league_changes"
+
+# the key columns sent for a changed row of each table, team references are included so that team level caches
+# can be invalidated by a change to one of its players, stadiums or matches
+NOTIFIED_KEYS = {
+    "Teams": ("team_id",),
+    "Stadiums": ("stadium_id", "team_id"),
+    "Players": ("player_id", "team_id"),
+    "Matches": ("match_id", "first_team_id", "second_team_id"),
+    "Player_Scored_In": ("player_id", "match_id"),
+    "Played_In": ("match_id", "stadium_id"),
+}
+
+# tuning profiles: the Postgres settings a kind of call runs with, applied with SET LOCAL to every transaction of the
+# call. The analytic calls get memory for their sorts and hashes and parallel workers, the lookups and writes touch a
+# few rows by index and get neither (nor JIT compilation, which costs more than such a query). The bulk deletes do not
+# wait for their commit to reach the disk: a crash may lose the last of them, the database stays consistent
+ANALYTIC = "analytic"
+LOOKUP = "lookup"
+WRITE = "write"
+BULK = "bulk"
+TUNING_PROFILES = {
+    ANALYTIC: {"work_mem": "64MB", "max_parallel_workers_per_gather": 4, "jit": "on"},
+    LOOKUP: {"work_mem": "4MB", "max_parallel_workers_per_gather": 0, "jit": "off"},
+    WRITE: {"max_parallel_workers_per_gather": 0, "jit": "off", "synchronous_commit": "on"},
+    BULK: {"work_mem": "64MB", "jit": "off", "synchronous_commit": "off"},
+}
+
+# the profile of every tuned Solution function, entered by its @tuned(profile) decorator, the others run with the
+# settings of the server. A [tuning.<profile>] section of database.ini overrides settings of a profile, and a
+# [tuning.<function>] section those of one function:
+#   [tuning.analytic]
+#   work_mem = 256MB
+#   [tuning.getClosePlayers]
+#   max_parallel_workers_per_gather = 8
+FUNCTION_TUNING = {}
+
+
+def tuningSettings(name: str) -> dict:
+    # the settings the function name runs with, see FUNCTION_TUNING
+    if name not in FUNCTION_TUNING:
+        return {}
+    sections = Connector.DBConnector.tuningSections()
+    profile = FUNCTION_TUNING[name]
+    return {**TUNING_PROFILES[profile], **sections.get(profile, {}), **sections.get(name, {})}
+
+
+def tuned(profile: str):
+    # @tuned(profile) runs the function with the settings of the profile and enters it in FUNCTION_TUNING
+    def decorator(fn):
+        name = fn.__name__
+        FUNCTION_TUNING[name] = profile
+        if inspect.isgeneratorfunction(fn):
+            # the rows of a streaming function are read after it returns, the settings are in place whenever it runs
+            @functools.wraps(fn)
+            def streaming(*args, **kwargs):
+                rows = fn(*args, **kwargs)
+                try:
+                    while True:
+                        with Connector.useSettings(tuningSettings(name)):
+                            try:
+                                row = next(rows)
+                            except StopIteration:
+                                return
+                        yield row
+                finally:
+                    rows.close()
+            return streaming
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            with Connector.useSettings(tuningSettings(name)):
+                return fn(*args, **kwargs)
+        return call
+    return decorator
+
+
+# build the Business objects straight from the row tuples of a ResultSet, one object per row
+def matchesFromResultSet(result: ResultSet) -> List[Match]:
+    return [Match(*row) for row in result.tuples(*MATCH_COLUMNS)]
+
+
+def playersFromResultSet(result: ResultSet) -> List[Player]:
+    return [Player(*row) for row in result.tuples(*PLAYER_COLUMNS)]
+
+
+def stadiumsFromResultSet(result: ResultSet) -> List[Stadium]:
+    return [Stadium(*row) for row in result.tuples(*STADIUM_COLUMNS)]
+
+
+# an attached CoScoringGraph answers getClosePlayers from memory. The writes below update it once they succeed
+co_scoring_graph = None
+
+
+# the references a database leaves unchecked, section -> {(table, column)}. Sharding drops the foreign keys that cross
+# shards, and the inserts must not check those references either
+unchecked_references = {}
+
+
+def attachCoScoringGraph(graph) -> None:
+    # None detaches the graph
+    global co_scoring_graph
+    co_scoring_graph = graph
+
+
+# profileSession: within the block the profile reads of this thread go through an identity map
+_profile_session = threading.local()
+
+MATCH_PROFILE = "match"
+PLAYER_PROFILE = "player"
+STADIUM_PROFILE = "stadium"
+
+
+@contextmanager
+def profileSession():
+    # repeated getMatchProfile, getPlayerProfile and getStadiumProfile calls for one id return the same object, a
+    # missing id included, and only the first one runs a query. The Solution writes and deletes of the session forget
+    # the ids they touch, changes made by anyone else are not seen until the session ends. Nested blocks share the
+    # outer session
+    outer = getattr(_profile_session, "profiles", None)
+    if outer is None:
+        _profile_session.profiles = {}
+    try:
+        yield
+    finally:
+        _profile_session.profiles = outer
+
+
+def _sessionProfile(kind: str, key: int):
+    # the remembered profile, or None when there is no session or the id was not read in it
+    profiles = getattr(_profile_session, "profiles", None)
+    if profiles is None:
+        return None
+    return profiles.get((Connector.currentSection(), kind, key))
+
+
+def _rememberProfile(kind: str, key: int, profile):
+    # profiles are keyed by the database section too, a sharded lookup of the same id may run against several
+    profiles = getattr(_profile_session, "profiles", None)
+    if profiles is not None:
+        profiles[(Connector.currentSection(), kind, key)] = profile
+    return profile
+
+
+def _forgetProfile(kind: str = None, key: int = None):
+    # None forgets every profile
+    profiles = getattr(_profile_session, "profiles", None)
+    if profiles is None:
+        return
+    if kind is None:
+        profiles.clear()
+    else:
+        profiles.pop((Connector.currentSection(), kind, key), None)
+
+
+def _insertUnlessPresent(conn: Connector.DBConnector, table: str, row: dict, key: Tuple[str, ...],
+                         references: dict = None, checks: sql.SQL = None,
+                         missing: ReturnValue = ReturnValue.BAD_PARAMS) -> ReturnValue:
+    # inserts row with ON CONFLICT DO NOTHING and leaves it out when a row it references (column -> (table, column))
+    # is missing, so a duplicate or a missing reference is answered without an error that would abort the
+    # transaction. The same statement tells which it was: ALREADY_EXISTS when the key was taken, missing when a
+    # reference was missing, ALREADY_EXISTS when another unique column clashed. A row that fails checks or has a
+    # NULL is inserted anyway, so its CHECK or NOT NULL violation is raised before the foreign keys as it always was
+    # a float is stored rounded in the INTEGER columns, it is rounded the same way before it is compared
+    values = {column: sql.SQL("CAST({0} AS INTEGER)").format(sql.Literal(value)) if type(value) is float
+              else sql.Literal(value) for column, value in row.items()}
+    unchecked = unchecked_references.get(Connector.currentSection(), ())
+    references = {column: referenced for column, referenced in (references or {}).items()
+                  if (table, column) not in unchecked}
+    refs_ok = sql.SQL(" AND ").join(
+        sql.SQL("({value} IS NULL OR EXISTS(SELECT 1 FROM {referenced} WHERE {referenced_column} = {value}))")
+        .format(value=values[column], referenced=sql.Identifier(referenced.lower()),
+                referenced_column=sql.Identifier(referenced_column))
+        for column, (referenced, referenced_column) in references.items()) if references else sql.SQL("TRUE")
+    failing = sql.SQL("NOT COALESCE({checks}, FALSE)").format(checks=sql.SQL(" AND ").join(
+        [checks.format(**values) if checks is not None else sql.SQL("TRUE")] +
+        [sql.SQL("{0} IS NOT NULL").format(value) for value in values.values()]))
+    query = sql.SQL("WITH Inserted AS ("
+                    " INSERT INTO {table}({columns}) SELECT {values} WHERE {refs_ok} OR {failing}"
+                    " ON CONFLICT DO NOTHING RETURNING 1)"
+                    " SELECT EXISTS(SELECT 1 FROM Inserted) AS inserted,"
+                    " EXISTS(SELECT 1 FROM {table} WHERE {key}) AS taken,"
+                    " {refs_ok} AS refs_ok") \
+        .format(table=sql.Identifier(table.lower()), columns=sql.SQL(", ").join(map(sql.Identifier, row)),
+                values=sql.SQL(", ").join(values.values()), refs_ok=refs_ok, failing=failing,
+                key=sql.SQL(" AND ").join(sql.SQL("{0} = {1}").format(sql.Identifier(column), values[column])
+                                          for column in key))
+    _, result = conn.execute(query)
+    inserted, taken, refs_ok = result.tuples("inserted", "taken", "refs_ok")[0]
+    if inserted:
+        return ReturnValue.OK
+    if taken:
+        return ReturnValue.ALREADY_EXISTS
+    if not refs_ok:
+        return missing
+    # another unique column, or the same key inserted by a concurrent transaction
+    return ReturnValue.ALREADY_EXISTS
+
 
-def createTables() -> None:
+def createTables(deadline: float = None) -> None:
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
 
         conn.execute("CREATE TABLE Teams(team_id INTEGER NOT NULL PRIMARY KEY,"
                      "CHECK (team_id > 0))")
@@ -38,6 +260,12 @@ def createTables() -> None:
                      " CHECK (height > 0),"
                      " CHECK (preferred_foot IN ('Left', 'Right')))")
 
+        # the player analytics read a team's players in height order
+        conn.execute("CREATE INDEX players_team_height ON Players(team_id, height)")
+        # the age and height ranges of findPlayers, and the same for the left footed players only, who are the fewer
+        conn.execute("CREATE INDEX players_age_height ON Players(age, height)")
+        conn.execute("CREATE INDEX players_left_age_height ON Players(age, height) WHERE preferred_foot = 'Left'")
+
         conn.execute("CREATE TABLE Matches(match_id INTEGER PRIMARY KEY NOT NULL,"
                      " competition VARCHAR(13) NOT NULL,"
                      " first_team_id INTEGER NOT NULL REFERENCES Teams(team_id) ON DELETE CASCADE,"
@@ -48,6 +276,11 @@ def createTables() -> None:
                      " CHECK (first_team_id > 0),"
                      " CHECK (second_team_id > 0))")
 
+        # which matches a team played, first or second, for the active and home team views, and in which competition
+        # for the competition filter of findPlayers
+        conn.execute("CREATE INDEX matches_first_team ON Matches(first_team_id, competition)")
+        conn.execute("CREATE INDEX matches_second_team ON Matches(second_team_id, competition)")
+
         conn.execute("CREATE TABLE Player_Scored_In(player_id INTEGER NOT NULL,"
                      " match_id INTEGER NOT NULL,"
                      " num_of_goals INTEGER NOT NULL,"
@@ -56,6 +289,9 @@ def createTables() -> None:
                      " CHECK (num_of_goals > 0),"
                      " PRIMARY KEY (player_id, match_id))")
 
+        # the primary key leads with the player, the deletes and goal sums by match need an index of their own
+        conn.execute("CREATE INDEX player_scored_in_match ON Player_Scored_In(match_id)")
+
         conn.execute("CREATE TABLE Played_In(match_id INTEGER NOT NULL,"
                      " stadium_id INTEGER NOT NULL,"
                      " audience_number INTEGER NOT NULL,"
@@ -64,10 +300,126 @@ def createTables() -> None:
                      " PRIMARY KEY (match_id),"
                      " CHECK(audience_number > -1))")
 
+        # the cascade of a deleted stadium, and the attendance of a stadium read from the index alone
+        conn.execute("CREATE INDEX played_in_stadium ON Played_In(stadium_id, audience_number)")
+        # the matches of a stadium in the pseudo random order of their hashed ids, so that a sample of the stadium's
+        # attendance is the first rows of its range, see _approximateAverageAttendance
+        conn.execute("CREATE INDEX played_in_sample ON Played_In(stadium_id, hashint4(match_id))"
+                     " INCLUDE (audience_number)")
+
+        # goal counters, kept up to date by the triggers below so that reading a total is a primary key lookup
+        # instead of a SUM over Player_Scored_In. Every match, player and stadium gets a row (with 0 goals) when it is
+        # added and loses it when it is deleted, so the triggers only ever UPDATE existing rows.
+        # The counters have no foreign keys on purpose: the cascades of a delete update the counter of the row being
+        # deleted, and a foreign key would reject that update
+        conn.execute("CREATE TABLE MatchGoals(match_id INTEGER PRIMARY KEY,"
+                     " goals INTEGER NOT NULL DEFAULT 0)")
+
+        conn.execute("CREATE TABLE PlayerGoals(player_id INTEGER PRIMARY KEY,"
+                     " team_id INTEGER NOT NULL,"
+                     " goals INTEGER NOT NULL DEFAULT 0)")
+
+        conn.execute("CREATE TABLE StadiumGoals(stadium_id INTEGER PRIMARY KEY,"
+                     " goals INTEGER NOT NULL DEFAULT 0)")
+
+        # the order of mostGoalsForTeam and getMostAttractiveStadiums. Goals are ranked descending but stadium ids
+        # ascending, indexing -goals makes both ascending so a page can start at a (-goals, stadium_id) row comparison
+        conn.execute("CREATE INDEX player_goals_rank ON PlayerGoals(team_id, goals DESC, player_id DESC)")
+        conn.execute("CREATE INDEX stadium_goals_rank ON StadiumGoals((-goals), stadium_id)")
+        # the players who scored, for the minimum goals filter of findPlayers
+        conn.execute("CREATE INDEX player_goals_scorers ON PlayerGoals(goals, player_id) WHERE goals > 0")
+
+        conn.execute("""
+                     CREATE FUNCTION keep_goal_counter() RETURNS TRIGGER AS $$
+                     BEGIN
+                         IF TG_TABLE_NAME = 'matches' AND TG_OP = 'INSERT' THEN
+                             INSERT INTO MatchGoals(match_id) VALUES (NEW.match_id);
+                         ELSIF TG_TABLE_NAME = 'matches' THEN
+                             DELETE FROM MatchGoals WHERE match_id = OLD.match_id;
+                         ELSIF TG_TABLE_NAME = 'players' AND TG_OP = 'INSERT' THEN
+                             INSERT INTO PlayerGoals(player_id, team_id) VALUES (NEW.player_id, NEW.team_id);
+                         ELSIF TG_TABLE_NAME = 'players' THEN
+                             DELETE FROM PlayerGoals WHERE player_id = OLD.player_id;
+                         ELSIF TG_OP = 'INSERT' THEN
+                             INSERT INTO StadiumGoals(stadium_id) VALUES (NEW.stadium_id);
+                         ELSE
+                             DELETE FROM StadiumGoals WHERE stadium_id = OLD.stadium_id;
+                         END IF;
+                         RETURN NULL;
+                     END;
+                     $$ LANGUAGE plpgsql
+                     """)
+
+        # a score moves the match, the player and (if the match was played in one) the stadium counters.
+        # Deletes are counted BEFORE the row goes: when a match is deleted its scores and its Played_In row are removed
+        # by two cascades, and only at the time of each delete does the other table still show the rows it had.
+        # Inserts are counted AFTER the row is in, so a row skipped by ON CONFLICT is never counted
+        conn.execute("""
+                     CREATE FUNCTION count_scored_goals() RETURNS TRIGGER AS $$
+                     BEGIN
+                         IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                             UPDATE MatchGoals SET goals = goals - OLD.num_of_goals WHERE match_id = OLD.match_id;
+                             UPDATE PlayerGoals SET goals = goals - OLD.num_of_goals WHERE player_id = OLD.player_id;
+                             UPDATE StadiumGoals SET goals = goals - OLD.num_of_goals
+                                 WHERE stadium_id = (SELECT stadium_id FROM Played_In WHERE match_id = OLD.match_id);
+                         END IF;
+                         IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                             UPDATE MatchGoals SET goals = goals + NEW.num_of_goals WHERE match_id = NEW.match_id;
+                             UPDATE PlayerGoals SET goals = goals + NEW.num_of_goals WHERE player_id = NEW.player_id;
+                             UPDATE StadiumGoals SET goals = goals + NEW.num_of_goals
+                                 WHERE stadium_id = (SELECT stadium_id FROM Played_In WHERE match_id = NEW.match_id);
+                         END IF;
+                         IF TG_OP = 'DELETE' THEN
+                             RETURN OLD;
+                         END IF;
+                         RETURN NULL;
+                     END;
+                     $$ LANGUAGE plpgsql
+                     """)
+
+        # a match moves all of its goals in or out of a stadium. They are summed from Player_Scored_In rather than read
+        # from MatchGoals, so the result is right whichever order the cascades of a deleted match run in
+        # (the deletes are counted BEFORE the row goes, as above)
+        conn.execute("""
+                     CREATE FUNCTION count_stadium_goals() RETURNS TRIGGER AS $$
+                     BEGIN
+                         IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                             UPDATE StadiumGoals SET goals = goals - (SELECT COALESCE(SUM(num_of_goals), 0)
+                                 FROM Player_Scored_In WHERE match_id = OLD.match_id)
+                                 WHERE stadium_id = OLD.stadium_id;
+                         END IF;
+                         IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                             UPDATE StadiumGoals SET goals = goals + (SELECT COALESCE(SUM(num_of_goals), 0)
+                                 FROM Player_Scored_In WHERE match_id = NEW.match_id)
+                                 WHERE stadium_id = NEW.stadium_id;
+                         END IF;
+                         IF TG_OP = 'DELETE' THEN
+                             RETURN OLD;
+                         END IF;
+                         RETURN NULL;
+                     END;
+                     $$ LANGUAGE plpgsql
+                     """)
+
+        for table in ["Matches", "Players", "Stadiums"]:
+            conn.execute(sql.SQL("CREATE TRIGGER {trigger} AFTER INSERT OR DELETE ON {table}"
+                                 " FOR EACH ROW EXECUTE PROCEDURE keep_goal_counter()")
+                         .format(trigger=sql.Identifier(f"{table.lower()}_keep_goal_counter"),
+                                 table=sql.Identifier(table.lower())))
+        conn.execute("CREATE TRIGGER player_scored_in_count_goals AFTER INSERT OR UPDATE"
+                     " ON Player_Scored_In FOR EACH ROW EXECUTE PROCEDURE count_scored_goals()")
+        conn.execute("CREATE TRIGGER player_scored_in_uncount_goals BEFORE DELETE"
+                     " ON Player_Scored_In FOR EACH ROW EXECUTE PROCEDURE count_scored_goals()")
+        conn.execute("CREATE TRIGGER played_in_count_goals AFTER INSERT OR UPDATE"
+                     " ON Played_In FOR EACH ROW EXECUTE PROCEDURE count_stadium_goals()")
+        conn.execute("CREATE TRIGGER played_in_uncount_goals BEFORE DELETE"
+                     " ON Played_In FOR EACH ROW EXECUTE PROCEDURE count_stadium_goals()")
+
+        # the goal views read the counters, they keep the rows and columns they had as aggregates
         conn.execute("CREATE VIEW Goals_Per_Match AS "
-                     " SELECT match_id, SUM(num_of_goals) "
-                     " FROM Player_Scored_In "
-                     " GROUP BY match_id ")
+                     " SELECT match_id, goals AS sum "
+                     " FROM MatchGoals "
+                     " WHERE goals > 0 ")
 
         conn.execute("CREATE VIEW Played_At_Least_One_Match AS "
                      " SELECT DISTINCT T.team_id "
@@ -79,10 +431,13 @@ def createTables() -> None:
                      " FROM  Matches M INNER JOIN Played_In P "
                      " ON P.match_id = M.match_id")
 
+        # the teams with at least two players taller than 190, counted per team instead of pairing the players
         conn.execute("CREATE VIEW TallTeams AS "
-                     " SELECT DISTINCT P1.team_id "
-                     " FROM Players P1 INNER JOIN Players P2 ON P1.team_id = P2.team_id" 
-                     " WHERE P1.player_id<>P2.player_id and P1.height > 190 and P2.height > 190")
+                     " SELECT team_id "
+                     " FROM Players "
+                     " WHERE height > 190 "
+                     " GROUP BY team_id "
+                     " HAVING COUNT(*) >= 2")
 
         conn.execute("CREATE VIEW ActiveTallTeams AS "
                      " SELECT DISTINCT P1.team_id "
@@ -101,17 +456,16 @@ def createTables() -> None:
                     
         conn.execute("""
                      CREATE VIEW GoalsInMatch AS
-                     SELECT match_id, SUM(num_of_goals) AS goals
-                     FROM Player_Scored_In
-                     GROUP BY match_id
+                     SELECT match_id, goals
+                     FROM MatchGoals
+                     WHERE goals > 0
                      """)
         
         conn.execute("""
                      CREATE VIEW GoalsInStadium AS
-                     SELECT stadium_id, SUM(goals) AS goals
-                     FROM Played_In, GoalsInMatch
-                     WHERE Played_In.match_id = GoalsInMatch.match_id
-                     GROUP BY stadium_id
+                     SELECT stadium_id, goals
+                     FROM StadiumGoals
+                     WHERE goals > 0
                      """)
 
         conn.execute("CREATE VIEW PopularNotEmptyWay AS "
@@ -122,14 +476,39 @@ def createTables() -> None:
         
         conn.execute("""
                     CREATE VIEW PlayerGoalsInTeam AS
-                    SELECT player_id, team_id, COALESCE(total_amount, 0) AS goals
-                    FROM (
-                        SELECT player_id, team_id FROM Players
-                    ) AS PlayerTeam LEFT JOIN (
-                        SELECT player_id, SUM(num_of_goals) as total_amount FROM Player_Scored_In GROUP BY player_id
-                    ) AS PlayerGoals USING (player_id)
+                    SELECT player_id, team_id, goals
+                    FROM PlayerGoals
                     """)
 
+        # payload: {"table": ..., "operation": "INSERT"/"UPDATE"/"DELETE", "keys": {column: value}}.
+        # Postgres delivers it to the listeners only when the changing transaction commits
+        conn.execute(sql.SQL("""
+                     CREATE FUNCTION notify_league_change() RETURNS TRIGGER AS $$
+                     DECLARE
+                         changed JSON;
+                     BEGIN
+                         IF TG_OP = 'DELETE' THEN
+                             changed := row_to_json(OLD);
+                         ELSE
+                             changed := row_to_json(NEW);
+                         END IF;
+                         PERFORM pg_notify({channel}, json_build_object(
+                             'table', TG_TABLE_NAME,
+                             'operation', TG_OP,
+                             'keys', (SELECT json_object_agg(key, value) FROM json_each(changed)
+                                      WHERE key = ANY(TG_ARGV)))::TEXT);
+                         RETURN NULL;
+                     END;
+                     $$ LANGUAGE plpgsql
+                     """).format(channel=sql.Literal(CHANGES_CHANNEL)))
+
+        for table, keys in NOTIFIED_KEYS.items():
+            conn.execute(sql.SQL("CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE ON {table}"
+                                 " FOR EACH ROW EXECUTE PROCEDURE notify_league_change({keys})")
+                         .format(trigger=sql.Identifier(f"{table.lower()}_notify_change"),
+                                 table=sql.Identifier(table.lower()),
+                                 keys=sql.SQL(", ").join(map(sql.Literal, keys))))
+
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
     except DatabaseException.NOT_NULL_VIOLATION as e:
@@ -140,6 +519,8 @@ def createTables() -> None:
         print(e)
     except DatabaseException.FOREIGN_KEY_VIOLATION as e:
         print(e)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         print(e)
     finally:
@@ -148,24 +529,32 @@ def createTables() -> None:
     pass
 
 
-def clearTables():
+def clearTables(deadline: float = None):
+    _forgetProfile()
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         list_of_tables = ["Played_In", "Player_Scored_In", "Stadiums", "Matches", "Players", "Teams"]
         for table in list_of_tables:
             conn.execute(f"DELETE FROM {table}")
+        if co_scoring_graph is not None:
+            co_scoring_graph.clear()
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
         conn.close()
 
 
-def dropTables():
+def dropTables(deadline: float = None):
+    _forgetProfile()
     conn = None
     try:
-        conn = Connector.DBConnector()
-        list_of_tables = ["Played_In", "Player_Scored_In", "Stadiums", "Matches", "Players", "Teams"]
+        conn = Connector.DBConnector(deadline=deadline)
+        list_of_tables = ["MatchGoals", "PlayerGoals", "StadiumGoals",
+                          "Played_In", "Player_Scored_In", "Stadiums", "Matches", "Players", "Teams"]
+        list_of_functions = ["notify_league_change", "keep_goal_counter", "count_scored_goals", "count_stadium_goals"]
         list_of_views = reversed(["Goals_Per_Match", "Played_At_Least_One_Match", "Played_At_Least_One_Home_Match",
           "TallTeams", "ActiveTallTeams", "HomeDidntHaveFortyAudience", "DidntPlayAtHome", "GoalsInMatch", "GoalsInStadium",
            "PopularNotEmptyWay", "PlayerGoalsInTeam"])
@@ -173,18 +562,24 @@ def dropTables():
             conn.execute(f"DROP VIEW IF EXISTS {view} CASCADE")
         for table in list_of_tables:
             conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+        for function in list_of_functions:
+            conn.execute(f"DROP FUNCTION IF EXISTS {function}() CASCADE")
+        if co_scoring_graph is not None:
+            co_scoring_graph.clear()
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
         conn.close()
 
 
-def addTeam(teamID: int) -> ReturnValue:
+@tuned(WRITE)
+def addTeam(teamID: int, deadline: float = None) -> ReturnValue:
     conn = None
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("INSERT INTO Teams(team_id) VALUES({team_id})").format(team_id=sql.Literal(teamID))
-        rows_effected, _ = conn.execute(query)
+        conn = Connector.DBConnector(deadline=deadline)
+        inserted = _insertUnlessPresent(conn, "Teams", {"team_id": teamID}, ("team_id",))
     except DatabaseException.ConnectionInvalid as e:
         conn.close()
         return ReturnValue.ERROR
@@ -199,21 +594,29 @@ def addTeam(teamID: int) -> ReturnValue:
     except DatabaseException.UNIQUE_VIOLATION as e:
         conn.close()
         return ReturnValue.ALREADY_EXISTS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         conn.close()
         return ReturnValue.ERROR
     conn.close()
-    return ReturnValue.OK
+    return inserted
 
-def addMatch(match: Match) -> ReturnValue:
+@tuned(WRITE)
+def addMatch(match: Match, deadline: float = None) -> ReturnValue:
+    _forgetProfile(MATCH_PROFILE, match.getMatchID())
     conn = None
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("INSERT INTO Matches(match_id, competition, first_team_id, second_team_id) "
-                        "VALUES({match_id}, {competition}, {first_team_id}, {second_team_id})") \
-            .format(match_id=sql.Literal(match.getMatchID()), competition=sql.Literal(match.getCompetition()),
-                    first_team_id=sql.Literal(match.getHomeTeamID()), second_team_id=sql.Literal(match.getAwayTeamID()))
-        rows_effected, _ = conn.execute(query)
+        conn = Connector.DBConnector(deadline=deadline)
+        inserted = _insertUnlessPresent(conn, "Matches",
+                                        {"match_id": match.getMatchID(), "competition": match.getCompetition(),
+                                         "first_team_id": match.getHomeTeamID(),
+                                         "second_team_id": match.getAwayTeamID()},
+                                        ("match_id",),
+                                        {"first_team_id": ("Teams", "team_id"), "second_team_id": ("Teams", "team_id")},
+                                        MATCH_CHECKS)
+        if inserted != ReturnValue.OK:
+            return inserted
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
     except DatabaseException.CHECK_VIOLATION as e:
@@ -224,6 +627,8 @@ def addMatch(match: Match) -> ReturnValue:
         return ReturnValue.BAD_PARAMS
     except DatabaseException.UNIQUE_VIOLATION as e:
         return ReturnValue.ALREADY_EXISTS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
@@ -231,29 +636,36 @@ def addMatch(match: Match) -> ReturnValue:
     return ReturnValue.OK
 
 
-def getMatchProfile(matchID: int) -> Match:
+@tuned(LOOKUP)
+def getMatchProfile(matchID: int, deadline: float = None) -> Match:
+    remembered = _sessionProfile(MATCH_PROFILE, matchID)
+    if remembered is not None:
+        return remembered
     conn = None
     try:
-        conn = Connector.DBConnector()
-        match_getting_query = sql.SQL("SELECT * FROM Matches WHERE match_id = {id_of_match}"). \
-            format(id_of_match=sql.Literal(matchID))
+        conn = Connector.DBConnector(deadline=deadline)
+        match_getting_query = sql.SQL("SELECT {columns} FROM Matches WHERE match_id = {id_of_match}"). \
+            format(columns=sql.SQL(", ").join(map(sql.Identifier, MATCH_COLUMNS)), id_of_match=sql.Literal(matchID))
         rows_effected, result = conn.execute(match_getting_query)
         if rows_effected != 0:
-            return Match(result[0]["match_id"], result[0]["competition"], result[0]["first_team_id"],
-                         result[0]["second_team_id"])
+            return _rememberProfile(MATCH_PROFILE, matchID, matchesFromResultSet(result)[0])
         else:
-            return Match.badMatch()
+            return _rememberProfile(MATCH_PROFILE, matchID, Match.badMatch())
         # rows_effected is the number of rows received by the SELECT
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return Match.badMatch()
     finally:
         conn.close()
 
 
-def deleteMatch(match: Match) -> ReturnValue:
+@tuned(WRITE)
+def deleteMatch(match: Match, deadline: float = None) -> ReturnValue:
+    _forgetProfile(MATCH_PROFILE, match.getMatchID())
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         match_deleting_query = sql.SQL("DELETE FROM Matches WHERE match_id = {id_of_match}").\
             format(id_of_match=sql.Literal(match.getMatchID()))
         rows_effected, _ = conn.execute(match_deleting_query)
@@ -261,24 +673,31 @@ def deleteMatch(match: Match) -> ReturnValue:
             return ReturnValue.NOT_EXISTS
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
         conn.close()
+    if co_scoring_graph is not None:
+        co_scoring_graph.removeMatch(match.getMatchID())
     return ReturnValue.OK
     pass
 
 
-def addPlayer(player: Player) -> ReturnValue:
+@tuned(WRITE)
+def addPlayer(player: Player, deadline: float = None) -> ReturnValue:
+    _forgetProfile(PLAYER_PROFILE, player.getPlayerID())
     conn = None
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("INSERT INTO Players(player_id, team_id, age, height, preferred_foot) VALUES({player_id},"
-                        " {team_id}, {age}, {height}, {preferred_foot})") \
-            .format(player_id=sql.Literal(player.getPlayerID()), team_id=sql.Literal(player.getTeamID()),
-                    age=sql.Literal(player.getAge()), height=sql.Literal(player.getHeight()),
-                    preferred_foot=sql.Literal(player.getFoot()))
-        rows_effected, _ = conn.execute(query)
+        conn = Connector.DBConnector(deadline=deadline)
+        inserted = _insertUnlessPresent(conn, "Players",
+                                        {"player_id": player.getPlayerID(), "team_id": player.getTeamID(),
+                                         "age": player.getAge(), "height": player.getHeight(),
+                                         "preferred_foot": player.getFoot()},
+                                        ("player_id",), {"team_id": ("Teams", "team_id")}, PLAYER_CHECKS)
+        if inserted != ReturnValue.OK:
+            return inserted
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
     except DatabaseException.CHECK_VIOLATION as e:
@@ -289,26 +708,35 @@ def addPlayer(player: Player) -> ReturnValue:
         return ReturnValue.ALREADY_EXISTS
     except DatabaseException.NOT_NULL_VIOLATION as e:
         return ReturnValue.BAD_PARAMS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
         conn.close()
+    if co_scoring_graph is not None:
+        co_scoring_graph.addPlayer(player.getPlayerID())
     return ReturnValue.OK
 
 
-def getPlayerProfile(playerID: int) -> Player:
+@tuned(LOOKUP)
+def getPlayerProfile(playerID: int, deadline: float = None) -> Player:
+    remembered = _sessionProfile(PLAYER_PROFILE, playerID)
+    if remembered is not None:
+        return remembered
     conn = None
     try:
-        conn = Connector.DBConnector()
-        match_getting_query = sql.SQL("SELECT * FROM Players WHERE player_id = {id_of_player}"). \
-            format(id_of_player=sql.Literal(playerID))
+        conn = Connector.DBConnector(deadline=deadline)
+        match_getting_query = sql.SQL("SELECT {columns} FROM Players WHERE player_id = {id_of_player}"). \
+            format(columns=sql.SQL(", ").join(map(sql.Identifier, PLAYER_COLUMNS)), id_of_player=sql.Literal(playerID))
         rows_effected, result = conn.execute(match_getting_query)
         if rows_effected != 0:
-            return Player(result[0]["player_id"], result[0]["team_id"], result[0]["age"],
-                          result[0]["height"], result[0]["preferred_foot"])
+            return _rememberProfile(PLAYER_PROFILE, playerID, playersFromResultSet(result)[0])
         else:
-            return Player.badPlayer()
+            return _rememberProfile(PLAYER_PROFILE, playerID, Player.badPlayer())
         # rows_effected is the number of rows received by the SELECT
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return Player.badPlayer()
     finally:
@@ -316,10 +744,12 @@ def getPlayerProfile(playerID: int) -> Player:
 
 
 
-def deletePlayer(player: Player) -> ReturnValue:
+@tuned(WRITE)
+def deletePlayer(player: Player, deadline: float = None) -> ReturnValue:
+    _forgetProfile(PLAYER_PROFILE, player.getPlayerID())
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         match_deleting_query = sql.SQL("DELETE FROM Players WHERE player_id = {id_of_player}").\
             format(id_of_player=sql.Literal(player.getPlayerID()))
         rows_effected, _ = conn.execute(match_deleting_query)
@@ -327,23 +757,30 @@ def deletePlayer(player: Player) -> ReturnValue:
             return ReturnValue.NOT_EXISTS
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
         conn.close()
+    if co_scoring_graph is not None:
+        co_scoring_graph.removePlayer(player.getPlayerID())
     return ReturnValue.OK
     pass
 
 
-def addStadium(stadium: Stadium) -> ReturnValue:
+@tuned(WRITE)
+def addStadium(stadium: Stadium, deadline: float = None) -> ReturnValue:
+    _forgetProfile(STADIUM_PROFILE, stadium.getStadiumID())
     conn = None
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("INSERT INTO Stadiums(stadium_id, capacity, team_id) VALUES({stadium_id}, {capacity},"
-                        " {team_id})") \
-            .format(stadium_id=sql.Literal(stadium.getStadiumID()), capacity=sql.Literal(stadium.getCapacity()),
-                    team_id=sql.Literal(stadium.getBelongsTo()))
-        rows_effected, _ = conn.execute(query)
+        conn = Connector.DBConnector(deadline=deadline)
+        inserted = _insertUnlessPresent(conn, "Stadiums",
+                                        {"stadium_id": stadium.getStadiumID(), "capacity": stadium.getCapacity(),
+                                         "team_id": stadium.getBelongsTo()},
+                                        ("stadium_id",), {"team_id": ("Teams", "team_id")}, STADIUM_CHECKS)
+        if inserted != ReturnValue.OK:
+            return inserted
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
     except DatabaseException.CHECK_VIOLATION as e:
@@ -354,6 +791,8 @@ def addStadium(stadium: Stadium) -> ReturnValue:
         return ReturnValue.ALREADY_EXISTS
     except DatabaseException.NOT_NULL_VIOLATION as e:
         return ReturnValue.BAD_PARAMS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         print(e)
     finally:
@@ -361,28 +800,37 @@ def addStadium(stadium: Stadium) -> ReturnValue:
     return ReturnValue.OK
 
 
-def getStadiumProfile(stadiumID: int) -> Stadium:
+@tuned(LOOKUP)
+def getStadiumProfile(stadiumID: int, deadline: float = None) -> Stadium:
+    remembered = _sessionProfile(STADIUM_PROFILE, stadiumID)
+    if remembered is not None:
+        return remembered
     conn = None
     try:
-        conn = Connector.DBConnector()
-        stadium_getting_query = sql.SQL("SELECT * FROM Stadiums WHERE stadium_id = {id_of_stadium}"). \
-            format(id_of_stadium=sql.Literal(stadiumID))
+        conn = Connector.DBConnector(deadline=deadline)
+        stadium_getting_query = sql.SQL("SELECT {columns} FROM Stadiums WHERE stadium_id = {id_of_stadium}"). \
+            format(columns=sql.SQL(", ").join(map(sql.Identifier, STADIUM_COLUMNS)),
+                   id_of_stadium=sql.Literal(stadiumID))
         rows_effected, result = conn.execute(stadium_getting_query)
         if rows_effected != 0:
-            return Stadium(result[0]["stadium_id"], result[0]["capacity"], result[0]["team_id"])
+            return _rememberProfile(STADIUM_PROFILE, stadiumID, stadiumsFromResultSet(result)[0])
         else:
-            return Stadium.badStadium()
+            return _rememberProfile(STADIUM_PROFILE, stadiumID, Stadium.badStadium())
         # rows_effected is the number of rows received by the SELECT
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return Stadium.badStadium()
     finally:
         conn.close()
 
 
-def deleteStadium(stadium: Stadium) -> ReturnValue:
+@tuned(WRITE)
+def deleteStadium(stadium: Stadium, deadline: float = None) -> ReturnValue:
+    _forgetProfile(STADIUM_PROFILE, stadium.getStadiumID())
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         match_deleting_query = sql.SQL("DELETE FROM Stadiums WHERE stadium_id = {id_of_stadium}").\
             format(id_of_stadium=sql.Literal(stadium.getStadiumID()))
         rows_effected, _ = conn.execute(match_deleting_query)
@@ -390,6 +838,8 @@ def deleteStadium(stadium: Stadium) -> ReturnValue:
             return ReturnValue.NOT_EXISTS
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
@@ -398,18 +848,22 @@ def deleteStadium(stadium: Stadium) -> ReturnValue:
     pass
 
 
-def playerScoredInMatch(match: Match, player: Player, amount: int) -> ReturnValue:
+@tuned(WRITE)
+def playerScoredInMatch(match: Match, player: Player, amount: int, deadline: float = None) -> ReturnValue:
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         # if getPlayerProfile(player.getPlayerID()) == player.badPlayer() or getMatchProfile(match.getMatchID()) ==\
         #         match.badMatch():
         #     return ReturnValue.NOT_EXISTS
-        query = sql.SQL("INSERT INTO Player_Scored_In(player_id, match_id, num_of_goals) VALUES({player_id},"
-                        " {match_id}, {num_of_goals})") \
-            .format(player_id=sql.Literal(player.getPlayerID()), match_id=sql.Literal(match.getMatchID()),
-                    num_of_goals=sql.Literal(amount))
-        rows_effected, _ = conn.execute(query)
+        inserted = _insertUnlessPresent(conn, "Player_Scored_In",
+                                        {"player_id": player.getPlayerID(), "match_id": match.getMatchID(),
+                                         "num_of_goals": amount},
+                                        ("player_id", "match_id"),
+                                        {"player_id": ("Players", "player_id"), "match_id": ("Matches", "match_id")},
+                                        SCORE_CHECKS, ReturnValue.NOT_EXISTS)
+        if inserted != ReturnValue.OK:
+            return inserted
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
     except DatabaseException.FOREIGN_KEY_VIOLATION as e:
@@ -418,18 +872,23 @@ def playerScoredInMatch(match: Match, player: Player, amount: int) -> ReturnValu
         return ReturnValue.BAD_PARAMS
     except DatabaseException.UNIQUE_VIOLATION as e:
         return ReturnValue.ALREADY_EXISTS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
         conn.close()
+    if co_scoring_graph is not None:
+        co_scoring_graph.addScore(player.getPlayerID(), match.getMatchID())
     return ReturnValue.OK
     pass
 
 
-def playerDidntScoreInMatch(match: Match, player: Player) -> ReturnValue:
+@tuned(WRITE)
+def playerDidntScoreInMatch(match: Match, player: Player, deadline: float = None) -> ReturnValue:
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         query = sql.SQL("DELETE FROM Player_Scored_In"
                         " WHERE player_id = {player_id} and match_id = {match_id} ") \
             .format(player_id=sql.Literal(player.getPlayerID()), match_id=sql.Literal(match.getMatchID()))
@@ -442,26 +901,34 @@ def playerDidntScoreInMatch(match: Match, player: Player) -> ReturnValue:
         return ReturnValue.NOT_EXISTS
     except DatabaseException.FOREIGN_KEY_VIOLATION as e:
         return ReturnValue.NOT_EXISTS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
         conn.close()
+    if co_scoring_graph is not None:
+        co_scoring_graph.removeScore(player.getPlayerID(), match.getMatchID())
     return ReturnValue.OK
     pass
 
 
-def matchInStadium(match: Match, stadium: Stadium, attendance: int) -> ReturnValue:
+@tuned(WRITE)
+def matchInStadium(match: Match, stadium: Stadium, attendance: int, deadline: float = None) -> ReturnValue:
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         # if getPlayerProfile(player.getPlayerID()) == player.badPlayer() or getMatchProfile(match.getMatchID()) ==\
         #         match.badMatch():
         #     return ReturnValue.NOT_EXISTS
-        query = sql.SQL("INSERT INTO Played_In(match_id, stadium_id, audience_number) VALUES({match_id},"
-                        " {stadium_id}, {audience_number})") \
-            .format(match_id=sql.Literal(match.getMatchID()), stadium_id=sql.Literal(stadium.getStadiumID()),
-                    audience_number=sql.Literal(attendance))
-        rows_effected, _ = conn.execute(query)
+        inserted = _insertUnlessPresent(conn, "Played_In",
+                                        {"match_id": match.getMatchID(), "stadium_id": stadium.getStadiumID(),
+                                         "audience_number": attendance},
+                                        ("match_id",),
+                                        {"match_id": ("Matches", "match_id"), "stadium_id": ("Stadiums", "stadium_id")},
+                                        ATTENDANCE_CHECKS, ReturnValue.NOT_EXISTS)
+        if inserted != ReturnValue.OK:
+            return inserted
     except DatabaseException.ConnectionInvalid as e:
         return ReturnValue.ERROR
     except DatabaseException.FOREIGN_KEY_VIOLATION as e:
@@ -470,6 +937,8 @@ def matchInStadium(match: Match, stadium: Stadium, attendance: int) -> ReturnVal
         return ReturnValue.BAD_PARAMS
     except DatabaseException.UNIQUE_VIOLATION as e:
         return ReturnValue.ALREADY_EXISTS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
@@ -478,10 +947,11 @@ def matchInStadium(match: Match, stadium: Stadium, attendance: int) -> ReturnVal
     pass
 
 
-def matchNotInStadium(match: Match, stadium: Stadium) -> ReturnValue:
+@tuned(WRITE)
+def matchNotInStadium(match: Match, stadium: Stadium, deadline: float = None) -> ReturnValue:
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         query = sql.SQL("DELETE FROM Played_In"
                         " WHERE match_id = {match_id} and stadium_id = {stadium_id} ") \
             .format(stadium_id=sql.Literal(stadium.getStadiumID()), match_id=sql.Literal(match.getMatchID()))
@@ -494,6 +964,8 @@ def matchNotInStadium(match: Match, stadium: Stadium) -> ReturnValue:
         return ReturnValue.NOT_EXISTS
     except DatabaseException.FOREIGN_KEY_VIOLATION as e:
         return ReturnValue.NOT_EXISTS
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return ReturnValue.ERROR
     finally:
@@ -502,10 +974,153 @@ def matchNotInStadium(match: Match, stadium: Stadium) -> ReturnValue:
     pass
 
 
-def averageAttendanceInStadium(stadiumID: int) -> float:
+# the bulk deletes take a list of objects or of their ids (pairs of them for the scores and attendances) and delete
+# all of them with one statement, in one transaction. They return a ReturnValue per item, the one the single delete
+# of the item would have returned if the items were deleted one after the other: an item listed twice is NOT_EXISTS
+# the second time
+def _idOf(item: Union[Match, Player, Stadium, int]):
+    if isinstance(item, Match):
+        return item.getMatchID()
+    if isinstance(item, Player):
+        return item.getPlayerID()
+    if isinstance(item, Stadium):
+        return item.getStadiumID()
+    return item
+
+
+def _deleteMany(table: str, columns: Tuple[str, ...], keys: List[tuple], deadline: float) -> List[ReturnValue]:
+    # keys holds the values of columns for every item
+    returned = [None] * len(keys)
+    deleting = []
+    for index, key in enumerate(keys):
+        if any(value is not None and type(value) is not int for value in key):
+            returned[index] = ReturnValue.ERROR
+        elif None in key:
+            returned[index] = ReturnValue.NOT_EXISTS
+        else:
+            deleting.append(index)
+    if not deleting:
+        return returned
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
+        if len(columns) == 1:
+            query = sql.SQL("DELETE FROM {table} WHERE {column} = ANY({ids}::INTEGER[]) RETURNING {column}") \
+                .format(table=sql.Identifier(table.lower()), column=sql.Identifier(columns[0]),
+                        ids=sql.Literal([keys[index][0] for index in deleting]))
+        else:
+            query = sql.SQL("DELETE FROM {table} T USING unnest({arrays}) AS R({columns})"
+                            " WHERE {matching} RETURNING {returning}") \
+                .format(table=sql.Identifier(table.lower()),
+                        arrays=sql.SQL(", ").join(sql.SQL("{0}::INTEGER[]").format(
+                            sql.Literal([keys[index][position] for index in deleting]))
+                            for position in range(len(columns))),
+                        columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+                        matching=sql.SQL(" AND ").join(sql.SQL("T.{0} = R.{0}").format(sql.Identifier(column))
+                                                       for column in columns),
+                        returning=sql.SQL(", ").join(sql.SQL("T.") + sql.Identifier(column) for column in columns))
+        _, result = conn.execute(query)
+        deleted = set(result.tuples(*columns))
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        for index in deleting:
+            returned[index] = ReturnValue.ERROR
+        return returned
+    finally:
+        if conn is not None:
+            conn.close()
+    for index in deleting:
+        if keys[index] in deleted:
+            returned[index] = ReturnValue.OK
+            deleted.remove(keys[index])
+        else:
+            returned[index] = ReturnValue.NOT_EXISTS
+    return returned
+
+
+@tuned(BULK)
+def deleteMatches(matches: List[Union[Match, int]], deadline: float = None) -> List[ReturnValue]:
+    match_ids = [_idOf(match) for match in matches]
+    for match_id in match_ids:
+        _forgetProfile(MATCH_PROFILE, match_id)
+    returned = _deleteMany("Matches", ("match_id",), [(match_id,) for match_id in match_ids], deadline)
+    if co_scoring_graph is not None:
+        for match_id, result in zip(match_ids, returned):
+            if result == ReturnValue.OK:
+                co_scoring_graph.removeMatch(match_id)
+    return returned
+
+
+@tuned(BULK)
+def deletePlayers(players: List[Union[Player, int]], deadline: float = None) -> List[ReturnValue]:
+    player_ids = [_idOf(player) for player in players]
+    for player_id in player_ids:
+        _forgetProfile(PLAYER_PROFILE, player_id)
+    returned = _deleteMany("Players", ("player_id",), [(player_id,) for player_id in player_ids], deadline)
+    if co_scoring_graph is not None:
+        for player_id, result in zip(player_ids, returned):
+            if result == ReturnValue.OK:
+                co_scoring_graph.removePlayer(player_id)
+    return returned
+
+
+@tuned(BULK)
+def deleteStadiums(stadiums: List[Union[Stadium, int]], deadline: float = None) -> List[ReturnValue]:
+    stadium_ids = [_idOf(stadium) for stadium in stadiums]
+    for stadium_id in stadium_ids:
+        _forgetProfile(STADIUM_PROFILE, stadium_id)
+    return _deleteMany("Stadiums", ("stadium_id",), [(stadium_id,) for stadium_id in stadium_ids], deadline)
+
+
+@tuned(BULK)
+def playersDidntScoreInMatches(scores: List[Tuple[Union[Match, int], Union[Player, int]]],
+                               deadline: float = None) -> List[ReturnValue]:
+    # scores are (match, player) pairs, as the arguments of playerDidntScoreInMatch
+    keys = [(_idOf(player), _idOf(match)) for match, player in scores]
+    returned = _deleteMany("Player_Scored_In", ("player_id", "match_id"), keys, deadline)
+    if co_scoring_graph is not None:
+        for (player_id, match_id), result in zip(keys, returned):
+            if result == ReturnValue.OK:
+                co_scoring_graph.removeScore(player_id, match_id)
+    return returned
+
+
+@tuned(BULK)
+def matchesNotInStadiums(attendances: List[Tuple[Union[Match, int], Union[Stadium, int]]],
+                         deadline: float = None) -> List[ReturnValue]:
+    # attendances are (match, stadium) pairs, as the arguments of matchNotInStadium
+    return _deleteMany("Played_In", ("match_id", "stadium_id"),
+                       [(_idOf(match), _idOf(stadium)) for match, stadium in attendances], deadline)
+
+
+# an approximate answer: value is in [low, high] with the requested confidence, exact answers have low == high. An
+# error is -1 everywhere with exact False, so it can not be taken for an exact answer
+Estimate = namedtuple("Estimate", ["value", "low", "high", "exact"])
+ESTIMATE_ERROR = Estimate(float(-1), float(-1), float(-1), False)
+
+# approximate averages are computed exactly for stadiums the planner expects to have fewer rows than this (an index
+# only scan of them is as fast as a sample), and from a sample of APPROXIMATE_SAMPLE_ROWS of their rows otherwise
+APPROXIMATE_EXACT_BELOW = 50000
+APPROXIMATE_SAMPLE_ROWS = 10000
+
+# the attendance sample of a stadium: its first rows in the played_in_sample index, read from the index alone
+ATTENDANCE_SAMPLE_QUERY = sql.SQL("SELECT audience_number"
+                                  " FROM Played_In"
+                                  " WHERE stadium_id = {stadium_id}"
+                                  " ORDER BY hashint4(match_id)"
+                                  " LIMIT {rows}")
+
+
+@tuned(LOOKUP)
+def averageAttendanceInStadium(stadiumID: int, deadline: float = None, approximate: bool = False,
+                               confidence: float = 0.95):
+    # with approximate=True the average is an Estimate, see _approximateAverageAttendance
+    if approximate:
+        return _approximateAverageAttendance(stadiumID, confidence, deadline)
+    conn = None
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
         query = sql.SQL("SELECT COALESCE(AVG(audience_number),0) AS avg_to_generate "
                         "FROM Played_In"
                         " WHERE stadium_id = {stadium_id}").format(stadium_id=sql.Literal(stadiumID))
@@ -514,6 +1129,8 @@ def averageAttendanceInStadium(stadiumID: int) -> float:
             return result[0]['avg_to_generate']
     except FloatingPointError:
         return float(0)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except DatabaseException:
         return float(-1)
     finally:
@@ -521,33 +1138,87 @@ def averageAttendanceInStadium(stadiumID: int) -> float:
     return float(0)
 
 
-def stadiumTotalGoals(stadiumID: int) -> int:
+def _approximateAverageAttendance(stadiumID: int, confidence: float, deadline: float) -> Estimate:
+    # the rows of the stadium are estimated by the planner from the table statistics, without reading them. A large
+    # stadium is averaged over the APPROXIMATE_SAMPLE_ROWS of its matches with the lowest hashed ids, which is a
+    # simple random sample of them as long as the attendance has nothing to do with the hash of the id, and it is
+    # read from the stadium's range of an index, so it costs the same however many matches the table holds. The
+    # interval is the normal one of the mean of a sample drawn without replacement, with the finite population
+    # correction. A stadium with fewer rows than the sample was read whole, and its average is exact. A confidence
+    # outside (0, 1) is a bad argument and gives the error Estimate
+    if not 0 < confidence < 1:
+        return ESTIMATE_ERROR
+    conn = None
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        stadium_rows = sql.SQL("SELECT audience_number FROM Played_In WHERE stadium_id = {stadium_id}") \
+            .format(stadium_id=sql.Literal(stadiumID))
+        _, result = conn.execute(sql.SQL("EXPLAIN (FORMAT JSON) ") + stadium_rows)
+        expected = result.rows[0][0][0]["Plan"]["Plan Rows"]
+        if expected >= APPROXIMATE_EXACT_BELOW:
+            query = sql.SQL("SELECT COUNT(*) AS sampled, COALESCE(AVG(audience_number), 0) AS average,"
+                            " STDDEV_SAMP(audience_number) AS deviation"
+                            " FROM ({sample}) S") \
+                .format(sample=ATTENDANCE_SAMPLE_QUERY.format(stadium_id=sql.Literal(stadiumID),
+                                                              rows=sql.Literal(APPROXIMATE_SAMPLE_ROWS)))
+            _, result = conn.execute(query)
+            sampled, average, deviation = result.rows[0]
+            average = float(average)
+            if sampled < APPROXIMATE_SAMPLE_ROWS:
+                return Estimate(average, average, average, True)
+            population = max(expected, sampled)
+            correction = ((population - sampled) / (population - 1)) ** 0.5 if population > 1 else 0.0
+            margin = NormalDist().inv_cdf((1 + confidence) / 2) * float(deviation or 0) / sampled ** 0.5 * correction
+            return Estimate(average, average - margin, average + margin, False)
+        _, result = conn.execute(sql.SQL("SELECT COALESCE(AVG(audience_number), 0) AS average FROM ({rows}) R")
+                                 .format(rows=stadium_rows))
+        average = float(result.rows[0][0])
+        return Estimate(average, average, average, True)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except DatabaseException:
+        return ESTIMATE_ERROR
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+@tuned(LOOKUP)
+def stadiumTotalGoals(stadiumID: int, deadline: float = None, approximate: bool = False):
+    # the total is read from the StadiumGoals counter, which is already as fast as an estimate, so approximate=True
+    # only returns it as an exact Estimate
+    if approximate:
+        goals = stadiumTotalGoals(stadiumID, deadline)
+        return ESTIMATE_ERROR if goals == -1 else Estimate(goals, goals, goals, True)
     conn = None
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("SELECT  COALESCE(SUM(num_of_goals),0) AS sum_of_goals "
-                        "FROM Player_Scored_In M, Played_In P"
-                        " WHERE M.match_id = P.match_id and P.stadium_id = {stadium_id}")\
+        conn = Connector.DBConnector(deadline=deadline)
+        query = sql.SQL("SELECT COALESCE(SUM(goals), 0) AS sum_of_goals "
+                        "FROM StadiumGoals"
+                        " WHERE stadium_id = {stadium_id}")\
             .format(stadium_id=sql.Literal(stadiumID))
         rows_effected, result = conn.execute(query)
         if rows_effected != 0:
             return result[0]['sum_of_goals']
         elif rows_effected == 0:
             return 0
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return -1
     finally:
         conn.close()
 
 
-def playerIsWinner(playerID: int, matchID: int) -> bool:
+@tuned(LOOKUP)
+def playerIsWinner(playerID: int, matchID: int, deadline: float = None) -> bool:
     conn = None
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         query = sql.SQL("SELECT player_id "
-                        "FROM Player_Scored_In P INNER JOIN Goals_Per_Match G "
+                        "FROM Player_Scored_In P INNER JOIN MatchGoals G "
                         " ON P.match_id = G.match_id "
-                        " WHERE P.num_of_goals >= CEILING(G.sum)/2 and P.player_id = {player_id} "
+                        " WHERE P.num_of_goals >= CEILING(G.goals)/2 and P.player_id = {player_id} "
                         "  and P.match_id = {match_id} ")\
             .format(match_id=sql.Literal(matchID), player_id=sql.Literal(playerID))
         rows_effected, result = conn.execute(query)
@@ -555,6 +1226,8 @@ def playerIsWinner(playerID: int, matchID: int) -> bool:
             return True
         elif rows_effected == 0:
             return False
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return False
     finally:
@@ -562,22 +1235,61 @@ def playerIsWinner(playerID: int, matchID: int) -> bool:
     pass
 
 
-def getActiveTallTeams() -> List[int]:
+# the ranked read queries are kept here so getLeagueDashboard runs exactly the same SQL as the single functions
+ACTIVE_TALL_TEAMS_QUERY = sql.SQL("SELECT DISTINCT team_id"
+                                  " FROM ActiveTallTeams "
+                                  "ORDER BY team_id DESC "
+                                  " LIMIT 5")
+
+ACTIVE_TALL_RICH_TEAMS_QUERY = sql.SQL("SELECT A1.team_id"
+                                       " FROM Stadiums S1 INNER JOIN ActiveTallTeams A1 "
+                                       "  ON S1.team_id = A1.team_id "
+                                       "  WHERE S1.capacity > 55000 "
+                                       "ORDER BY A1.team_id ASC "
+                                       " LIMIT 5 ")
+
+POPULAR_TEAMS_QUERY = sql.SQL("SELECT team_id"
+                              " FROM DidntPlayAtHome "
+                              "UNION "
+                              "   SELECT first_team_id "
+                              "   FROM PopularNotEmptyWay "
+                              "ORDER BY team_id DESC "
+                              " LIMIT 10")
+
+# every stadium has a counter row, so ranking the counters ranks all the stadiums
+MOST_ATTRACTIVE_STADIUMS_QUERY = sql.SQL(
+    """
+    SELECT stadium_id
+    FROM StadiumGoals
+    ORDER BY -goals ASC, stadium_id ASC
+    """)
+
+# {team_id} is formatted with a literal, or with a column when the query is correlated in getLeagueDashboard
+MOST_GOALS_FOR_TEAM_QUERY = sql.SQL(
+    """
+    SELECT player_id
+    FROM PlayerGoals
+    WHERE team_id = {team_id}
+    ORDER BY goals DESC, player_id DESC
+    LIMIT 5
+    """)
+
+
+@tuned(ANALYTIC)
+def getActiveTallTeams(deadline: float = None) -> List[int]:
     conn = None
     list_to_return = []
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("SELECT DISTINCT team_id"
-                        " FROM ActiveTallTeams "
-                        "ORDER BY team_id DESC "
-                        " LIMIT 5")
+        conn = Connector.DBConnector(deadline=deadline)
+        query = ACTIVE_TALL_TEAMS_QUERY
         rows_effected, result = conn.execute(query)
         if rows_effected != 0:
-            for row in range(rows_effected):
-                list_to_return.append(result[row]['team_id'])
+            list_to_return = [team_id for team_id, in result.tuples('team_id')]
             return list_to_return
         elif rows_effected == 0:
             return list_to_return
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return list_to_return
     finally:
@@ -585,24 +1297,21 @@ def getActiveTallTeams() -> List[int]:
     pass
 
 
-def getActiveTallRichTeams() -> List[int]:
+@tuned(ANALYTIC)
+def getActiveTallRichTeams(deadline: float = None) -> List[int]:
     conn = None
     list_to_return = []
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("SELECT A1.team_id"
-                        " FROM Stadiums S1 INNER JOIN ActiveTallTeams A1 "
-                        "  ON S1.team_id = A1.team_id "
-                        "  WHERE S1.capacity > 55000 "
-                        "ORDER BY A1.team_id ASC "
-                        " LIMIT 5 ")
+        conn = Connector.DBConnector(deadline=deadline)
+        query = ACTIVE_TALL_RICH_TEAMS_QUERY
         rows_effected, result = conn.execute(query)
         if rows_effected != 0:
-            for row in range(rows_effected):
-                list_to_return.append(result[row]['team_id'])
+            list_to_return = [team_id for team_id, in result.tuples('team_id')]
             return list_to_return
         elif rows_effected == 0:
             return list_to_return
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return list_to_return
     finally:
@@ -610,25 +1319,21 @@ def getActiveTallRichTeams() -> List[int]:
     pass
 
 
-def popularTeams() -> List[int]:
+@tuned(ANALYTIC)
+def popularTeams(deadline: float = None) -> List[int]:
     conn = None
     list_to_return = []
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL("SELECT team_id"
-                        " FROM DidntPlayAtHome "
-                        "UNION "
-                        "   SELECT first_team_id "
-                        "   FROM PopularNotEmptyWay "
-                        "ORDER BY team_id DESC "
-                        " LIMIT 10")
+        conn = Connector.DBConnector(deadline=deadline)
+        query = POPULAR_TEAMS_QUERY
         rows_effected, result = conn.execute(query)
         if rows_effected != 0:
-            for row in range(rows_effected):
-                list_to_return.append(result[row]['team_id'])
+            list_to_return = [team_id for team_id, in result.tuples('team_id')]
             return list_to_return
         elif rows_effected == 0:
             return list_to_return
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return list_to_return
     finally:
@@ -636,56 +1341,49 @@ def popularTeams() -> List[int]:
     pass
 
 
-def getMostAttractiveStadiums() -> List[int]:
+@tuned(ANALYTIC)
+def getMostAttractiveStadiums(deadline: float = None) -> List[int]:
     conn = None
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL(
-            """      
-            SELECT stadium_id, COALESCE(goals, 0) AS goals FROM
-            (
-                GoalsInStadium RIGHT JOIN (
-                    SELECT DISTINCT stadium_id FROM Stadiums
-                ) AS AllStadiums USING (stadium_id)
-            ) ORDER BY goals DESC, stadium_id ASC
-            """)
+        conn = Connector.DBConnector(deadline=deadline)
+        query = MOST_ATTRACTIVE_STADIUMS_QUERY
         _, result_set = conn.execute(query)
         if result_set.isEmpty():
             return []
         return [next(iter(row)) for row in result_set.rows]
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return []
     finally:
         conn.close()
 
-def mostGoalsForTeam(teamID: int) -> List[int]:
+@tuned(LOOKUP)
+def mostGoalsForTeam(teamID: int, deadline: float = None) -> List[int]:
     conn = None
     try:
-        conn = Connector.DBConnector()
-        query = sql.SQL(
-            """      
-            SELECT player_id
-            FROM PlayerGoalsInTeam
-            WHERE team_id = {team_id}
-            ORDER BY goals DESC, player_id DESC
-            LIMIT 5
-            """
-        ).format(team_id=sql.Literal(teamID))
+        conn = Connector.DBConnector(deadline=deadline)
+        query = MOST_GOALS_FOR_TEAM_QUERY.format(team_id=sql.Literal(teamID))
         _, result_set = conn.execute(query)
         if result_set.isEmpty():
             return []
         return [next(iter(row)) for row in result_set.rows]
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         return []
     finally:
         conn.close()
 
 
-def getClosePlayers(playerID: int) -> List[int]:
+@tuned(ANALYTIC)
+def getClosePlayers(playerID: int, deadline: float = None) -> List[int]:
+    if co_scoring_graph is not None:
+        return co_scoring_graph.closePlayers(playerID, limit=10)
     conn = None
     ret = []
     try:
-        conn = Connector.DBConnector()
+        conn = Connector.DBConnector(deadline=deadline)
         query = sql.SQL('''
                         SELECT player_id FROM (SELECT g.player_id, COALESCE(COUNT(*), 0) AS scored
                             FROM (SELECT player_id, match_id FROM Player_Scored_In WHERE player_id={player_id}) pm INNER JOIN Player_Scored_In g USING (match_id)
@@ -698,14 +1396,418 @@ def getClosePlayers(playerID: int) -> List[int]:
                         ORDER BY other_players.player_id
                         ''').format(player_id=sql.Literal(playerID))
         rows_effected, res = conn.execute(query)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
     except Exception as e:
         print(e)
         return []
     finally:
         conn.close()
 
-    size = min(10, rows_effected)
-    for i in range(size):
-        ret.append(res[i]['player_id'])
+    ret = [player_id for player_id, in res.tuples('player_id')[:10]]
+
+    return ret
+
+@tuned(ANALYTIC)
+def getLeagueDashboard(teamIDs: List[int] = None, deadline: float = None) -> dict:
+    # everything the dashboard page shows, read by one statement in a read only transaction, so all the lists come
+    # from the same snapshot and the page pays a single round trip. mostGoalsForTeam maps each requested team to its
+    # list, just like calling mostGoalsForTeam(team) for it
+    conn = None
+    dashboard = {"activeTallTeams": [], "activeTallRichTeams": [], "popularTeams": [], "mostAttractiveStadiums": [],
+                 "mostGoalsForTeam": {}}
+    teamIDs = [] if teamIDs is None else list(teamIDs)
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        query = sql.SQL("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY; "
+                        "SELECT ARRAY({active_tall}) AS active_tall_teams,"
+                        " ARRAY({active_tall_rich}) AS active_tall_rich_teams,"
+                        " ARRAY({popular}) AS popular_teams,"
+                        " ARRAY({attractive}) AS most_attractive_stadiums,"
+                        " (SELECT json_object_agg(requested_team_id, ARRAY({most_goals}))"
+                        "   FROM unnest({team_ids}::INTEGER[]) AS Requested(requested_team_id))"
+                        " AS most_goals_for_team") \
+            .format(active_tall=ACTIVE_TALL_TEAMS_QUERY, active_tall_rich=ACTIVE_TALL_RICH_TEAMS_QUERY,
+                    popular=POPULAR_TEAMS_QUERY, attractive=MOST_ATTRACTIVE_STADIUMS_QUERY,
+                    most_goals=MOST_GOALS_FOR_TEAM_QUERY.format(team_id=sql.Identifier("requested_team_id")),
+                    team_ids=sql.Literal(teamIDs))
+        rows_effected, result = conn.execute(query)
+        if rows_effected != 0:
+            dashboard["activeTallTeams"] = result[0]["active_tall_teams"]
+            dashboard["activeTallRichTeams"] = result[0]["active_tall_rich_teams"]
+            dashboard["popularTeams"] = result[0]["popular_teams"]
+            dashboard["mostAttractiveStadiums"] = result[0]["most_attractive_stadiums"]
+            # json object keys come back as strings
+            most_goals = result[0]["most_goals_for_team"] or {}
+            dashboard["mostGoalsForTeam"] = {int(team): players for team, players in most_goals.items()}
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return dashboard
+    finally:
+        conn.close()
+    return dashboard
+
 
-    return ret
\ No newline at end of file
+@tuned(ANALYTIC)
+def getTallTeams(minHeight: int = 190, minCount: int = 2, activeOnly: bool = True, minCapacity: int = None,
+                 limit: int = 5, ascending: bool = False, deadline: float = None) -> List[int]:
+    # the teams with at least minCount players taller than minHeight, by team id descending (ascending when
+    # ascending is set). activeOnly keeps the teams that played a match, minCapacity the teams whose stadium has more
+    # than minCapacity seats, and limit None lists them all. The defaults give getActiveTallTeams, and
+    # minCapacity=55000 with ascending=True gives getActiveTallRichTeams
+    conn = None
+    conditions = []
+    if activeOnly:
+        conditions.append(sql.SQL("(EXISTS(SELECT 1 FROM Matches M WHERE M.first_team_id = T.team_id)"
+                                  " OR EXISTS(SELECT 1 FROM Matches M WHERE M.second_team_id = T.team_id))"))
+    if minCapacity is not None:
+        conditions.append(sql.SQL("EXISTS(SELECT 1 FROM Stadiums S WHERE S.team_id = T.team_id"
+                                  " AND S.capacity > {min_capacity})").format(min_capacity=sql.Literal(minCapacity)))
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        query = sql.SQL("SELECT team_id"
+                        " FROM (SELECT team_id FROM Players WHERE height > {min_height}"
+                        "  GROUP BY team_id HAVING COUNT(*) >= {min_count}) T"
+                        "{where}"
+                        " ORDER BY team_id {direction}"
+                        " LIMIT {limit}") \
+            .format(min_height=sql.Literal(minHeight), min_count=sql.Literal(minCount),
+                    where=sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+                    direction=sql.SQL("ASC" if ascending else "DESC"), limit=sql.Literal(limit))
+        _, result = conn.execute(query)
+        return [team_id for team_id, in result.tuples('team_id')]
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    finally:
+        conn.close()
+
+
+@tuned(ANALYTIC)
+def getTeamReports(teamIDs: List[int], deadline: float = None) -> dict:
+    # team -> everything a team page shows, for the requested teams that exist, read by one statement:
+    #   "roster"             the team's players, by id
+    #   "topScorers"         mostGoalsForTeam(team)
+    #   "homeMatches", "awayMatches"
+    #   "stadium"            the team's Stadium, None when it has none, and then also None for
+    #   "averageAttendance"  averageAttendanceInStadium(stadium)
+    #   "stadiumGoals"       stadiumTotalGoals(stadium)
+    #   "tall", "active", "popular"   whether the team is in TallTeams, played a match, and is one of the teams
+    #                                 popularTeams picks from (without its limit of 10)
+    # popular follows DidntPlayAtHome and PopularNotEmptyWay for the one team: it hosted no match, or it hosted a
+    # match played in a stadium and every such match had more than 40000 people
+    conn = None
+    reports = {}
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        query = sql.SQL(
+            """
+            SELECT T.team_id, Roster.players, ARRAY({most_goals}) AS top_scorers, Games.home_matches,
+                Games.away_matches, S.stadium_id, S.capacity, Attendance.average_attendance, G.goals AS stadium_goals,
+                Tall.tall,
+                Games.home_matches = 0 OR (Home.played_home AND NOT Home.small_home) AS popular
+            FROM Teams T
+            CROSS JOIN LATERAL (
+                SELECT json_agg(json_build_array({player_columns}) ORDER BY P.player_id) AS players
+                FROM Players P WHERE P.team_id = T.team_id) Roster
+            CROSS JOIN LATERAL (
+                SELECT (SELECT COUNT(*) FROM Matches M WHERE M.first_team_id = T.team_id) AS home_matches,
+                    (SELECT COUNT(*) FROM Matches M WHERE M.second_team_id = T.team_id) AS away_matches) Games
+            CROSS JOIN LATERAL (
+                SELECT COUNT(*) >= 2 AS tall
+                FROM Players P WHERE P.team_id = T.team_id AND P.height > 190) Tall
+            CROSS JOIN LATERAL (
+                SELECT COUNT(*) > 0 AS played_home,
+                    COUNT(*) FILTER (WHERE NOT (I.audience_number > 40000)) > 0 AS small_home
+                FROM Matches M INNER JOIN Played_In I ON I.match_id = M.match_id
+                WHERE M.first_team_id = T.team_id) Home
+            LEFT OUTER JOIN Stadiums S ON S.team_id = T.team_id
+            LEFT OUTER JOIN StadiumGoals G ON G.stadium_id = S.stadium_id
+            LEFT OUTER JOIN LATERAL (
+                SELECT COALESCE(AVG(I.audience_number), 0) AS average_attendance
+                FROM Played_In I WHERE I.stadium_id = S.stadium_id) Attendance ON S.stadium_id IS NOT NULL
+            WHERE T.team_id = ANY({team_ids}::INTEGER[])
+            """).format(most_goals=MOST_GOALS_FOR_TEAM_QUERY.format(team_id=sql.SQL("T.team_id")),
+                        player_columns=sql.SQL(", ").join(sql.SQL("P.") + sql.Identifier(column)
+                                                          for column in PLAYER_COLUMNS),
+                        team_ids=sql.Literal(list(teamIDs)))
+        _, result = conn.execute(query)
+        for team_id, players, top_scorers, home_matches, away_matches, stadium_id, capacity, average_attendance, \
+                stadium_goals, tall, popular in result.tuples("team_id", "players", "top_scorers", "home_matches",
+                                                              "away_matches", "stadium_id", "capacity",
+                                                              "average_attendance", "stadium_goals", "tall",
+                                                              "popular"):
+            reports[team_id] = {
+                "roster": [Player(*player) for player in players or []],
+                "topScorers": top_scorers,
+                "homeMatches": home_matches,
+                "awayMatches": away_matches,
+                "stadium": None if stadium_id is None else Stadium(stadium_id, capacity, team_id),
+                "averageAttendance": average_attendance,
+                "stadiumGoals": stadium_goals,
+                "tall": tall,
+                "active": home_matches + away_matches > 0,
+                "popular": popular,
+            }
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return {}
+    finally:
+        conn.close()
+    return reports
+
+
+def getTeamReport(teamID: int, deadline: float = None) -> dict:
+    # see getTeamReports, None when there is no such team
+    return getTeamReports([teamID], deadline).get(teamID)
+
+
+# the player attributes getPlayerAttributeHistogram can bucket
+PLAYER_ATTRIBUTES = ["age", "height"]
+
+
+@tuned(ANALYTIC)
+def getPlayerAttributeHistogram(attribute: str, buckets: int, teamID: int = None,
+                                deadline: float = None) -> List[Tuple[int, int, int]]:
+    # (low, high, players) for each of buckets equally wide ranges low <= value < high, from the smallest value of
+    # the attribute to the largest, of all the players or of teamID's players only. Empty ranges are listed with 0
+    # players, and there are no ranges at all when there are no players
+    if attribute not in PLAYER_ATTRIBUTES:
+        return []
+    conn = None
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        team_filter = sql.SQL("") if teamID is None else \
+            sql.SQL(" WHERE team_id = {team_id}").format(team_id=sql.Literal(teamID))
+        query = sql.SQL(
+            """
+            WITH Selected AS (SELECT {attribute} AS value FROM Players{team_filter}),
+            Bounds AS (
+                SELECT MIN(value) AS low, CEIL((MAX(value) - MIN(value) + 1)::NUMERIC / {buckets})::INTEGER AS width
+                FROM Selected),
+            Counted AS (
+                SELECT width_bucket(value, B.low, B.low + B.width * {buckets}, {buckets}) AS bucket, COUNT(*) AS players
+                FROM Selected, Bounds B
+                GROUP BY 1)
+            SELECT B.low + (R.bucket - 1) * B.width AS low, B.low + R.bucket * B.width AS high,
+                COALESCE(C.players, 0) AS players
+            FROM Bounds B CROSS JOIN generate_series(1, {buckets}) AS R(bucket)
+                LEFT OUTER JOIN Counted C ON C.bucket = R.bucket
+            WHERE B.low IS NOT NULL
+            ORDER BY R.bucket
+            """).format(attribute=sql.Identifier(attribute), team_filter=team_filter, buckets=sql.Literal(buckets))
+        _, result = conn.execute(query)
+        return result.tuples("low", "high", "players")
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return []
+    finally:
+        conn.close()
+
+
+@tuned(ANALYTIC)
+def getTeamPlayerStats(teamIDs: List[int], deadline: float = None) -> dict:
+    # team -> {"players", "tallPlayers" (taller than 190), "leftFooted", "rightFooted", "heightQuartiles",
+    # "ageQuartiles"}, every requested team is listed. The quartiles are [25th, 50th, 75th] interpolated percentiles,
+    # None for a team without players
+    conn = None
+    stats = {}
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        query = sql.SQL(
+            """
+            SELECT R.team_id, COUNT(P.player_id) AS players,
+                COUNT(*) FILTER (WHERE P.height > 190) AS tall_players,
+                COUNT(*) FILTER (WHERE P.preferred_foot = 'Left') AS left_footed,
+                COUNT(*) FILTER (WHERE P.preferred_foot = 'Right') AS right_footed,
+                percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY P.height) AS height_quartiles,
+                percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY P.age) AS age_quartiles
+            FROM unnest({team_ids}::INTEGER[]) AS R(team_id) LEFT OUTER JOIN Players P USING (team_id)
+            GROUP BY R.team_id
+            """).format(team_ids=sql.Literal(list(teamIDs)))
+        _, result = conn.execute(query)
+        for team_id, players, tall_players, left_footed, right_footed, height_quartiles, age_quartiles in \
+                result.tuples("team_id", "players", "tall_players", "left_footed", "right_footed",
+                              "height_quartiles", "age_quartiles"):
+            stats[team_id] = {"players": players, "tallPlayers": tall_players, "leftFooted": left_footed,
+                              "rightFooted": right_footed, "heightQuartiles": height_quartiles,
+                              "ageQuartiles": age_quartiles}
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return {}
+    finally:
+        conn.close()
+    return stats
+
+
+# the filters of findPlayers: filter key -> condition on the player P and its goal counter G, with a {value}
+# placeholder. The bounds are inclusive
+PLAYER_FILTERS = {
+    "minAge": sql.SQL("P.age >= {value}"),
+    "maxAge": sql.SQL("P.age <= {value}"),
+    "minHeight": sql.SQL("P.height >= {value}"),
+    "maxHeight": sql.SQL("P.height <= {value}"),
+    "preferredFoot": sql.SQL("P.preferred_foot = {value}"),
+    "teamIDs": sql.SQL("P.team_id = ANY({value}::INTEGER[])"),
+    "minGoals": sql.SQL("G.goals >= {value}"),
+    # the player's team played a match of the competition, first or second
+    "competition": sql.SQL("(EXISTS(SELECT 1 FROM Matches M"
+                           "  WHERE M.first_team_id = P.team_id AND M.competition = {value})"
+                           " OR EXISTS(SELECT 1 FROM Matches M"
+                           "  WHERE M.second_team_id = P.team_id AND M.competition = {value}))"),
+}
+
+# the orders of findPlayers, a leading "-" reverses one. Ties are broken by player id
+PLAYER_ORDERS = {
+    "playerID": sql.SQL("P.player_id"),
+    "age": sql.SQL("P.age"),
+    "height": sql.SQL("P.height"),
+    "goals": sql.SQL("G.goals"),
+}
+
+
+@tuned(ANALYTIC)
+def findPlayers(filter: dict = None, orderBy: str = "playerID", limit: int = None, deadline: float = None,
+                batchSize: int = 1000) -> Iterator[Player]:
+    # the players matching every condition of filter (see PLAYER_FILTERS), e.g.
+    #   findPlayers({"minAge": 18, "maxAge": 22, "minHeight": 185, "preferredFoot": "Left",
+    #                "competition": "International", "minGoals": 3}, "-goals", 50)
+    # The players are yielded as they are read, batchSize per round trip, so a scan of the whole league is never held
+    # in memory. An unknown filter or order finds nobody
+    filter = filter or {}
+    if any(key not in PLAYER_FILTERS for key in filter) or orderBy.lstrip("-") not in PLAYER_ORDERS:
+        return
+    conditions = [PLAYER_FILTERS[key].format(value=sql.Literal(value)) for key, value in sorted(filter.items())]
+    query = sql.SQL("SELECT {player_columns}"
+                    " FROM Players P INNER JOIN PlayerGoals G ON G.player_id = P.player_id"
+                    " WHERE {conditions}"
+                    " ORDER BY {order}{direction}, P.player_id"
+                    " LIMIT {limit}") \
+        .format(player_columns=sql.SQL(", ").join(sql.SQL("P.") + sql.Identifier(column) for column in PLAYER_COLUMNS),
+                conditions=sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("TRUE"),
+                order=PLAYER_ORDERS[orderBy.lstrip("-")],
+                direction=sql.SQL(" DESC" if orderBy.startswith("-") else ""), limit=sql.Literal(limit))
+    conn = None
+    try:
+        conn = Connector.DBConnector(deadline=deadline)
+        for row in conn.stream(query, batchSize):
+            yield Player(*row)
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+# the paged versions of the ranked lists return (page, cursor). The cursor is opaque to the caller, it is passed back
+# to get the next page and is None after the last page. A page starts right after the last row of the previous one
+# (keyset paging, no OFFSET), so it costs the same however deep it is
+def _encodeCursor(*last_row) -> str:
+    return base64.urlsafe_b64encode(json.dumps(last_row).encode()).decode()
+
+
+def _decodeCursor(cursor: str) -> list:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+
+def _rankedPage(makeQuery: Callable[[list], sql.Composed], pageSize: int, cursor: str,
+                deadline: float) -> Tuple[List[int], str]:
+    # makeQuery gets the decoded cursor (None for the first page) and selects the id first and then the rest of the
+    # ranking key. One row more than the page is fetched so the last page is known to be the last
+    if pageSize <= 0:
+        return [], None
+    conn = None
+    try:
+        query = makeQuery(None if cursor is None else _decodeCursor(cursor))
+        conn = Connector.DBConnector(deadline=deadline)
+        _, result = conn.execute(query)
+        rows = result.rows
+        page = [row[0] for row in rows[:pageSize]]
+        if len(rows) <= pageSize:
+            return page, None
+        last = rows[pageSize - 1]
+        return page, _encodeCursor(*last[1:], last[0])
+    except DatabaseException.QUERY_TIMEOUT:
+        raise
+    except Exception as e:
+        return [], None
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+@tuned(LOOKUP)
+def getMostAttractiveStadiumsPage(pageSize: int, cursor: str = None,
+                                  deadline: float = None) -> Tuple[List[int], str]:
+    def makeQuery(last):
+        after = sql.SQL("TRUE")
+        if last is not None:
+            goals, stadium_id = last
+            after = sql.SQL("(-goals, stadium_id) > ({goals}, {stadium_id})") \
+                .format(goals=sql.Literal(-int(goals)), stadium_id=sql.Literal(int(stadium_id)))
+        return sql.SQL("SELECT stadium_id, goals FROM StadiumGoals"
+                       " WHERE {after}"
+                       " ORDER BY -goals ASC, stadium_id ASC"
+                       " LIMIT {limit}").format(after=after, limit=sql.Literal(pageSize + 1))
+    return _rankedPage(makeQuery, pageSize, cursor, deadline)
+
+
+@tuned(LOOKUP)
+def mostGoalsForTeamPage(teamID: int, pageSize: int, cursor: str = None,
+                         deadline: float = None) -> Tuple[List[int], str]:
+    def makeQuery(last):
+        after = sql.SQL("TRUE")
+        if last is not None:
+            goals, player_id = last
+            after = sql.SQL("(goals, player_id) < ({goals}, {player_id})") \
+                .format(goals=sql.Literal(int(goals)), player_id=sql.Literal(int(player_id)))
+        return sql.SQL("SELECT player_id, goals FROM PlayerGoals"
+                       " WHERE team_id = {team_id} AND {after}"
+                       " ORDER BY goals DESC, player_id DESC"
+                       " LIMIT {limit}").format(team_id=sql.Literal(teamID), after=after,
+                                                limit=sql.Literal(pageSize + 1))
+    return _rankedPage(makeQuery, pageSize, cursor, deadline)
+
+
+@tuned(LOOKUP)
+def popularTeamsPage(pageSize: int, cursor: str = None, deadline: float = None) -> Tuple[List[int], str]:
+    def makeQuery(last):
+        before_team, before_first_team = sql.SQL("TRUE"), sql.SQL("TRUE")
+        if last is not None:
+            team_id, = last
+            before_team = sql.SQL("team_id < {0}").format(sql.Literal(int(team_id)))
+            before_first_team = sql.SQL("first_team_id < {0}").format(sql.Literal(int(team_id)))
+        # the bound goes into both sides of the UNION so each side stops early on its own
+        return sql.SQL("SELECT team_id"
+                       " FROM DidntPlayAtHome "
+                       " WHERE {before_team} "
+                       "UNION "
+                       "   SELECT first_team_id "
+                       "   FROM PopularNotEmptyWay "
+                       "   WHERE {before_first_team} "
+                       "ORDER BY team_id DESC "
+                       " LIMIT {limit}").format(before_team=before_team, before_first_team=before_first_team,
+                                                limit=sql.Literal(pageSize + 1))
+    return _rankedPage(makeQuery, pageSize, cursor, deadline)
+
+
+@tuned(LOOKUP)
+def getActiveTallTeamsPage(pageSize: int, cursor: str = None, deadline: float = None) -> Tuple[List[int], str]:
+    def makeQuery(last):
+        before = sql.SQL("TRUE")
+        if last is not None:
+            team_id, = last
+            before = sql.SQL("team_id < {0}").format(sql.Literal(int(team_id)))
+        return sql.SQL("SELECT DISTINCT team_id"
+                       " FROM ActiveTallTeams "
+                       " WHERE {before} "
+                       "ORDER BY team_id DESC "
+                       " LIMIT {limit}").format(before=before, limit=sql.Literal(pageSize + 1))
+    return _rankedPage(makeQuery, pageSize, cursor, deadline)
@@ -0,0 +1,311 @@
+import argparse
+import contextlib
+import functools
+import inspect
+import io
+import itertools
+import json
+import os
+import runpy
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import List
+import Utility.DBConnector as Connector
+from Utility.ReturnValue import ReturnValue
+import Solution
+from Business.Match import Match
+from Business.Player import Player
+from Business.Stadium import Stadium
+from LoadGenerator import percentile
+
+# Capture of the Solution calls of a real workload, and their replay against a database.
+# While a WorkloadRecorder is started every public Solution call is appended to its trace file as one JSON line:
+#   {"t": start time (epoch seconds), "f": function, "a": [arguments], "k": {keyword arguments},
+#    "ms": latency in milliseconds, "r": result}            ("e": exception class instead of "r" if it raised)
+# A stream (a generator function) is recorded with the items that were read, its "ms" is the time spent producing
+# them and not the time of whoever read them, and "done": true if it was read to the end.
+# Business objects, ReturnValues, Decimals, tuples and dicts with non string keys are encoded as one key objects,
+# e.g. {"P": [1, 1, 20, 180, "Left"]} or {"R": "OK"}. Only the outermost call is recorded (a Solution function that
+# calls another one is one call), and calls with arguments or results that can not be encoded (e.g. a ResultSet)
+# are left out.
+#
+#   with WorkloadRecorder("trace.jsonl"):
+#       ...
+#
+#   python Workload.py record trace.jsonl                          # records a run of main.py
+#   python Workload.py replay trace.jsonl --speed 2 --concurrency 4 --section shard0
+#
+# The replay sends the calls at the recorded pace (--speed N for N times faster, --speed 0 as fast as possible) on
+# --concurrency threads, and reports per function the recorded and replayed latencies and the calls whose result
+# differs from the recorded one. The target database should start in the state the recording started in. With more
+# than one thread calls may overtake each other, and a call that depends on an earlier one may then differ.
+
+BUSINESS_TYPES = {
+    "M": (Match, lambda match: [match.getMatchID(), match.getCompetition(), match.getHomeTeamID(),
+                                match.getAwayTeamID()]),
+    "P": (Player, lambda player: [player.getPlayerID(), player.getTeamID(), player.getAge(), player.getHeight(),
+                                  player.getFoot()]),
+    "S": (Stadium, lambda stadium: [stadium.getStadiumID(), stadium.getCapacity(), stadium.getBelongsTo()]),
+}
+
+
+def encode(value):
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    if isinstance(value, ReturnValue):
+        return {"R": value.name}
+    if isinstance(value, Decimal):
+        return {"D": str(value)}
+    for key, (cls, fields) in BUSINESS_TYPES.items():
+        if isinstance(value, cls):
+            return {key: encode(fields(value))}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, tuple):
+        return {"T": [encode(item) for item in value]}
+    if isinstance(value, dict):
+        return {"K": [[encode(key), encode(item)] for key, item in value.items()]}
+    raise TypeError(f"can not encode a {type(value).__name__}")
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    (key, encoded), = value.items()
+    if key == "R":
+        return ReturnValue[encoded]
+    if key == "D":
+        return Decimal(encoded)
+    if key in BUSINESS_TYPES:
+        return BUSINESS_TYPES[key][0](*decode(encoded))
+    if key == "T":
+        return tuple(decode(item) for item in encoded)
+    return {decode(item_key): decode(item) for item_key, item in encoded}
+
+
+class WorkloadRecorder:
+    # appends to path, so one trace can span several recordings
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.running = threading.local()
+        self.file = None
+        self.originals = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.file = open(self.path, "a")
+        self.originals = {name: fn for name, fn in vars(Solution).items()
+                          if inspect.isfunction(fn) and fn.__module__ == Solution.__name__
+                          and not name.startswith("_")}
+        for name, fn in self.originals.items():
+            setattr(Solution, name, self.__recorded(name, fn))
+
+    def stop(self):
+        for name, fn in self.originals.items():
+            setattr(Solution, name, fn)
+        self.originals = {}
+        with self.lock:
+            self.file.close()
+
+    def __write(self, name: str, args: tuple, kwargs: dict, start: float, elapsed: float, result=None,
+                error: Exception = None, done: bool = False):
+        try:
+            call = {"t": start, "f": name, "a": encode(list(args)), "k": {key: encode(value)
+                                                                          for key, value in kwargs.items()},
+                    "ms": round(elapsed * 1000, 3)}
+            if error is None:
+                call["r"] = encode(result)
+            else:
+                call["e"] = type(error).__name__
+            if done:
+                call["done"] = True
+        except TypeError:
+            return
+        line = json.dumps(call, separators=(",", ":")) + "\n"
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line)
+
+    def __recorded(self, name: str, fn):
+        if inspect.isgeneratorfunction(fn):
+            # a stream is recorded when it is read to the end or closed, with the items that were read. Only the time
+            # inside the stream is counted, the reader's time between two items is not
+            @functools.wraps(fn)
+            def streaming(*args, **kwargs):
+                if getattr(self.running, "depth", 0):
+                    yield from fn(*args, **kwargs)
+                    return
+                start = time.time()
+                rows = fn(*args, **kwargs)
+                items = []
+                error = None
+                done = False
+                elapsed = 0.0
+                try:
+                    while True:
+                        # the stream runs whenever it is resumed, what it calls then is part of it
+                        self.running.depth = 1
+                        started = time.perf_counter()
+                        try:
+                            item = next(rows)
+                        except StopIteration:
+                            done = True
+                            break
+                        finally:
+                            elapsed += time.perf_counter() - started
+                            self.running.depth = 0
+                        items.append(item)
+                        yield item
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    rows.close()
+                    self.__write(name, args, kwargs, start, elapsed, items, error, done)
+            return streaming
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            depth = getattr(self.running, "depth", 0)
+            if depth:
+                return fn(*args, **kwargs)
+            self.running.depth = 1
+            start, started = time.time(), time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.__write(name, args, kwargs, start, time.perf_counter() - started, error=e)
+                raise
+            finally:
+                self.running.depth = 0
+            self.__write(name, args, kwargs, start, time.perf_counter() - started, result)
+            return result
+        return call
+
+
+def readTrace(path: str) -> List[dict]:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def replayTrace(calls: List[dict], speed: float = 1.0, concurrency: int = 1, section: str = None) -> List[dict]:
+    # replays the calls in trace order and returns for each one {"ms": latency, "r": result} (or "e"), encoded as in
+    # the trace. While paced (speed > 0) a call's latency is measured from its planned send time, so a server that
+    # falls behind shows up in the latencies instead of slowing the replay down. speed 0 sends every call as soon as
+    # a thread is free
+    section = Connector.currentSection() if section is None else section
+    replayed = [None] * len(calls)
+    pending = iter(enumerate(calls))
+    lock = threading.Lock()
+    first = calls[0]["t"] if calls else 0
+    start = time.monotonic()
+
+    def replay():
+        with Connector.useSection(section):
+            while True:
+                with lock:
+                    index, call = next(pending, (None, None))
+                if call is None:
+                    return
+                planned = start + (call["t"] - first) / speed if speed > 0 else time.monotonic()
+                if planned > time.monotonic():
+                    time.sleep(planned - time.monotonic())
+                outcome = {}
+                try:
+                    result = getattr(Solution, call["f"])(*decode(call["a"]),
+                                                          **{key: decode(value) for key, value in call["k"].items()})
+                    if inspect.isgenerator(result):
+                        # a stream that was read to the end is read to the end again, one that was closed early as
+                        # far as it was read
+                        if call.get("done"):
+                            result = list(result)
+                        else:
+                            result, rows = list(itertools.islice(result, len(call.get("r") or []))), result
+                            rows.close()
+                    outcome["r"] = json.loads(json.dumps(encode(result)))
+                except Exception as e:
+                    outcome["e"] = type(e).__name__
+                outcome["ms"] = (time.monotonic() - planned) * 1000
+                replayed[index] = outcome
+
+    threads = [threading.Thread(target=replay) for _ in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return replayed
+
+
+def mismatches(calls: List[dict], replayed: List[dict]) -> List[int]:
+    # the indexes of the calls whose result (or exception) differs from the recorded one
+    return [index for index, (call, outcome) in enumerate(zip(calls, replayed))
+            if (call.get("r"), call.get("e")) != (outcome.get("r"), outcome.get("e"))]
+
+
+def report(calls: List[dict], replayed: List[dict], shown: int = 10) -> str:
+    recorded, latencies, different = defaultdict(list), defaultdict(list), defaultdict(int)
+    differing = mismatches(calls, replayed)
+    for call, outcome in zip(calls, replayed):
+        recorded[call["f"]].append(call["ms"])
+        latencies[call["f"]].append(outcome["ms"])
+    for index in differing:
+        different[calls[index]["f"]] += 1
+    lines = [f"{'function':28}{'calls':>7}{'rec p50':>10}{'rec p99':>10}{'p50':>10}{'p99':>10}{'p50 x':>8}"
+             f"{'differ':>8}"]
+    for name in sorted(recorded, key=lambda function: -len(recorded[function])):
+        before, after = recorded[name], latencies[name]
+        ratio = percentile(after, 0.5) / percentile(before, 0.5) if percentile(before, 0.5) else 0.0
+        lines.append(f"{name:28}{len(before):>7}{percentile(before, 0.5):>10.2f}{percentile(before, 0.99):>10.2f}"
+                     f"{percentile(after, 0.5):>10.2f}{percentile(after, 0.99):>10.2f}{ratio:>8.2f}"
+                     f"{different[name]:>8}")
+    lines.append(f"{len(calls)} calls, {len(differing)} with a different result (latencies in ms)")
+    for index in differing[:shown]:
+        call, outcome = calls[index], replayed[index]
+        lines.append(f"  #{index} {call['f']}{tuple(decode(call['a']))}: recorded "
+                     f"{call.get('r', call.get('e'))}, replayed {outcome.get('r', outcome.get('e'))}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the Solution calls of a run, or replay a recorded trace")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="run a scenario and append its calls to the trace")
+    record.add_argument("trace")
+    record.add_argument("--scenario", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                        help="the script to run, main.py by default")
+    record.add_argument("--show-output", action="store_true", help="do not hide what the scenario prints")
+    replay = commands.add_parser("replay", help="replay the trace and compare it with the recording")
+    replay.add_argument("trace")
+    replay.add_argument("--speed", type=float, default=1.0, help="N times the recorded pace, 0 as fast as possible")
+    replay.add_argument("--concurrency", type=int, default=1)
+    replay.add_argument("--section", help="the database.ini section of the database to replay against")
+    replay.add_argument("--mismatches", type=int, default=10, help="how many differing calls to list")
+    arguments = parser.parse_args()
+
+    if arguments.command == "record":
+        output = contextlib.nullcontext() if arguments.show_output else contextlib.redirect_stdout(io.StringIO())
+        with WorkloadRecorder(arguments.trace), output:
+            # the scenario imports the (recorded) Solution functions itself
+            runpy.run_path(arguments.scenario, run_name="__main__")
+        print(f"{len(readTrace(arguments.trace))} calls in {arguments.trace}")
+    else:
+        calls = readTrace(arguments.trace)
+        start = time.monotonic()
+        replayed = replayTrace(calls, arguments.speed, arguments.concurrency, arguments.section)
+        print(f"replayed in {time.monotonic() - start:.1f}s")
+        print(report(calls, replayed, arguments.mismatches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from psycopg2 import sql
+import Utility.DBConnector as Connector
+from Utility.ReturnValue import ReturnValue
+import Solution
+from Business.Match import Match
+from Business.Player import Player
+from Business.Stadium import Stadium
+
+# Write-behind queue for playerScoredInMatch and matchInStadium.
+# The calls return a Future at once and a background thread writes them in batches, one transaction (and so one
+# commit) per batch. A batch is written when it reaches max_batch calls or when its first call has waited max_delay
+# seconds. Each future resolves to the ReturnValue the direct call would have returned.
+#
+#   with WriteBehindQueue() as writes:
+#       future = writes.playerScoredInMatch(match, player, 2)
+#       ...
+#       future.result()     # ReturnValue.OK
+#
+# When max_pending calls are waiting the callers block until the writer catches up. If a batch fails as a whole
+# (e.g. a referenced row was deleted while it was written) its calls are retried one by one with the direct calls.
+
+SCORE = "score"
+ATTENDANCE = "attendance"
+
+
+class WriteBehindQueue:
+    def __init__(self, max_batch: int = 500, max_delay: float = 0.05, max_pending: int = 10000):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.writer = threading.Thread(target=self.__run, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def playerScoredInMatch(self, match: Match, player: Player, amount: int) -> Future:
+        return self.__submit(SCORE, (player.getPlayerID(), match.getMatchID(), amount), (match, player, amount))
+
+    def matchInStadium(self, match: Match, stadium: Stadium, attendance: int) -> Future:
+        return self.__submit(ATTENDANCE, (match.getMatchID(), stadium.getStadiumID(), attendance),
+                             (match, stadium, attendance))
+
+    def flush(self):
+        # waits until every call submitted before it is written
+        done = Future()
+        self.pending.put((None, None, None, done))
+        done.result()
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.writer.join()
+
+    def __submit(self, kind: str, values: tuple, args: tuple) -> Future:
+        future = Future()
+        self.pending.put((kind, values, args, future))
+        return future
+
+    def __run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            closing = False
+            batch_deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.pending.get(timeout=max(0.0, batch_deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self.__write([item for item in batch if item[0] is not None])
+            for kind, _, _, future in batch:
+                if kind is None:
+                    future.set_result(None)
+            if closing:
+                return
+
+    def __write(self, batch: list):
+        if not batch:
+            return
+        # the calls a CHECK constraint or a NOT NULL would reject, or with values that are not plain ids, are answered
+        # by the direct call. Of several calls for the same row only the first one is written
+        direct, sent, first_of, repeated = [], [], {}, []
+        for item in batch:
+            kind, values, _, _ = item
+            key = (kind, values[0]) if kind == ATTENDANCE else (kind, values[0], values[1])
+            if not all(type(value) is int for value in values) or \
+                    (kind == SCORE and values[2] <= 0) or (kind == ATTENDANCE and values[2] < 0):
+                direct.append(item)
+            elif key in first_of:
+                repeated.append((item, first_of[key]))
+            else:
+                first_of[key] = len(sent)
+                sent.append(item)
+        results = []
+        if sent:
+            try:
+                results = self.__insert(sent)
+            except Exception as e:
+                direct += sent
+        for item, result in zip(sent, results):
+            item[3].set_result(result)
+        # after a first call that went in (or found the row there) a repeat finds the row. A repeat of a call that
+        # missed a referenced row may reference other rows (another stadium), so it is made on its own
+        for item, first in repeated:
+            if not results or results[first] == ReturnValue.NOT_EXISTS:
+                direct.append(item)
+            else:
+                item[3].set_result(ReturnValue.ALREADY_EXISTS)
+        for kind, _, args, future in direct:
+            call = Solution.playerScoredInMatch if kind == SCORE else Solution.matchInStadium
+            try:
+                future.set_result(call(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    @staticmethod
+    def __insert(items: list) -> list:
+        # one transaction for the whole batch, a statement per table: every call is classified against the table as
+        # it is (is the row already there, do the rows it references exist) and the ones that can go in are inserted.
+        # A row that another session inserted meanwhile is skipped by ON CONFLICT and reported as ALREADY_EXISTS.
+        # The tables get separate statements because the goal counter triggers of a statement run after all of its
+        # rows are in, a score and a Played_In row of the same match written together would both count the goals
+        scores = [(seq,) + item[1] for seq, item in enumerate(items) if item[0] == SCORE]
+        attendances = [(seq,) + item[1] for seq, item in enumerate(items) if item[0] == ATTENDANCE]
+        statements = [sql.SQL("CREATE TEMPORARY TABLE BatchResults(seq INTEGER, taken BOOLEAN, refs_ok BOOLEAN,"
+                              " inserted BOOLEAN) ON COMMIT DROP")]
+        if scores:
+            statements.append(sql.SQL(
+                "WITH ScoreBatch(seq, player_id, match_id, num_of_goals) AS (VALUES {rows}),"
+                " ScoreClassified AS ("
+                "  SELECT B.*,"
+                "   EXISTS(SELECT 1 FROM Player_Scored_In S"
+                "    WHERE S.player_id = B.player_id AND S.match_id = B.match_id) AS taken,"
+                "   EXISTS(SELECT 1 FROM Players P WHERE P.player_id = B.player_id)"
+                "    AND EXISTS(SELECT 1 FROM Matches M WHERE M.match_id = B.match_id) AS refs_ok"
+                "  FROM ScoreBatch B),"
+                " ScoreInserted AS ("
+                "  INSERT INTO Player_Scored_In(player_id, match_id, num_of_goals)"
+                "  SELECT player_id, match_id, num_of_goals FROM ScoreClassified WHERE refs_ok AND NOT taken"
+                "  ON CONFLICT DO NOTHING"
+                "  RETURNING player_id, match_id)"
+                " INSERT INTO BatchResults"
+                " SELECT C.seq, C.taken, C.refs_ok, I.player_id IS NOT NULL"
+                " FROM ScoreClassified C LEFT OUTER JOIN ScoreInserted I USING (player_id, match_id)")
+                .format(rows=WriteBehindQueue.__rows(scores)))
+        if attendances:
+            statements.append(sql.SQL(
+                "WITH AttendanceBatch(seq, match_id, stadium_id, audience_number) AS (VALUES {rows}),"
+                " AttendanceClassified AS ("
+                "  SELECT B.*,"
+                "   EXISTS(SELECT 1 FROM Played_In P WHERE P.match_id = B.match_id) AS taken,"
+                "   EXISTS(SELECT 1 FROM Matches M WHERE M.match_id = B.match_id)"
+                "    AND EXISTS(SELECT 1 FROM Stadiums S WHERE S.stadium_id = B.stadium_id) AS refs_ok"
+                "  FROM AttendanceBatch B),"
+                " AttendanceInserted AS ("
+                "  INSERT INTO Played_In(match_id, stadium_id, audience_number)"
+                "  SELECT match_id, stadium_id, audience_number FROM AttendanceClassified WHERE refs_ok AND NOT taken"
+                "  ON CONFLICT DO NOTHING"
+                "  RETURNING match_id)"
+                " INSERT INTO BatchResults"
+                " SELECT C.seq, C.taken, C.refs_ok, I.match_id IS NOT NULL"
+                " FROM AttendanceClassified C LEFT OUTER JOIN AttendanceInserted I USING (match_id)")
+                .format(rows=WriteBehindQueue.__rows(attendances)))
+        statements.append(sql.SQL("SELECT seq, taken, refs_ok, inserted FROM BatchResults"))
+        query = sql.SQL("; ").join(statements)
+        conn = None
+        try:
+            conn = Connector.DBConnector()
+            _, result = conn.execute(query)
+            rows = result.tuples("seq", "taken", "refs_ok", "inserted")
+        finally:
+            if conn is not None:
+                conn.close()
+
+        # the same precedence as the direct calls: the primary key is checked before the foreign keys
+        returned = [None] * len(items)
+        for seq, taken, refs_ok, inserted in rows:
+            if taken:
+                returned[seq] = ReturnValue.ALREADY_EXISTS
+            elif not refs_ok:
+                returned[seq] = ReturnValue.NOT_EXISTS
+            elif inserted:
+                returned[seq] = ReturnValue.OK
+            else:
+                returned[seq] = ReturnValue.ALREADY_EXISTS
+        if Solution.co_scoring_graph is not None:
+            for seq, player_id, match_id, _ in scores:
+                if returned[seq] == ReturnValue.OK:
+                    Solution.co_scoring_graph.addScore(player_id, match_id)
+        return returned
+
+    @staticmethod
+    def __rows(rows: list) -> sql.Composed:
+        return sql.SQL(", ").join(sql.SQL("({0})").format(sql.SQL(", ").join(map(sql.Literal, row))) for row in rows)